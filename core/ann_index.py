@@ -0,0 +1,635 @@
+import os
+import threading
+import time
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from core.models import VideoEmbedding, ContentEmbedding
+from core.embedding_store import ENCODED_FIELDS, decode_rows
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    faiss = None
+    FAISS_AVAILABLE = False
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_NPROBE = 8  # Number of inverted lists probed per query
+FLAT_INDEX_THRESHOLD = 10000  # Below this many vectors an exact flat index is used
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_SIZE = 50000  # Maximum number of vectors used to train the coarse quantizer
+RELOAD_CHECK_INTERVAL = 60  # Seconds between checks for a newer index file on disk
+MERGE_BATCH_SIZE = 256  # Pending writes merged into a FAISS index at once
+MERGE_INTERVAL = 30  # Seconds a pending write may wait before the next write merges it
+CONTENT_ID_SHIFT = 32  # Content index ids are (content_type_id << 32) | object_id
+
+
+def get_index_dir():
+    """Directory where ANN index files are persisted"""
+    base_dir = getattr(settings, 'RECOMMENDER_DATA_DIR', os.path.join(settings.BASE_DIR, 'recommender_data'))
+    return os.path.join(base_dir, 'ann')
+
+
+def normalize_rows(vectors):
+    """L2-normalise rows so inner product equals cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def encode_content_id(content_type_id, object_id):
+    """Pack a (content type, object id) pair into a single int64 index id"""
+    return (int(content_type_id) << CONTENT_ID_SHIFT) | int(object_id)
+
+
+def decode_content_id(index_id):
+    """Unpack an index id into (content_type_id, object_id)"""
+    index_id = int(index_id)
+    return index_id >> CONTENT_ID_SHIFT, index_id & ((1 << CONTENT_ID_SHIFT) - 1)
+
+
+def _filter_mask(ids, filter):
+    """
+    Evaluate a search filter against an array of ids
+
+    Args:
+        ids (numpy.ndarray): Candidate ids
+        filter: None, a callable returning a boolean mask, or a collection of allowed ids
+
+    Returns:
+        numpy.ndarray or None: Boolean mask, or None if everything is allowed
+    """
+    if filter is None:
+        return None
+    if callable(filter):
+        return np.asarray(filter(ids), dtype=bool)
+    if isinstance(filter, (set, frozenset)):
+        filter = np.fromiter(filter, dtype=np.int64, count=len(filter))
+    return np.isin(ids, np.asarray(filter, dtype=np.int64))
+
+
+def _top_k(ids, scores, k):
+    """Return the k best (ids, scores) in descending order"""
+    if len(ids) > k:
+        selected = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[selected], scores[selected]
+    order = np.argsort(-scores, kind='stable')
+    return ids[order], scores[order]
+
+
+class NumpyIVFIndex:
+    """
+    Inverted-file index over unit vectors implemented with NumPy.
+
+    Vectors are assigned to the nearest of `nlist` spherical k-means centroids and a
+    query only scores the vectors in its `nprobe` closest lists. Used when FAISS is
+    not installed.
+
+    Each list is an (ids, vectors) pair that writers replace as a whole, so
+    searches can run without a lock while vectors are added or removed.
+    """
+    supports_concurrent_search = True
+
+    def __init__(self, dimension, nlist=1):
+        self.dimension = dimension
+        self.nlist = max(1, nlist)
+        self.centroids = np.zeros((0, dimension), dtype=np.float32)
+        self.lists = []
+        self.id_to_list = {}
+
+    @property
+    def list_ids(self):
+        return [list_ids for list_ids, _ in self.lists]
+
+    @property
+    def list_vectors(self):
+        return [list_vectors for _, list_vectors in self.lists]
+
+    def __len__(self):
+        return len(self.id_to_list)
+
+    @property
+    def is_trained(self):
+        return len(self.centroids) > 0
+
+    def train(self, vectors, seed=0):
+        """Learn the coarse quantizer with spherical k-means"""
+        rng = np.random.default_rng(seed)
+        if len(vectors) > KMEANS_SAMPLE_SIZE:
+            vectors = vectors[rng.choice(len(vectors), KMEANS_SAMPLE_SIZE, replace=False)]
+
+        nlist = min(self.nlist, len(vectors)) or 1
+        if len(vectors) == 0:
+            centroids = np.zeros((1, self.dimension), dtype=np.float32)
+        else:
+            centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+            for _ in range(KMEANS_ITERATIONS):
+                assignments = np.argmax(vectors @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignments, vectors)
+                empty = np.bincount(assignments, minlength=nlist) == 0
+                # Re-seed empty clusters with random points
+                sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+                centroids = normalize_rows(sums)
+
+        self.centroids = centroids.astype(np.float32)
+        self.nlist = len(self.centroids)
+        self.lists = [
+            (np.zeros(0, dtype=np.int64), np.zeros((0, self.dimension), dtype=np.float32))
+            for _ in range(self.nlist)
+        ]
+        self.id_to_list = {}
+
+    def add(self, ids, vectors):
+        """Add (or replace) unit vectors"""
+        ids = np.asarray(ids, dtype=np.int64)
+        self.remove(ids)
+
+        assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+        for list_no in np.unique(assignments):
+            mask = assignments == list_no
+            list_ids, list_vectors = self.lists[list_no]
+            self.lists[list_no] = (np.concatenate([list_ids, ids[mask]]), np.vstack([list_vectors, vectors[mask]]))
+            for index_id in ids[mask].tolist():
+                self.id_to_list[index_id] = int(list_no)
+
+    def remove(self, ids):
+        """Remove vectors by id; unknown ids are ignored"""
+        by_list = {}
+        for index_id in np.asarray(ids, dtype=np.int64).tolist():
+            list_no = self.id_to_list.pop(index_id, None)
+            if list_no is not None:
+                by_list.setdefault(list_no, []).append(index_id)
+
+        for list_no, removed in by_list.items():
+            list_ids, list_vectors = self.lists[list_no]
+            keep = ~np.isin(list_ids, removed)
+            self.lists[list_no] = (list_ids[keep], list_vectors[keep])
+
+    def search(self, query, k, filter=None, nprobe=DEFAULT_NPROBE):
+        """Search the `nprobe` closest lists, widening the probe if too few results pass the filter"""
+        centroid_order = np.argsort(-(self.centroids @ query))
+        nprobe = max(1, min(nprobe, self.nlist))
+
+        while True:
+            probed = [self.lists[list_no] for list_no in centroid_order[:nprobe]]
+            ids = np.concatenate([list_ids for list_ids, _ in probed])
+            vectors = np.vstack([list_vectors for _, list_vectors in probed])
+
+            mask = _filter_mask(ids, filter)
+            if mask is not None:
+                ids, vectors = ids[mask], vectors[mask]
+
+            if len(ids) >= k or nprobe >= self.nlist:
+                break
+            nprobe = min(self.nlist, nprobe * 2)
+
+        return _top_k(ids, vectors @ query, k)
+
+    def save(self, path):
+        ids = np.concatenate(self.list_ids) if self.list_ids else np.zeros(0, dtype=np.int64)
+        vectors = np.vstack(self.list_vectors) if self.list_vectors else np.zeros((0, self.dimension), dtype=np.float32)
+        assignments = np.concatenate([
+            np.full(len(list_ids), list_no, dtype=np.int32)
+            for list_no, list_ids in enumerate(self.list_ids)
+        ]) if self.list_ids else np.zeros(0, dtype=np.int32)
+        with open(path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, ids=ids, vectors=vectors, assignments=assignments)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        centroids = data['centroids']
+        index = cls(centroids.shape[1], len(centroids))
+        index.centroids = centroids
+        ids, vectors, assignments = data['ids'], data['vectors'], data['assignments']
+
+        # Group rows by list with one sort instead of one scan per list
+        order = np.argsort(assignments, kind='stable')
+        boundaries = np.searchsorted(assignments[order], np.arange(1, len(centroids)))
+        index.lists = list(zip(np.split(ids[order], boundaries), np.split(vectors[order], boundaries)))
+        index.id_to_list = dict(zip(ids.tolist(), assignments.tolist()))
+        return index
+
+
+class FaissIndex:
+    """
+    FAISS-backed index over unit vectors (inner product metric).
+
+    Small collections use an exact flat index; larger ones an IVF index.
+    FAISS indexes must not be modified while they are searched, so ANNIndex
+    collects writes and merges them into a copy in batches.
+    """
+    supports_concurrent_search = False
+
+    def __init__(self, dimension, nlist=1):
+        self.dimension = dimension
+        self.nlist = max(1, nlist)
+        self.index = None
+
+    def __len__(self):
+        return 0 if self.index is None else self.index.ntotal
+
+    @property
+    def is_trained(self):
+        return self.index is not None and self.index.is_trained
+
+    def train(self, vectors, seed=0):
+        if len(vectors) < FLAT_INDEX_THRESHOLD:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+        else:
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            self.index = faiss.IndexIVFFlat(quantizer, self.dimension, self.nlist, faiss.METRIC_INNER_PRODUCT)
+            self.index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def copy(self):
+        clone = FaissIndex(self.dimension, self.nlist)
+        clone.index = faiss.clone_index(self.index)
+        return clone
+
+    def add(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        self.remove(ids)
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+
+    def remove(self, ids):
+        self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def search(self, query, k, filter=None, nprobe=DEFAULT_NPROBE):
+        # Per-call parameters, so concurrent searches never change the shared index
+        params = faiss.SearchParametersIVF(nprobe=nprobe) if hasattr(self.index, 'nprobe') else None
+
+        # Over-fetch and filter afterwards, widening until enough results pass
+        fetch = k
+        while True:
+            fetch = min(fetch, len(self))
+            scores, ids = self.index.search(query.reshape(1, -1).astype(np.float32), fetch, params=params)
+            scores, ids = scores[0], ids[0]
+            valid = ids >= 0
+            ids, scores = ids[valid], scores[valid]
+
+            mask = _filter_mask(ids, filter)
+            if mask is not None:
+                ids, scores = ids[mask], scores[mask]
+
+            if len(ids) >= k or fetch >= len(self):
+                break
+            fetch *= 4
+
+        return ids[:k], scores[:k]
+
+    def save(self, path):
+        faiss.write_index(self.index, path)
+
+    @classmethod
+    def load(cls, path):
+        raw = faiss.read_index(path)
+        index = cls(raw.d, getattr(raw, 'nlist', 1))
+        index.index = raw
+        return index
+
+
+class PendingWrites:
+    """
+    Writes not yet merged into a backend that cannot be modified while searched.
+
+    Instances are immutable: each write creates a new one, so searches read a
+    consistent set without a lock.
+    """
+
+    def __init__(self, writes=None, since=None):
+        self.writes = writes or {}  # id -> unit vector, or None for a removal
+        self.since = since  # Monotonic time of the oldest write
+        added = [(index_id, vector) for index_id, vector in self.writes.items() if vector is not None]
+        self.ids = np.array([index_id for index_id, _ in added], dtype=np.int64)
+        self.vectors = np.vstack([vector for _, vector in added]) if added else None
+        self.overlaid = np.fromiter(self.writes, dtype=np.int64, count=len(self.writes))
+
+    def __len__(self):
+        return len(self.writes)
+
+    def with_writes(self, ids, vectors=None):
+        """A copy with `ids` added (or removed when `vectors` is None)"""
+        writes = dict(self.writes)
+        for row, index_id in enumerate(np.asarray(ids, dtype=np.int64).tolist()):
+            writes[index_id] = None if vectors is None else vectors[row]
+        return PendingWrites(writes, time.monotonic() if self.since is None else self.since)
+
+
+class ANNIndex:
+    """
+    Approximate nearest-neighbour index over embeddings, keyed by int64 ids.
+
+    Uses FAISS when it is installed and falls back to a NumPy IVF implementation
+    otherwise. Supports incremental add/remove, persistence to disk and filtered
+    top-k search by cosine similarity.
+
+    Searches read the current backend without taking a lock; builds and loads
+    replace it with a single attribute assignment. FAISS indexes cannot be
+    written while they are searched, so writes to them are collected in
+    PendingWrites (searched exactly alongside the index) and merged into a
+    copy of the index every MERGE_BATCH_SIZE writes or MERGE_INTERVAL seconds.
+    Requests never build an index: until the file written by build_ann_index
+    exists, a background thread builds one and searches return no results.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, name):
+        """Get the process-wide index for a name ('video' or 'content')"""
+        if name not in cls._instances:
+            with cls._instances_lock:
+                if name not in cls._instances:
+                    cls._instances[name] = cls(name)
+        return cls._instances[name]
+
+    def __init__(self, name, use_faiss=None):
+        self.name = name
+        self.use_faiss = FAISS_AVAILABLE if use_faiss is None else use_faiss
+        self.backend = None
+        self.pending = PendingWrites()
+        self.dimension = None
+        self.loaded_mtime = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()  # Serialises writers; searches do not take it
+        self._builder = None
+
+    def __len__(self):
+        return 0 if self.backend is None else len(self.backend)
+
+    @property
+    def path(self):
+        extension = 'faiss' if self.use_faiss else 'npz'
+        return os.path.join(get_index_dir(), f"{self.name}.{extension}")
+
+    def _backend_class(self):
+        return FaissIndex if self.use_faiss else NumpyIVFIndex
+
+    def build(self, ids, vectors, nlist=None):
+        """
+        Train and fill the index from scratch
+
+        Args:
+            ids (array-like): int64 ids
+            vectors (numpy.ndarray): (N, D) embeddings
+            nlist (int): Number of inverted lists (defaults to ~sqrt(N), 1 for small collections)
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize_rows(vectors)
+        dimension = vectors.shape[1]
+        if nlist is None:
+            # Small collections are searched exactly with a single list
+            nlist = 1 if len(ids) < FLAT_INDEX_THRESHOLD else int(np.clip(np.sqrt(len(ids)), 1, 4096))
+
+        backend = self._backend_class()(dimension, nlist)
+        backend.train(vectors)
+        if len(ids):
+            backend.add(ids, vectors)
+
+        with self._lock:
+            self.dimension = dimension
+            self.backend = backend
+
+        logger.info(f"Built {self.name} ANN index with {len(ids)} vectors ({type(backend).__name__})")
+
+    def add(self, ids, vectors):
+        """Insert or replace vectors; ignored until the index has been built"""
+        if self.backend is None or not len(ids):
+            return
+        vectors = normalize_rows(vectors)
+        if vectors.shape[1] != self.dimension:
+            logger.warning(f"Skipping {len(ids)} vectors with dimension {vectors.shape[1]} for {self.name} index")
+            return
+        with self._lock:
+            self._write(ids, vectors)
+
+    def remove(self, ids):
+        """Remove vectors by id"""
+        if self.backend is None or not len(ids):
+            return
+        with self._lock:
+            self._write(ids)
+
+    def _write(self, ids, vectors=None):
+        """Add (or, without vectors, remove) ids; the caller holds the lock"""
+        if self.backend.supports_concurrent_search:
+            if vectors is None:
+                self.backend.remove(ids)
+            else:
+                self.backend.add(ids, vectors)
+            return
+
+        self.pending = self.pending.with_writes(ids, vectors)
+        if len(self.pending) >= MERGE_BATCH_SIZE or time.monotonic() - self.pending.since >= MERGE_INTERVAL:
+            self._merge_pending()
+
+    def _merge_pending(self):
+        """Apply pending writes to a copy of the backend and swap it in; the caller holds the lock"""
+        pending = self.pending
+        if not len(pending):
+            return
+        backend = self.backend.copy()
+        backend.remove(pending.overlaid)
+        if len(pending.ids):
+            backend.add(pending.ids, pending.vectors)
+        self.backend = backend
+        self.pending = PendingWrites()
+
+    def search(self, vector, k, filter=None, nprobe=DEFAULT_NPROBE):
+        """
+        Find the k most similar vectors
+
+        Args:
+            vector (numpy.ndarray): Query embedding
+            k (int): Number of results
+            filter: Optional callable(ids) -> bool mask, or a collection of allowed ids
+            nprobe (int): Inverted lists to probe (accuracy/latency trade-off)
+
+        Returns:
+            tuple: (ids, scores) numpy arrays sorted by descending similarity
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        backend, pending = self.backend, self.pending
+        if backend is None or k <= 0 or len(backend) + len(pending.ids) == 0 or vector is None:
+            return empty
+
+        query = normalize_rows(vector)[0]
+        if len(query) != backend.dimension or not query.any():
+            return empty
+
+        if not len(pending):
+            return backend.search(query, k, filter=filter, nprobe=nprobe)
+
+        # Ids with pending writes are scored from the pending vectors, not the index
+        def is_current(ids):
+            mask = ~np.isin(ids, pending.overlaid)
+            allowed = _filter_mask(ids, filter)
+            return mask if allowed is None else mask & allowed
+
+        ids, scores = backend.search(query, k, filter=is_current, nprobe=nprobe) if len(backend) else empty
+        if len(pending.ids):
+            pending_ids, pending_vectors = pending.ids, pending.vectors
+            mask = _filter_mask(pending_ids, filter)
+            if mask is not None:
+                pending_ids, pending_vectors = pending_ids[mask], pending_vectors[mask]
+            ids = np.concatenate([ids, pending_ids])
+            scores = np.concatenate([scores, pending_vectors @ query])
+        return _top_k(ids, scores, k)
+
+    def save(self):
+        """Persist the index atomically"""
+        if self.backend is None:
+            return
+        os.makedirs(get_index_dir(), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            self._merge_pending()
+            self.backend.save(tmp_path)
+        os.replace(tmp_path, self.path)
+        self.loaded_mtime = os.path.getmtime(self.path)
+
+    def load(self):
+        """
+        Load the index from disk if a newer file is available
+
+        Returns:
+            bool: Whether an index is available
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return self.backend is not None
+
+        if self.loaded_mtime is not None and mtime <= self.loaded_mtime:
+            return True
+
+        backend = self._backend_class().load(self.path)
+        with self._lock:
+            self.dimension = backend.dimension
+            self.backend = backend
+            self.loaded_mtime = mtime
+        logger.info(f"Loaded {self.name} ANN index with {len(backend)} vectors from {self.path}")
+        return True
+
+    def ensure_loaded(self):
+        """Load from disk on first use and pick up newer files; build in the background if there is none"""
+        now = time.monotonic()
+        if self.backend is not None and now - self.checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+
+        if not self.load():
+            self.build_in_background()
+
+    def build_in_background(self):
+        """
+        Build the index from the database in a background thread and save it
+
+        Does nothing while a build is already running. Searches return no
+        results until the build finishes.
+        """
+        with self._lock:
+            if self._builder is not None and self._builder.is_alive():
+                return
+            self._builder = threading.Thread(target=self._build_and_save, name=f'{self.name}-ann-build', daemon=True)
+            self._builder.start()
+
+    def _build_and_save(self):
+        try:
+            if self.name == 'video':
+                build_video_index(self)
+            elif self.name == 'content':
+                build_content_index(self)
+            else:
+                return
+            self.save()
+        except Exception as e:
+            logger.error(f"Error building {self.name} ANN index: {e}")
+        finally:
+            connection.close()
+
+
+def load_video_vectors():
+    """Load (ids, vectors) for all published and approved videos with an embedding"""
+    rows = list(
+        VideoEmbedding.objects.filter(
+            video__is_published=True,
+            video__moderation_status='approved'
+        ).values_list('video_id', *ENCODED_FIELDS, 'model_name').iterator()
+    )
+    return _stack_rows(decode_rows(rows, label='video embeddings'))
+
+
+def load_content_vectors():
+    """Load (ids, vectors) for all blog and post embeddings, with ids encoded by content type"""
+    rows = ContentEmbedding.objects.values_list('content_type_id', 'object_id', *ENCODED_FIELDS, 'model_name').iterator()
+    return _stack_rows(decode_rows(
+        ((encode_content_id(content_type_id, object_id), *encoded) for content_type_id, object_id, *encoded in rows),
+        label='content embeddings'
+    ))
+
+
+def _stack_rows(rows):
+    """Stack (id, vector) pairs, keeping only vectors of the dominant dimension"""
+    rows = [(index_id, np.asarray(vector, dtype=np.float32).ravel()) for index_id, vector in rows]
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 1), dtype=np.float32)
+
+    lengths = np.array([len(vector) for _, vector in rows])
+    dimension = np.bincount(lengths).argmax()
+    rows = [(index_id, vector) for index_id, vector in rows if len(vector) == dimension]
+
+    ids = np.array([index_id for index_id, _ in rows], dtype=np.int64)
+    vectors = np.vstack([vector for _, vector in rows])
+    return ids, vectors
+
+
+def build_video_index(index=None, nlist=None):
+    """Build (but do not save) the video index from VideoEmbedding"""
+    if index is None:
+        index = ANNIndex.get_instance('video')
+    ids, vectors = load_video_vectors()
+    index.build(ids, vectors, nlist=nlist)
+    return index
+
+
+def build_content_index(index=None, nlist=None):
+    """Build (but do not save) the blog and post search index from ContentEmbedding"""
+    if index is None:
+        index = ANNIndex.get_instance('content')
+    ids, vectors = load_content_vectors()
+    index.build(ids, vectors, nlist=nlist)
+    return index
+
+
+def get_video_index():
+    """Get the shared video ANN index, loading it (or starting a background build) if needed"""
+    index = ANNIndex.get_instance('video')
+    try:
+        index.ensure_loaded()
+    except Exception as e:
+        logger.error(f"Error loading video ANN index: {e}")
+    return index
+
+
+def get_content_index():
+    """Get the shared content ANN index, loading it (or starting a background build) if needed"""
+    index = ANNIndex.get_instance('content')
+    try:
+        index.ensure_loaded()
+    except Exception as e:
+        logger.error(f"Error loading content ANN index: {e}")
+    return index
+
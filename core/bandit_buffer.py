@@ -0,0 +1,255 @@
+import atexit
+import threading
+import logging
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from videos.models import Video
+from core.models import BanditStats
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+FLUSH_INTERVAL = 30  # Seconds between background flushes
+MAX_PENDING_ARMS = 500  # Flush early once this many arms have pending deltas
+MAX_FLUSH_ATTEMPTS = 3  # Deltas are dropped after failing to flush this many times in a row
+DEFAULT_VIDEO_DURATION = 300  # Seconds used to normalise rewards (videos have no duration field)
+
+
+def calculate_reward(watch_time, duration=None):
+    """Reward for a click: fraction of the video watched, capped at 1.0"""
+    return min(1.0, watch_time / (duration or DEFAULT_VIDEO_DURATION))
+
+
+def compute_ucb_scores(impression_counts, reward_sums, total_arms):
+    """
+    Vectorised Upper Confidence Bound scores
+
+    UCB = average_reward + sqrt(2 * ln(total_arms) / impressions); arms that were
+    never shown get infinity.
+
+    Args:
+        impression_counts (numpy.ndarray): Impressions per arm
+        reward_sums (numpy.ndarray): Summed rewards per arm
+        total_arms (int): Number of arms, the `total_count` of the bonus term
+
+    Returns:
+        numpy.ndarray: UCB score per arm
+    """
+    impression_counts = np.asarray(impression_counts, dtype=np.float64)
+    reward_sums = np.asarray(reward_sums, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_reward = reward_sums / impression_counts
+        exploration_bonus = np.sqrt(2 * np.log(total_arms or 1) / impression_counts)
+
+    return np.where(impression_counts > 0, average_reward + exploration_bonus, np.inf)
+
+
+class BanditUpdateBuffer:
+    """
+    Write-behind aggregation of bandit statistics.
+
+    Clicks, impressions and watch-time heartbeats are summed per video in memory
+    and written periodically with one F()-based UPDATE per distinct delta, followed
+    by a single vectorised UCB recomputation for every touched arm. This keeps
+    request handlers off the hot BanditStats rows of popular videos.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+                    atexit.register(cls._instance.flush)
+        return cls._instance
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING_ARMS):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}
+        self._failures = {}  # video_id -> consecutive failed flushes of its deltas
+        self._flusher = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, video_id, clicked=False, watch_time=0, impressions=1, previous_watch_time=0):
+        """
+        Queue a stats update for a video
+
+        Only the watch time beyond `previous_watch_time` is added, and the
+        reward grows by the matching difference, so the periodic watch-time
+        updates of one view add up to that view's capped reward.
+
+        Args:
+            video_id (int): ID of the video
+            clicked (bool): Whether the video was clicked
+            watch_time (int): Watch time of the view so far, in seconds
+            impressions (int): Number of impressions to add
+            previous_watch_time (int): Watch time of the view already recorded
+        """
+        previous_watch_time = min(previous_watch_time, watch_time)
+        with self._lock:
+            deltas = self._pending.setdefault(int(video_id), [0, 0, 0, 0.0])
+            deltas[0] += impressions
+            if clicked:
+                deltas[1] += 1
+            deltas[2] += watch_time - previous_watch_time
+            deltas[3] += calculate_reward(watch_time) - calculate_reward(previous_watch_time)
+            pending = len(self._pending)
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name='bandit-flusher', daemon=True)
+                self._flusher.start()
+
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def record_impressions(self, counts):
+        """
+        Queue impressions for many videos at once
+
+        Args:
+            counts (dict): video_id -> number of impressions
+        """
+        with self._lock:
+            for video_id, impressions in counts.items():
+                self._pending.setdefault(int(video_id), [0, 0, 0, 0.0])[0] += impressions
+            pending = len(self._pending)
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name='bandit-flusher', daemon=True)
+                self._flusher.start()
+
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _run_flusher(self):
+        """Flush periodically (or early when woken) off the request threads"""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in bandit stats flusher: {e}")
+            finally:
+                connection.close()
+
+    def flush(self):
+        """
+        Write all pending deltas to the database
+
+        Returns:
+            int: Number of arms updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        with self._flush_lock:
+            try:
+                apply_deltas(pending)
+            except Exception as e:
+                logger.error(f"Error flushing bandit stats for {len(pending)} arms: {e}")
+                self._requeue(pending)
+                return 0
+
+            for video_id in pending:
+                self._failures.pop(video_id, None)
+
+        return len(pending)
+
+    def _requeue(self, pending):
+        """Put failed deltas back for the next flush, dropping those that failed MAX_FLUSH_ATTEMPTS times"""
+        dropped = 0
+        with self._lock:
+            for video_id, deltas in pending.items():
+                failures = self._failures.get(video_id, 0) + 1
+                if failures >= MAX_FLUSH_ATTEMPTS:
+                    self._failures.pop(video_id, None)
+                    dropped += 1
+                    continue
+                self._failures[video_id] = failures
+                current = self._pending.setdefault(video_id, [0, 0, 0, 0.0])
+                for i, value in enumerate(deltas):
+                    current[i] += value
+        if dropped:
+            logger.warning(f"Dropped bandit stats for {dropped} arms after {MAX_FLUSH_ATTEMPTS} failed flushes")
+
+
+def apply_deltas(pending):
+    """
+    Apply aggregated deltas and refresh the UCB scores of the touched arms
+
+    Deltas of videos deleted since they were recorded are dropped; inserting
+    their arms would violate the foreign key and roll back the whole batch.
+
+    Args:
+        pending (dict): video_id -> [impressions, clicks, watch_time, reward]
+    """
+    with transaction.atomic():
+        video_ids = list(Video.objects.filter(id__in=list(pending)).values_list('id', flat=True))
+        if len(video_ids) < len(pending):
+            logger.info(f"Dropping bandit stats for {len(pending) - len(video_ids)} deleted videos")
+            pending = {video_id: pending[video_id] for video_id in video_ids}
+        if not pending:
+            return
+
+        BanditStats.objects.bulk_create(
+            [BanditStats(video_id=video_id) for video_id in video_ids],
+            ignore_conflicts=True
+        )
+
+        # Arms with identical deltas (e.g. a single impression) share one UPDATE
+        by_delta = {}
+        for video_id, deltas in pending.items():
+            by_delta.setdefault(tuple(deltas), []).append(video_id)
+
+        for (impressions, clicks, watch_time, reward), ids in by_delta.items():
+            BanditStats.objects.filter(video_id__in=ids).update(
+                # Clicks from lists that log no impressions (autoplay, rewritten links) still count as shown
+                impression_count=Greatest(F('impression_count') + impressions, F('click_count') + clicks),
+                click_count=F('click_count') + clicks,
+                total_watch_time=F('total_watch_time') + watch_time,
+                reward_sum=F('reward_sum') + reward
+            )
+
+        refresh_ucb_scores(video_ids)
+
+
+def refresh_ucb_scores(video_ids):
+    """Recompute UCB scores for a set of arms in one vectorised pass"""
+    arms = list(
+        BanditStats.objects.filter(video_id__in=video_ids).only('id', 'impression_count', 'click_count', 'reward_sum')
+    )
+    if not arms:
+        return
+
+    scores = compute_ucb_scores(
+        [max(arm.impression_count, arm.click_count) for arm in arms],
+        [arm.reward_sum for arm in arms],
+        BanditStats.get_arm_count()
+    )
+    for arm, score in zip(arms, scores.tolist()):
+        arm.ucb_score = score
+
+    BanditStats.objects.bulk_update(arms, ['ucb_score'], batch_size=500)
+
+
+def get_bandit_buffer():
+    """Get the process-wide bandit update buffer"""
+    return BanditUpdateBuffer.get_instance()
@@ -0,0 +1,364 @@
+import logging
+import random
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from videos.models import Video, VideoView
+from core.models import BanditStats, Category, Like, UserEmbedding, VideoEmbedding
+from core.bandit_buffer import compute_ucb_scores
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+REPORT_FORMAT = 1  # Bump when the report layout changes
+POPULARITY_EXPONENT = 1.0  # Zipf exponent of video popularity in the synthetic dataset
+HISTORY_DAYS = 60  # Synthetic videos and views are spread over this many days
+SEED_BATCH_SIZE = 2000
+
+
+def latency_summary(latencies_ms, query_counts):
+    """
+    Percentile summary of repeated measurements
+
+    Args:
+        latencies_ms (list): Latency of each run in milliseconds
+        query_counts (list): SQL queries issued by each run
+
+    Returns:
+        dict: Run count, latency percentiles and query counts
+    """
+    latencies = np.asarray(latencies_ms, dtype=np.float64)
+    queries = np.asarray(query_counts, dtype=np.float64)
+    if not len(latencies):
+        return {'runs': 0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'runs': len(latencies),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'max_ms': round(float(latencies.max()), 3),
+        'queries_mean': round(float(queries.mean()), 2),
+        'queries_max': int(queries.max()),
+    }
+
+
+def measure(func, args_list, setup=None):
+    """
+    Time a callable over a list of argument tuples, counting SQL queries
+
+    Args:
+        func (callable): Function to measure
+        args_list (list): One tuple of positional arguments per run
+        setup (callable): Optional function called with the same arguments
+            before each run, outside the measurement (e.g. to clear a cache)
+
+    Returns:
+        dict: latency_summary of the runs
+    """
+    latencies = []
+    query_counts = []
+    for args in args_list:
+        if setup is not None:
+            setup(*args)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func(*args)
+            latencies.append((time.perf_counter() - start) * 1000)
+        query_counts.append(len(queries))
+    return latency_summary(latencies, query_counts)
+
+
+def seed_synthetic_dataset(users=1000, videos=5000, views_per_user=30, likes_per_user=5,
+                           categories=20, subscriptions_per_user=3, dimension=384, seed=0):
+    """
+    Fill the database with a synthetic catalogue and interaction history
+
+    Video popularity follows a Zipf distribution and embeddings are clustered
+    by category, so similarity and collaborative sources see realistic
+    structure. Rows are bulk inserted, which skips the model inference run by
+    the post_save signals. Meant for a throwaway database.
+
+    Args:
+        users (int): Number of users
+        videos (int): Number of published, approved videos
+        views_per_user (int): Distinct videos each user has viewed
+        likes_per_user (int): Viewed videos each user has liked
+        categories (int): Number of categories (one per video)
+        subscriptions_per_user (int): Channels each user subscribes to
+        dimension (int): Embedding dimension
+        seed (int): Random seed
+
+    Returns:
+        dict: Number of rows created per table
+    """
+    User = get_user_model()
+    rng = np.random.default_rng(seed)
+    now = timezone.now()
+
+    created_users = User.objects.bulk_create([
+        User(username=f'bench_user_{i}', email=f'bench_user_{i}@example.com', password='!', last_login=now)
+        for i in range(users)
+    ], batch_size=SEED_BATCH_SIZE)
+    user_ids = np.array(sorted(User.objects.filter(username__startswith='bench_user_').values_list('id', flat=True)))
+
+    created_categories = Category.objects.bulk_create([
+        Category(name=f'Benchmark {i}', slug=f'benchmark-{i}') for i in range(categories)
+    ])
+
+    creator_ids = rng.choice(user_ids, size=videos)
+    Video.objects.bulk_create([
+        Video(
+            title=f'Benchmark video {i}', description='Synthetic benchmark video',
+            creator_id=int(creator_ids[i]), slug=f'benchmark-video-{i}',
+            is_published=True, requires_moderation=False, moderation_status='approved'
+        )
+        for i in range(videos)
+    ], batch_size=SEED_BATCH_SIZE)
+    video_objects = list(Video.objects.filter(slug__startswith='benchmark-video-').order_by('id'))
+    video_ids = np.array([video.id for video in video_objects], dtype=np.int64)
+
+    # Zipf popularity over a random permutation of the catalogue
+    popularity = 1.0 / np.arange(1, videos + 1) ** POPULARITY_EXPONENT
+    popularity = popularity[rng.permutation(videos)]
+    popularity /= popularity.sum()
+
+    ages = rng.uniform(0, HISTORY_DAYS * 86400, size=videos)
+    for video, age, share in zip(video_objects, ages, popularity):
+        video.created_at = now - timedelta(seconds=float(age))
+        video.views = int(share * users * views_per_user * 10)
+    Video.objects.bulk_update(video_objects, ['created_at', 'views'], batch_size=SEED_BATCH_SIZE)
+
+    video_categories = rng.integers(0, categories, size=videos)
+    Category.videos.through.objects.bulk_create([
+        Category.videos.through(category_id=created_categories[category].id, video_id=int(video_id))
+        for video_id, category in zip(video_ids, video_categories)
+    ], batch_size=SEED_BATCH_SIZE)
+
+    centroids = rng.standard_normal((categories, dimension)).astype(np.float32)
+    vectors = centroids[video_categories] + 0.5 * rng.standard_normal((videos, dimension)).astype(np.float32)
+    VideoEmbedding.objects.bulk_create([
+        VideoEmbedding(video_id=int(video_id), **VideoEmbedding.encode_fields(vector))
+        for video_id, vector in zip(video_ids, vectors)
+    ], batch_size=SEED_BATCH_SIZE)
+
+    views = []
+    likes = []
+    per_user = min(views_per_user, videos)
+    for user_id in user_ids.tolist():
+        watched = rng.choice(video_ids, size=per_user, replace=False, p=popularity)
+        watched_at = [now - timedelta(seconds=float(age)) for age in rng.uniform(0, HISTORY_DAYS * 86400, size=per_user)]
+        view_times = rng.integers(0, 900, size=per_user)
+        views.extend(
+            VideoView(user_id=user_id, video_id=int(video_id), view_time=int(view_time), created_at=created_at)
+            for video_id, view_time, created_at in zip(watched, view_times, watched_at)
+        )
+        likes.extend(
+            Like(user_id=user_id, video_id=int(video_id))
+            for video_id in watched[:min(likes_per_user, per_user)]
+        )
+    VideoView.objects.bulk_create(views, batch_size=SEED_BATCH_SIZE)
+    Like.objects.bulk_create(likes, batch_size=SEED_BATCH_SIZE)
+
+    Subscription = User.subscribers.through
+    subscriptions = set()
+    for user_id in user_ids.tolist():
+        for creator_id in rng.choice(creator_ids, size=min(subscriptions_per_user, len(creator_ids)), replace=False).tolist():
+            if creator_id != user_id:
+                subscriptions.add((creator_id, user_id))
+    Subscription.objects.bulk_create([
+        Subscription(from_customuser_id=creator_id, to_customuser_id=user_id)
+        for creator_id, user_id in subscriptions
+    ], batch_size=SEED_BATCH_SIZE)
+
+    impressions = rng.integers(0, 500, size=videos)
+    clicks = rng.binomial(impressions, 0.05)
+    rewards = clicks * rng.uniform(0.2, 1.0, size=videos)
+    ucb_scores = compute_ucb_scores(impressions, rewards, videos)
+    BanditStats.objects.bulk_create([
+        BanditStats(
+            video_id=int(video_id), impression_count=int(shown), click_count=int(clicked),
+            total_watch_time=int(clicked * 120), reward_sum=float(reward), ucb_score=float(score)
+        )
+        for video_id, shown, clicked, reward, score in zip(video_ids, impressions, clicks, rewards, ucb_scores)
+    ], batch_size=SEED_BATCH_SIZE)
+
+    return {
+        'users': len(created_users),
+        'videos': videos,
+        'categories': len(created_categories),
+        'views': len(views),
+        'likes': len(likes),
+        'subscriptions': len(subscriptions),
+        'dimension': dimension,
+    }
+
+
+def build_user_embeddings():
+    """Compute and store every user's preference embedding from the seeded history"""
+    from core.nlp import calculate_user_preference_embedding
+
+    User = get_user_model()
+    embeddings = [
+        UserEmbedding(user=user, **UserEmbedding.encode_fields(calculate_user_preference_embedding(user)))
+        for user in User.objects.filter(video_views__isnull=False).distinct()
+    ]
+    UserEmbedding.objects.bulk_create(embeddings, batch_size=SEED_BATCH_SIZE)
+    return len(embeddings)
+
+
+def build_models(factors=32, iterations=5):
+    """Build the trending scores, item-item model and ALS factors for the current data"""
+    from core.trending import refresh_trending
+    from core.item_similarity import get_item_similarity_model
+    from core.matrix_factorization import load_feedback, train_als, save_factors
+
+    refresh_trending()
+
+    model = get_item_similarity_model()
+    model.build()
+    model.save()
+
+    user_ids, video_ids, feedback = load_feedback()
+    if feedback.nnz:
+        user_factors, item_factors = train_als(feedback, factors=factors, iterations=iterations)
+        save_factors(user_ids, video_ids, user_factors, item_factors)
+
+
+def run_recommender_benchmark(samples=50, num_recommendations=24, precompute_workers=1, seed=0):
+    """
+    Measure latency and query counts of the recommender entry points
+
+    Every stage is measured cold: ranked lists and the popular list are
+    evicted before each run. Candidate sources and UCB ranking are measured
+    on a shared RecommendationContext, whose construction is reported as its
+    own stage, mirroring recommend_for_user. Exploration is disabled on the
+    measured recommender so runs are comparable.
+
+    Args:
+        samples (int): Number of users to measure per stage
+        num_recommendations (int): Videos requested per call
+        precompute_workers (int): Worker processes for precompute_recommendations
+        seed (int): Random seed for picking users
+
+    Returns:
+        dict: Stage name -> latency_summary
+    """
+    from django.core.cache import cache
+    from core.recommender import (
+        ContextualBanditRecommender, RecommendationContext, RANKED_LIST_SIZE,
+        POPULAR_VIDEOS_CACHE_KEY, precompute_recommendations, ranked_cache_key
+    )
+
+    User = get_user_model()
+    random.seed(seed)
+    users = list(User.objects.filter(video_views__isnull=False).distinct().order_by('id'))
+    users = random.sample(users, min(samples, len(users)))
+    recommender = ContextualBanditRecommender(exploration_rate=0.0)
+    list_size = max(num_recommendations, RANKED_LIST_SIZE)
+
+    def evict_ranked(user):
+        cache.delete(ranked_cache_key(user.id))
+
+    def evict_popular(*args):
+        cache.delete(POPULAR_VIDEOS_CACHE_KEY)
+
+    # Warm the process-wide structures once so the first sample is not an outlier
+    recommender.recommend_for_user(users[0].id, num_recommendations)
+
+    results = {
+        'recommend_for_user.cold': measure(
+            lambda user: recommender.recommend_for_user(user.id, num_recommendations),
+            [(user,) for user in users], setup=evict_ranked
+        ),
+        'recommend_for_user.cached': measure(
+            lambda user: recommender.recommend_for_user(user.id, num_recommendations),
+            [(user,) for user in users]
+        ),
+        'context': measure(RecommendationContext, [(user,) for user in users]),
+        'get_popular_videos.cold': measure(
+            recommender.get_popular_videos, [(num_recommendations,)] * len(users), setup=evict_popular
+        ),
+        'get_popular_videos.cached': measure(
+            recommender.get_popular_videos, [(num_recommendations,)] * len(users)
+        ),
+        'get_exploration_videos': measure(
+            recommender.get_exploration_videos, [(user, num_recommendations) for user in users]
+        ),
+    }
+
+    contexts = [RecommendationContext(user) for user in users]
+    sources = {
+        'source.personalized': (recommender.get_personalized_videos, list_size * 2),
+        'source.collaborative': (recommender.get_collaborative_recommendations, list_size),
+        'source.category': (recommender.get_category_recommendations, list_size),
+        'source.likes': (recommender.get_recommendations_from_likes, list_size),
+        'source.watch_time': (recommender.get_watch_time_recommendations, list_size),
+        'source.factors': (recommender.get_factor_recommendations, list_size),
+    }
+    candidates = {}
+    for name, (source, size) in sources.items():
+        results[name] = measure(
+            lambda user, context, source=source, size=size: candidates.setdefault(user.id, []).extend(
+                source(user, size, True, context)
+            ),
+            [(user, context) for user, context in zip(users, contexts)]
+        )
+
+    results['rank_videos_ucb'] = measure(
+        recommender.rank_videos_ucb,
+        [(user, list({video.id: video for video in candidates.get(user.id, [])}.values()), context)
+         for user, context in zip(users, contexts)]
+    )
+
+    # One full precompute pass; with workers > 1 only the parent's queries are counted
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        summary = precompute_recommendations(workers=precompute_workers, full=True)
+        elapsed = time.perf_counter() - start
+    results['precompute_recommendations'] = {
+        'users': summary['users'],
+        'failed': summary['failed'],
+        'workers': precompute_workers,
+        'total_s': round(elapsed, 3),
+        'per_user_p50_ms': summary['p50_ms'],
+        'per_user_p95_ms': summary['p95_ms'],
+        'per_user_p99_ms': summary['p99_ms'],
+        'queries': len(queries),
+    }
+
+    return results
+
+
+def compare_reports(baseline, current, max_regression=0.2):
+    """
+    Find stages that got slower or issue more queries than in a baseline report
+
+    Args:
+        baseline (dict): Earlier report
+        current (dict): New report
+        max_regression (float): Allowed relative p95 slowdown (0.2 = 20%)
+
+    Returns:
+        list: Human-readable regression descriptions
+    """
+    regressions = []
+    for stage, stats in current.get('results', {}).items():
+        before = baseline.get('results', {}).get(stage)
+        if not before:
+            continue
+        if 'p95_ms' in stats and 'p95_ms' in before and stats['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{stage}: p95 {before['p95_ms']}ms -> {stats['p95_ms']}ms")
+        if 'queries_max' in stats and 'queries_max' in before and stats['queries_max'] > before['queries_max']:
+            regressions.append(f"{stage}: queries {before['queries_max']} -> {stats['queries_max']}")
+        if 'total_s' in stats and 'total_s' in before and stats['total_s'] > before['total_s'] * (1 + max_regression):
+            regressions.append(f"{stage}: total {before['total_s']}s -> {stats['total_s']}s")
+    return regressions
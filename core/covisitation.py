@@ -0,0 +1,323 @@
+import os
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from videos.models import Video, VideoView
+from core.item_similarity import truncate_neighbors
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+COVISIT_WINDOW_MINUTES = 30  # A later view counts as "watched next" within this many minutes
+MAX_LAG = 5  # Later views of the same visitor paired with each view; the k-th next view counts 1/k
+HISTORY_DAYS = 90  # Views older than this are ignored by full builds
+TRACKED_NEIGHBORS = 100  # Counts kept per video, so incremental updates have a tail to grow into
+DEFAULT_NEIGHBORS = 20  # Next videos served per video
+RELOAD_CHECK_INTERVAL = 60  # Seconds between checks for a newer model file on disk
+MODEL_FILENAME = 'covisitation.npz'
+
+
+def get_model_path():
+    """Path of the persisted co-visitation model"""
+    base_dir = getattr(settings, 'RECOMMENDER_DATA_DIR', os.path.join(settings.BASE_DIR, 'recommender_data'))
+    return os.path.join(base_dir, MODEL_FILENAME)
+
+
+def load_views(since):
+    """
+    Load views as parallel arrays, one visitor ID per logged-in user or anonymous session
+
+    Anonymous sessions get negative visitor IDs; views with neither a user nor
+    a session are skipped.
+
+    Returns:
+        tuple: (visitors, timestamps, video_ids) as numpy arrays
+    """
+    rows = list(
+        VideoView.objects.filter(created_at__gt=since).exclude(
+            user__isnull=True, session_id__isnull=True
+        ).values_list('user_id', 'session_id', 'video_id', 'created_at')
+    )
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(0, dtype=np.float64), empty
+
+    sessions = np.array([session_id or '' for user_id, session_id, _, _ in rows if user_id is None])
+    session_codes = np.unique(sessions, return_inverse=True)[1] if len(sessions) else np.zeros(0, dtype=np.int64)
+
+    visitors = np.empty(len(rows), dtype=np.int64)
+    anonymous = np.array([user_id is None for user_id, _, _, _ in rows], dtype=bool)
+    visitors[~anonymous] = [user_id for user_id, _, _, _ in rows if user_id is not None]
+    visitors[anonymous] = -1 - session_codes
+
+    timestamps = np.array([created_at.timestamp() for _, _, _, created_at in rows], dtype=np.float64)
+    video_ids = np.array([video_id for _, _, video_id, _ in rows], dtype=np.int64)
+    return visitors, timestamps, video_ids
+
+
+def covisit_pairs(visitors, timestamps, video_ids, counted_after=None):
+    """
+    Count (video, next video) pairs watched by the same visitor
+
+    Views are ordered per visitor and consecutive views of the same video
+    merged into one run. Each run is paired with the next MAX_LAG runs of the
+    visitor that started within COVISIT_WINDOW_MINUTES of its last view.
+
+    Args:
+        visitors, timestamps, video_ids (numpy.ndarray): Views as returned by load_views
+        counted_after (float): Only count pairs whose later run started after this timestamp
+
+    Returns:
+        tuple: (source_ids, next_ids, counts) with one entry per distinct pair
+    """
+    order = np.lexsort((timestamps, visitors))
+    visitors, timestamps, video_ids = visitors[order], timestamps[order], video_ids[order]
+
+    run_starts = np.flatnonzero(np.r_[True, (visitors[1:] != visitors[:-1]) | (video_ids[1:] != video_ids[:-1])])
+    run_ends = np.r_[run_starts[1:], len(video_ids)] - 1
+    visitors, video_ids = visitors[run_starts], video_ids[run_starts]
+    first_seen, last_seen = timestamps[run_starts], timestamps[run_ends]
+
+    window = COVISIT_WINDOW_MINUTES * 60
+    sources, targets, weights = [], [], []
+    for lag in range(1, MAX_LAG + 1):
+        if lag >= len(video_ids):
+            break
+        keep = (
+            (visitors[lag:] == visitors[:-lag])
+            & (first_seen[lag:] - last_seen[:-lag] <= window)
+            & (video_ids[lag:] != video_ids[:-lag])
+        )
+        if counted_after is not None:
+            keep &= first_seen[lag:] > counted_after
+        sources.append(video_ids[:-lag][keep])
+        targets.append(video_ids[lag:][keep])
+        weights.append(np.full(keep.sum(), 1.0 / lag, dtype=np.float32))
+
+    if not sources:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.float32)
+    return aggregate_pairs(np.concatenate(sources), np.concatenate(targets), np.concatenate(weights))
+
+
+def aggregate_pairs(sources, targets, counts):
+    """Sum the counts of duplicate (source, target) pairs"""
+    if not len(sources):
+        return sources, targets, counts
+    pairs, inverse = np.unique(np.stack([sources, targets], axis=1), axis=0, return_inverse=True)
+    summed = np.bincount(inverse.ravel(), weights=counts, minlength=len(pairs)).astype(np.float32)
+    return pairs[:, 0], pairs[:, 1], summed
+
+
+class CovisitationModel:
+    """
+    Top co-visitation counts: which videos people watch next after each video.
+
+    Counts are kept for the TRACKED_NEIGHBORS strongest next videos of every
+    video as CSR-style arrays (sorted `video_ids`, `indptr` into the flat
+    `neighbor_ids` and `counts`), and updated incrementally from new views.
+    Lookups are a binary search and a slice, so "up next" needs no recommender call.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.video_ids = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.neighbor_ids = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.float32)
+        self.watermark = None
+        self.loaded_mtime = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def _set_entries(self, sources, neighbors, counts):
+        """Keep the strongest TRACKED_NEIGHBORS entries per source and swap them in"""
+        sources, neighbors, counts = truncate_neighbors(sources, neighbors, counts, TRACKED_NEIGHBORS)
+        video_ids, run_lengths = np.unique(sources, return_counts=True)
+        with self._lock:
+            self.video_ids = video_ids
+            self.indptr = np.concatenate([[0], np.cumsum(run_lengths)]).astype(np.int64)
+            self.neighbor_ids = neighbors.astype(np.int64)
+            self.counts = counts.astype(np.float32)
+
+    def _entries(self):
+        """Current counts as flat COO arrays"""
+        return np.repeat(self.video_ids, np.diff(self.indptr)), self.neighbor_ids, self.counts
+
+    def build(self):
+        """Count co-visits from scratch over the last HISTORY_DAYS of views"""
+        started_at = timezone.now()
+        visitors, timestamps, video_ids = load_views(started_at - timedelta(days=HISTORY_DAYS))
+        self._set_entries(*covisit_pairs(visitors, timestamps, video_ids))
+        self.watermark = started_at
+        logger.info(f"Built co-visitation counts for {len(self)} videos ({len(self.neighbor_ids)} entries)")
+
+    def update(self):
+        """
+        Fold in views recorded since the last build or update
+
+        Views from one window before the watermark are reloaded so new views
+        pair with the ones just before them; only pairs whose later run
+        started after the watermark are counted.
+
+        Returns:
+            int: Number of new pairs counted
+        """
+        if self.watermark is None:
+            self.build()
+            return len(self.neighbor_ids)
+
+        started_at = timezone.now()
+        visitors, timestamps, video_ids = load_views(self.watermark - timedelta(minutes=COVISIT_WINDOW_MINUTES))
+        new_sources, new_neighbors, new_counts = covisit_pairs(
+            visitors, timestamps, video_ids, counted_after=self.watermark.timestamp()
+        )
+
+        if len(new_sources):
+            sources, neighbors, counts = self._entries()
+            self._set_entries(*aggregate_pairs(
+                np.concatenate([sources, new_sources]),
+                np.concatenate([neighbors, new_neighbors]),
+                np.concatenate([counts, new_counts])
+            ))
+        self.watermark = started_at
+
+        logger.info(f"Folded {len(new_sources)} new co-visitation pairs into the model")
+        return len(new_sources)
+
+    def neighbors(self, video_id, limit=DEFAULT_NEIGHBORS):
+        """
+        Videos most often watched next after `video_id`
+
+        Returns:
+            numpy.ndarray: Up to `limit` video IDs, most co-visited first
+        """
+        with self._lock:
+            video_ids, indptr, neighbor_ids = self.video_ids, self.indptr, self.neighbor_ids
+
+        position = np.searchsorted(video_ids, video_id)
+        if position >= len(video_ids) or video_ids[position] != video_id:
+            return np.zeros(0, dtype=np.int64)
+        start = indptr[position]
+        return neighbor_ids[start:min(start + limit, indptr[position + 1])]
+
+    def save(self):
+        """Persist the model atomically"""
+        path = get_model_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    video_ids=self.video_ids,
+                    indptr=self.indptr,
+                    neighbor_ids=self.neighbor_ids,
+                    counts=self.counts,
+                    watermark=np.array(self.watermark.isoformat() if self.watermark else '')
+                )
+        os.replace(tmp_path, path)
+        self.loaded_mtime = os.path.getmtime(path)
+
+    def load(self):
+        """
+        Load the model from disk if a newer file is available
+
+        Returns:
+            bool: Whether a model is available
+        """
+        path = get_model_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return len(self.neighbor_ids) > 0
+
+        if self.loaded_mtime is not None and mtime <= self.loaded_mtime:
+            return True
+
+        data = np.load(path)
+        watermark = str(data['watermark'])
+        with self._lock:
+            self.video_ids = data['video_ids']
+            self.indptr = data['indptr']
+            self.neighbor_ids = data['neighbor_ids']
+            self.counts = data['counts']
+            self.watermark = datetime.fromisoformat(watermark) if watermark else None
+            self.loaded_mtime = mtime
+        logger.info(f"Loaded co-visitation counts for {len(self.video_ids)} videos from {path}")
+        return True
+
+    def ensure_loaded(self):
+        """Pick up the model file on first use and whenever a newer one is written"""
+        now = time.monotonic()
+        if self.loaded_mtime is not None and now - self.checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        self.load()
+
+
+def get_covisitation_model():
+    """Get the shared co-visitation model, loading it from disk if needed"""
+    model = CovisitationModel.get_instance()
+    try:
+        model.ensure_loaded()
+    except Exception as e:
+        logger.error(f"Error loading co-visitation model: {e}")
+    return model
+
+
+def get_up_next_video(video, exclude=()):
+    """
+    Video to suggest (and autoplay) after `video`
+
+    Takes the most co-visited next video, falling back to the top of the
+    video's related list (see core.related) when nobody has watched on from it yet.
+
+    Args:
+        video (Video): Video being watched
+        exclude (iterable): Video IDs that must not be suggested (e.g. the rest of a playlist)
+
+    Returns:
+        Video or None
+    """
+    from core.related import get_related_video_ids
+
+    exclude = set(exclude) | {video.id}
+    candidate_ids = [
+        video_id for video_id in get_covisitation_model().neighbors(video.id).tolist()
+        if video_id not in exclude
+    ]
+    if not candidate_ids:
+        related_ids = get_related_video_ids(video.id)
+        if related_ids is not None:
+            candidate_ids = [video_id for video_id in related_ids.tolist() if video_id not in exclude]
+
+    # A few spare IDs in case the first ones were unpublished since the last update
+    candidate_ids = candidate_ids[:5]
+    videos_by_id = Video.objects.filter(
+        is_published=True,
+        moderation_status='approved'
+    ).select_related('creator').in_bulk(candidate_ids)
+    for video_id in candidate_ids:
+        if video_id in videos_by_id:
+            return videos_by_id[video_id]
+    return None
@@ -0,0 +1,254 @@
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from django.core.cache import cache
+
+from core.models import VideoEmbedding
+from core.embedding_store import (
+    EMBEDDING_DIMENSION, EMBEDDING_VERSION, ENCODED_FIELDS, EmbeddingDimensionError, decode_vector
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+LRU_MAX_BYTES = 64 * 1024 * 1024  # Per-process budget for cached vectors (~40k MiniLM embeddings)
+LRU_TTL = 5 * 60  # Seconds an entry is served before re-reading the shared cache (bounds cross-process staleness)
+ENTRY_OVERHEAD = 128  # Bytes charged per LRU entry on top of the vector (key, tuple, dict slot)
+CACHE_TTL = 60 * 60 * 24  # 24 hours in seconds (shared cache tier)
+
+
+# Remembered in the LRU for videos without an embedding, so repeated lookups skip the database
+NO_EMBEDDING = np.zeros(0, dtype=np.float32)
+
+
+def video_embedding_cache_key(video_id):
+    # v3: entries hold the stored (encoded) payload of a current-version (mean-pooled) vector
+    return f"video_embedding_v3_{video_id}"
+
+
+def _stored_payload(embedding):
+    """decode_vector arguments of a VideoEmbedding, as kept in the shared cache"""
+    return (
+        bytes(embedding.embedding_vector),
+        embedding.encoding,
+        embedding.dimension,
+        embedding.quant_scale,
+        embedding.quant_offset,
+    )
+
+
+def _decode_payloads(payloads):
+    """Decode {video_id: payload}, dropping (and logging) payloads that fail dimension validation"""
+    vectors = {}
+    for video_id, payload in payloads.items():
+        try:
+            vectors[video_id] = decode_vector(*payload)
+        except EmbeddingDimensionError as e:
+            logger.error(f"Invalid stored embedding for video {video_id}: {e}")
+    return vectors
+
+
+class EmbeddingLRU:
+    """
+    Per-process LRU of video embeddings, bounded by the bytes it holds.
+
+    Sits in front of the shared Django cache, so repeated lookups of hot
+    videos cost a dict access instead of a cache round trip. Counts hits,
+    misses and evictions for monitoring (see stats()).
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, max_bytes=LRU_MAX_BYTES, ttl=LRU_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # video_id -> (vector, stored_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, video_ids):
+        """
+        Look up several videos
+
+        Returns:
+            dict: video_id -> vector for the fresh entries found
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for video_id in video_ids:
+                entry = self._entries.get(video_id)
+                if entry is None or now - entry[1] > self.ttl:
+                    continue
+                self._entries.move_to_end(video_id)
+                found[video_id] = entry[0]
+            self.hits += len(found)
+            self.misses += len(video_ids) - len(found)
+        return found
+
+    def set_many(self, vectors):
+        """Store vectors, evicting the least recently used ones beyond max_bytes"""
+        now = time.monotonic()
+        with self._lock:
+            for video_id, vector in vectors.items():
+                old = self._entries.pop(video_id, None)
+                if old is not None:
+                    self.bytes -= old[0].nbytes + ENTRY_OVERHEAD
+                if vector.nbytes + ENTRY_OVERHEAD > self.max_bytes:
+                    continue
+                self._entries[video_id] = (vector, now)
+                self.bytes += vector.nbytes + ENTRY_OVERHEAD
+
+            while self.bytes > self.max_bytes:
+                _, (vector, _) = self._entries.popitem(last=False)
+                self.bytes -= vector.nbytes + ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def discard(self, video_ids):
+        """Drop entries, e.g. after the embeddings were regenerated"""
+        with self._lock:
+            for video_id in video_ids:
+                entry = self._entries.pop(video_id, None)
+                if entry is not None:
+                    self.bytes -= entry[0].nbytes + ENTRY_OVERHEAD
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def get_embedding_lru():
+    """Get the process-wide embedding LRU"""
+    return EmbeddingLRU.get_instance()
+
+
+def get_video_embeddings(video_ids, create_missing=False):
+    """
+    Get the embeddings of several videos at once
+
+    Each tier is queried once for everything the previous one missed: the
+    per-process LRU, then the shared cache (get_many), then the database (one
+    in_bulk query). Vectors found in a lower tier are written back to the
+    tiers above it. The shared cache holds the stored encoding (float16 by
+    default, see core.embedding_store); the LRU holds decoded float32 vectors.
+    Rows from another model version count as missing, but are left for
+    generate_embeddings rather than re-embedded here.
+
+    Args:
+        video_ids (array-like): IDs of the videos
+        create_missing (bool): Run the model for videos without a stored embedding
+
+    Returns:
+        numpy.ndarray: (len(video_ids), D) float32 matrix in the order of
+        `video_ids`; rows of videos without an embedding are zero
+    """
+    video_ids = [int(video_id) for video_id in video_ids]
+    unique_ids = list(dict.fromkeys(video_ids))
+
+    lru = get_embedding_lru()
+    vectors = lru.get_many(unique_ids)
+
+    missing = [video_id for video_id in unique_ids if video_id not in vectors]
+    if missing:
+        cached = cache.get_many([video_embedding_cache_key(video_id) for video_id in missing])
+        from_cache = _decode_payloads({
+            video_id: cached[video_embedding_cache_key(video_id)]
+            for video_id in missing
+            if video_embedding_cache_key(video_id) in cached
+        })
+        vectors.update(from_cache)
+
+        missing = [video_id for video_id in missing if video_id not in from_cache]
+        from_db = {}
+        if missing:
+            embeddings = VideoEmbedding.objects.only('video_id', 'model_name', *ENCODED_FIELDS).in_bulk(missing, field_name='video_id')
+            stale = [video_id for video_id, embedding in embeddings.items() if embedding.model_name != EMBEDDING_VERSION]
+            if stale:
+                # Left for generate_embeddings rather than re-embedded on the request path
+                logger.warning(f"Ignoring {len(stale)} video embeddings from another model version")
+                for video_id in stale:
+                    del embeddings[video_id]
+            if create_missing:
+                embeddings.update(_generate_embeddings([
+                    video_id for video_id in missing if video_id not in embeddings and video_id not in stale
+                ]))
+            payloads = {video_id: _stored_payload(embedding) for video_id, embedding in embeddings.items()}
+            from_db = _decode_payloads(payloads)
+            cache.set_many({
+                video_embedding_cache_key(video_id): payloads[video_id]
+                for video_id in from_db
+            }, CACHE_TTL)
+            vectors.update(from_db)
+
+        not_found = {video_id: NO_EMBEDDING for video_id in missing if video_id not in from_db}
+        lru.set_many({**from_cache, **from_db, **not_found})
+
+    dimension = next((len(vector) for vector in vectors.values() if len(vector)), EMBEDDING_DIMENSION)
+    matrix = np.zeros((len(video_ids), dimension), dtype=np.float32)
+    for row, video_id in enumerate(video_ids):
+        vector = vectors.get(video_id)
+        if vector is not None and len(vector) == dimension:
+            matrix[row] = vector
+    return matrix
+
+
+def _generate_embeddings(video_ids):
+    """
+    Run the model for videos that have never been embedded and store the results
+
+    All the videos go through the model together (see bulk_embed); videos
+    whose embedding failed are left out and retried on a later request.
+
+    Returns:
+        dict: video_id -> stored VideoEmbedding
+    """
+    from videos.models import Video
+    from core.embedding_service import bulk_embed
+
+    if not video_ids:
+        return {}
+    try:
+        videos = list(Video.objects.filter(id__in=video_ids).prefetch_related('tags', 'categories'))
+        return {embedding.video_id: embedding for embedding in bulk_embed(videos)}
+    except Exception as e:
+        logger.error(f"Error generating embeddings for {len(video_ids)} videos: {e}")
+        return {}
+
+
+def invalidate_video_embeddings(video_ids):
+    """Drop videos from this process's LRU and from the shared cache"""
+    video_ids = [int(video_id) for video_id in video_ids]
+    get_embedding_lru().discard(video_ids)
+    cache.delete_many([video_embedding_cache_key(video_id) for video_id in video_ids])
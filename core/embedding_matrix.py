@@ -0,0 +1,483 @@
+import os
+import shutil
+import threading
+import time
+import logging
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+
+from core.models import VideoEmbedding
+from core.embedding_store import ENCODED_FIELDS, decode_rows
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+REFRESH_INTERVAL = 60  # Seconds between incremental refreshes from the database
+REBUILD_INTERVAL = 60 * 60  # Seconds between full rebuilds (drops rows of deleted videos)
+SNAPSHOT_CHECK_INTERVAL = 60  # Seconds between checks for a newer snapshot generation on disk
+KEEP_SNAPSHOTS = 2  # Snapshot generations kept on disk; workers may still map the previous one
+REQUEUE_INTERVAL = 10 * 60  # Seconds before this process queues the same unembedded video again
+CURRENT_POINTER = 'CURRENT'
+
+
+def get_snapshot_dir():
+    """Directory holding the versioned embedding snapshots"""
+    base_dir = getattr(settings, 'RECOMMENDER_DATA_DIR', os.path.join(settings.BASE_DIR, 'recommender_data'))
+    return os.path.join(base_dir, 'embeddings')
+
+
+class EmbeddingMatrix:
+    """
+    Process-wide, L2-normalised matrix of video embeddings.
+
+    Rows are loaded in bulk from VideoEmbedding and kept up to date incrementally
+    using the `updated_at` watermark, so the recommender can score the whole
+    catalogue with a single matrix product instead of one cache/DB lookup and one
+    similarity call per candidate video.
+
+    When an exported snapshot exists (see export_snapshot) the base rows are
+    memory-mapped from it instead, so every web worker shares one copy through
+    the page cache and starts warm. Rows added or changed since the base was
+    loaded live in a small private `overlay`; `id_to_row` indexes the base
+    rows first, then the overlay rows.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        """Initialize an empty matrix; rows are loaded lazily on first use"""
+        self._lock = threading.Lock()
+        self.vectors = np.zeros((0, 0), dtype=np.float32)  # Base rows (memory-mapped when loaded from a snapshot)
+        self.overlay = np.zeros((0, 0), dtype=np.float32)  # Rows added or replaced since the base was loaded
+        self.ids = np.zeros(0, dtype=np.int64)  # IDs that have a row
+        self.id_to_row = {}
+        self.dimension = None
+        self.watermark = None
+        self.snapshot_version = None
+        self.built_at = 0.0
+        self.checked_at = 0.0
+        self.snapshot_checked_at = 0.0
+        self.queued_at = {}  # Video ID -> monotonic time it was last queued for embedding
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _normalize(vectors):
+        """L2-normalise rows, leaving zero vectors untouched"""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    def build(self):
+        """
+        Load every stored video embedding in one pass and replace the matrix.
+
+        Rows from another model or whose payload does not match their recorded
+        dimension are skipped (see decode_rows), as are vectors whose length
+        differs from the dominant dimension, so that a stray zero-vector
+        fallback cannot break the matrix shape.
+        """
+        rows = list(
+            VideoEmbedding.objects.values_list(
+                'video_id', *ENCODED_FIELDS, 'model_name', 'updated_at'
+            ).iterator()
+        )
+        decoded = decode_rows(rows, label='video embeddings')
+
+        if decoded:
+            dimension = Counter(len(vector) for _, vector, _ in decoded).most_common(1)[0][0]
+        else:
+            dimension = self.dimension
+
+        kept = [(video_id, vector, updated_at) for video_id, vector, updated_at in decoded if len(vector) == dimension]
+        skipped = len(decoded) - len(kept)
+        if skipped:
+            logger.warning(f"Skipped {skipped} video embeddings with unexpected dimension (expected {dimension})")
+
+        if kept:
+            ids = np.array([video_id for video_id, _, _ in kept], dtype=np.int64)
+            vectors = self._normalize(np.vstack([vector for _, vector, _ in kept]))
+            watermark = max(row[-1] for row in rows)
+        else:
+            ids = np.zeros(0, dtype=np.int64)
+            vectors = np.zeros((0, dimension or 0), dtype=np.float32)
+            watermark = None
+
+        self._set_base(vectors, ids, dimension, watermark)
+        logger.info(f"Built embedding matrix with {len(ids)} videos (dimension {dimension})")
+
+    def _set_base(self, vectors, ids, dimension, watermark, snapshot_version=None):
+        """Swap in new base rows and drop the overlay"""
+        with self._lock:
+            self.vectors = vectors
+            self.overlay = np.zeros((0, dimension or 0), dtype=np.float32)
+            self.ids = ids
+            self.id_to_row = {int(video_id): row for row, video_id in enumerate(ids)}
+            self.dimension = dimension
+            self.watermark = watermark
+            self.snapshot_version = snapshot_version
+            self.built_at = self.checked_at = time.monotonic()
+
+    def load_snapshot(self):
+        """
+        Map the snapshot generation named by CURRENT if it differs from the loaded one
+
+        Returns:
+            bool: Whether a new generation was mapped
+        """
+        base_dir = get_snapshot_dir()
+        try:
+            with open(os.path.join(base_dir, CURRENT_POINTER)) as f:
+                version = f.read().strip()
+        except OSError:
+            return False
+
+        if version == self.snapshot_version:
+            return False
+
+        version_dir = os.path.join(base_dir, version)
+        ids = np.load(os.path.join(version_dir, 'ids.npy'))
+        vectors = np.load(os.path.join(version_dir, 'vectors.npy'), mmap_mode='r')
+        watermark = str(np.load(os.path.join(version_dir, 'watermark.npy')))
+
+        self._set_base(
+            vectors, ids, vectors.shape[1] if len(ids) else self.dimension,
+            datetime.fromisoformat(watermark) if watermark else None, version
+        )
+        logger.info(f"Mapped embedding snapshot {version} ({len(ids)} videos)")
+        return True
+
+    def upsert(self, entries):
+        """
+        Insert or replace rows.
+
+        Args:
+            entries (list): (video_id, vector) pairs
+
+        Returns:
+            int: Number of rows written
+        """
+        entries = [
+            (int(video_id), np.asarray(vector, dtype=np.float32).ravel())
+            for video_id, vector in entries
+            if vector is not None
+        ]
+        if not entries:
+            return 0
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = len(entries[0][1])
+                self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+                self.overlay = np.zeros((0, self.dimension), dtype=np.float32)
+
+            entries = [(video_id, vector) for video_id, vector in entries if len(vector) == self.dimension]
+            if not entries:
+                return 0
+
+            normalized = self._normalize(np.vstack([vector for _, vector in entries]))
+
+            # Copy-on-write so concurrent readers always see a consistent matrix.
+            # Only the overlay is copied; replaced base rows are simply no longer referenced.
+            base_rows = len(self.vectors)
+            overlay = self.overlay.copy()
+            id_to_row = dict(self.id_to_row)
+            new_ids = []
+            new_vectors = []
+
+            for (video_id, _), vector in zip(entries, normalized):
+                row = id_to_row.get(video_id)
+                if row is not None and row >= base_rows:
+                    overlay[row - base_rows] = vector
+                    continue
+                if row is None:
+                    new_ids.append(video_id)
+                id_to_row[video_id] = base_rows + len(overlay) + len(new_vectors)
+                new_vectors.append(vector)
+
+            if new_vectors:
+                overlay = np.vstack([overlay, np.vstack(new_vectors)])
+            if new_ids:
+                self.ids = np.concatenate([self.ids, np.array(new_ids, dtype=np.int64)])
+
+            self.overlay = overlay
+            self.id_to_row = id_to_row
+
+        return len(entries)
+
+    def remove(self, video_ids):
+        """Drop rows for deleted videos"""
+        with self._lock:
+            drop = {int(video_id) for video_id in video_ids} & self.id_to_row.keys()
+            if not drop:
+                return
+
+            # Rows stay in place until the next build or snapshot; only their IDs are dropped
+            self.ids = self.ids[~np.isin(self.ids, list(drop))]
+            self.id_to_row = {video_id: row for video_id, row in self.id_to_row.items() if video_id not in drop}
+
+    def refresh(self, force=False):
+        """
+        Bring the matrix up to date.
+
+        Maps a newer snapshot generation when one appears (checked every
+        SNAPSHOT_CHECK_INTERVAL). Without a snapshot, does a full build the first
+        time and every REBUILD_INTERVAL. Otherwise only pulls rows whose
+        `updated_at` moved past the watermark, at most once every REFRESH_INTERVAL seconds.
+        """
+        now = time.monotonic()
+
+        if self.built_at == 0.0 or now - self.snapshot_checked_at > SNAPSHOT_CHECK_INTERVAL:
+            self.snapshot_checked_at = now
+            if self.load_snapshot():
+                force = True
+
+        if self.snapshot_version is None and (self.built_at == 0.0 or now - self.built_at > REBUILD_INTERVAL):
+            self.build()
+            return
+
+        if not force and now - self.checked_at < REFRESH_INTERVAL:
+            return
+
+        self.checked_at = now
+        changed = VideoEmbedding.objects.all()
+        if self.watermark is not None:
+            changed = changed.filter(updated_at__gt=self.watermark)
+
+        rows = list(changed.values_list('video_id', *ENCODED_FIELDS, 'model_name', 'updated_at'))
+        if not rows:
+            return
+
+        self.upsert([
+            (video_id, vector)
+            for video_id, vector, _ in decode_rows(rows, dimension=self.dimension, label='video embeddings')
+        ])
+        self.watermark = max(row[-1] for row in rows)
+
+    def ensure(self, video_ids):
+        """
+        Make sure every id that has a stored embedding has a row.
+
+        Never runs the model: videos without a current embedding are queued
+        for the process_embedding_queue worker (see core.embedding_queue) and
+        score 0 until it has stored one.
+        """
+        from core.embedding_cache import get_video_embeddings
+        from core.embedding_queue import enqueue_embeddings
+        from videos.models import Video
+
+        missing = [int(video_id) for video_id in video_ids if int(video_id) not in self.id_to_row]
+        if not missing:
+            return
+
+        try:
+            vectors = get_video_embeddings(missing)
+        except Exception as e:
+            logger.error(f"Error loading embeddings for {len(missing)} videos: {e}")
+            return
+
+        # Zero rows are videos without a stored embedding
+        present = vectors.any(axis=1)
+        self.upsert(zip(np.array(missing)[present].tolist(), vectors[present]))
+
+        now = time.monotonic()
+        unembedded = [
+            video_id for video_id, found in zip(missing, present.tolist())
+            if not found and now - self.queued_at.get(video_id, -REQUEUE_INTERVAL) >= REQUEUE_INTERVAL
+        ]
+        if unembedded:
+            try:
+                enqueue_embeddings(Video, unembedded, requeue=False)
+                self.queued_at.update((video_id, now) for video_id in unembedded)
+            except Exception as e:
+                logger.error(f"Error queueing embeddings for {len(unembedded)} videos: {e}")
+
+    def _gather(self, rows):
+        """Stack the given rows from the base and the overlay"""
+        with self._lock:
+            vectors, overlay = self.vectors, self.overlay
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(overlay):
+            return np.asarray(vectors[rows], dtype=np.float32)
+
+        in_base = rows < len(vectors)
+        gathered = np.empty((len(rows), overlay.shape[1]), dtype=np.float32)
+        gathered[in_base] = vectors[rows[in_base]]
+        gathered[~in_base] = overlay[rows[~in_base] - len(vectors)]
+        return gathered
+
+    def get_vectors(self, video_ids):
+        """
+        Get the normalised rows for a list of videos
+
+        Returns:
+            numpy.ndarray: (M, D) matrix for the ids that have an embedding
+        """
+        id_to_row = self.id_to_row
+        rows = [id_to_row[int(video_id)] for video_id in video_ids if int(video_id) in id_to_row]
+        return self._gather(rows)
+
+    def get_vector(self, video_id):
+        """
+        Get one video's normalised row
+
+        Returns:
+            numpy.ndarray or None: The row, or None if the video has no embedding
+        """
+        row = self.id_to_row.get(int(video_id))
+        if row is None:
+            return None
+        return self._gather([row])[0]
+
+    def prepare_query(self, vector):
+        """
+        Normalise a query vector against the matrix dimension
+
+        Returns:
+            numpy.ndarray or None: Unit-length query, or None if it is empty or mismatched
+        """
+        if vector is None:
+            return None
+
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        if self.dimension is None or len(query) != self.dimension:
+            return None
+
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+
+        return query / norm
+
+    def score(self, queries, candidate_ids):
+        """
+        Score candidates against one or more query vectors.
+
+        The whole catalogue is scored with a single matrix product and the
+        scores for the candidates are gathered afterwards.
+
+        Args:
+            queries (numpy.ndarray): (D,) query or (D, Q) matrix of queries, already normalised
+            candidate_ids (array-like): IDs of the candidate videos
+
+        Returns:
+            tuple: (ids, scores) for the candidates that have an embedding; with
+            several queries the scores have shape (M, Q)
+        """
+        with self._lock:
+            vectors, overlay, id_to_row = self.vectors, self.overlay, self.id_to_row
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+
+        rows = np.fromiter(
+            (id_to_row.get(int(video_id), -1) for video_id in candidate_ids),
+            dtype=np.int64,
+            count=len(candidate_ids)
+        )
+        present = rows >= 0
+        rows = rows[present]
+
+        all_scores = vectors @ queries
+        if len(overlay):
+            all_scores = np.concatenate([all_scores, overlay @ queries])
+        return candidate_ids[present], all_scores[rows]
+
+    @staticmethod
+    def top_k(ids, scores, k):
+        """
+        Select the k highest scoring ids in descending order.
+
+        Uses argpartition so only the selected slice is sorted.
+        """
+        if k <= 0 or len(ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if k < len(ids):
+            selected = np.argpartition(-scores, k - 1)[:k]
+        else:
+            selected = np.arange(len(ids))
+
+        order = selected[np.argsort(-scores[selected], kind='stable')]
+        return ids[order], scores[order]
+
+
+def get_embedding_matrix():
+    """
+    Get the shared embedding matrix, refreshed if it is due
+
+    Returns:
+        EmbeddingMatrix: Process-wide matrix instance
+    """
+    matrix = EmbeddingMatrix.get_instance()
+    try:
+        matrix.refresh()
+    except Exception as e:
+        logger.error(f"Error refreshing embedding matrix: {e}")
+    return matrix
+
+
+def export_snapshot():
+    """
+    Write the normalised vectors of all published videos as a new snapshot generation
+
+    Vectors go to `vectors.npy` (float32, one row per entry of `ids.npy`) in a
+    new version directory, and CURRENT is pointed at it. Web workers memory-map
+    these files, so existing generations are never modified in place; only the
+    last KEEP_SNAPSHOTS directories are retained.
+
+    Returns:
+        tuple: (version directory, number of videos)
+    """
+    started_at = datetime.now()
+    rows = list(
+        VideoEmbedding.objects.filter(
+            video__is_published=True,
+            video__moderation_status='approved'
+        ).values_list('video_id', *ENCODED_FIELDS, 'model_name', 'updated_at').order_by('video_id').iterator()
+    )
+    decoded = decode_rows(rows, label='video embeddings')
+    if decoded:
+        dimension = Counter(len(vector) for _, vector, _ in decoded).most_common(1)[0][0]
+        decoded = [(video_id, vector) for video_id, vector, _ in decoded if len(vector) == dimension]
+        ids = np.array([video_id for video_id, _ in decoded], dtype=np.int64)
+        vectors = EmbeddingMatrix._normalize(np.vstack([vector for _, vector in decoded]))
+        watermark = max(row[-1] for row in rows)
+    else:
+        ids = np.zeros(0, dtype=np.int64)
+        vectors = np.zeros((0, 0), dtype=np.float32)
+        watermark = None
+
+    base_dir = get_snapshot_dir()
+    version = started_at.strftime('%Y%m%d%H%M%S%f')
+    version_dir = os.path.join(base_dir, version)
+    os.makedirs(version_dir)
+
+    np.save(os.path.join(version_dir, 'ids.npy'), ids)
+    np.save(os.path.join(version_dir, 'vectors.npy'), np.ascontiguousarray(vectors, dtype=np.float32))
+    np.save(os.path.join(version_dir, 'watermark.npy'), np.array(watermark.isoformat() if watermark else ''))
+
+    pointer = os.path.join(base_dir, CURRENT_POINTER)
+    with open(f"{pointer}.tmp", 'w') as f:
+        f.write(version)
+    os.replace(f"{pointer}.tmp", pointer)
+
+    versions = sorted(
+        name for name in os.listdir(base_dir)
+        if os.path.isdir(os.path.join(base_dir, name))
+    )
+    for old_version in versions[:-KEEP_SNAPSHOTS]:
+        shutil.rmtree(os.path.join(base_dir, old_version), ignore_errors=True)
+
+    return version_dir, len(ids)
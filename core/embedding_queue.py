@@ -0,0 +1,216 @@
+import logging
+import operator
+from collections import defaultdict
+from datetime import timedelta
+from functools import reduce
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from videos.models import Video
+from core.models import EmbeddingJob, VideoEmbedding
+from core.embedding_service import DEFAULT_BATCH_SIZE, bulk_embed
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_QUEUE_PAGE_SIZE = 256  # Jobs claimed and embedded together by one worker pass
+CLAIM_TIMEOUT = 10 * 60  # Seconds a claimed job is hidden from other workers (covers crashed workers)
+RETRY_DELAY = 60  # Seconds before a failed job is retried
+MAX_ATTEMPTS = 5  # Jobs are dropped after failing this many times in a row
+
+
+def enqueue_embeddings(model, object_ids, requeue=True):
+    """
+    Queue objects of one model for (re-)embedding
+
+    One upsert per call: objects that are already queued keep their single
+    job. With `requeue` (the object changed) the job is marked as changed, so
+    a worker that is embedding the old text right now embeds the object
+    again afterwards; without it existing jobs are left alone.
+
+    Args:
+        model: Video, Blog or Post (class)
+        object_ids (iterable): Primary keys of the objects
+        requeue (bool): Whether the objects changed since they were queued
+    """
+    object_ids = list(dict.fromkeys(object_ids))
+    if not object_ids:
+        return
+
+    now = timezone.now()
+    content_type = ContentType.objects.get_for_model(model)
+    jobs = [EmbeddingJob(content_type=content_type, object_id=object_id, enqueued_at=now) for object_id in object_ids]
+    if requeue:
+        EmbeddingJob.objects.bulk_create(
+            jobs,
+            update_conflicts=True,
+            unique_fields=['content_type', 'object_id'],
+            update_fields=['enqueued_at', 'attempts', 'last_error']
+        )
+    else:
+        EmbeddingJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def enqueue_embedding(content_object):
+    """Queue a video, blog or post for (re-)embedding"""
+    enqueue_embeddings(type(content_object), [content_object.pk])
+
+
+def claim_jobs(limit=DEFAULT_QUEUE_PAGE_SIZE):
+    """
+    Claim the oldest jobs that no other worker holds
+
+    Claimed jobs are hidden for CLAIM_TIMEOUT seconds. On databases with row
+    locks, concurrent workers skip each other's rows instead of waiting.
+
+    Returns:
+        list: Claimed EmbeddingJob objects, oldest first
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            EmbeddingJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lte=now))
+            .order_by('enqueued_at')[:limit]
+        )
+        EmbeddingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            locked_until=now + timedelta(seconds=CLAIM_TIMEOUT)
+        )
+    return jobs
+
+
+def _load_objects(jobs):
+    """
+    Load the objects of claimed jobs with one query per content type
+
+    Returns:
+        dict: job pk -> object; jobs of deleted objects and unpublished videos are left out
+    """
+    jobs_by_type = defaultdict(list)
+    for job in jobs:
+        jobs_by_type[job.content_type_id].append(job)
+
+    objects = {}
+    for content_type_id, type_jobs in jobs_by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+        queryset = model.objects.all()
+        if model is Video:
+            queryset = queryset.filter(is_published=True).prefetch_related('tags', 'categories')
+        found = queryset.in_bulk([job.object_id for job in type_jobs])
+        for job in type_jobs:
+            if job.object_id in found:
+                objects[job.pk] = found[job.object_id]
+    return objects
+
+
+def _finish_jobs(jobs):
+    """
+    Delete finished jobs, except those queued again since they were claimed
+
+    A job whose enqueued_at changed belongs to an object that was saved while
+    it was being embedded; it is released so the new text is embedded too.
+    """
+    if not jobs:
+        return
+    unchanged = reduce(operator.or_, (Q(pk=job.pk, enqueued_at=job.enqueued_at) for job in jobs))
+    EmbeddingJob.objects.filter(unchanged).delete()
+    EmbeddingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(locked_until=None)
+
+
+def _fail_jobs(jobs, error):
+    """Schedule failed jobs for a retry, dropping those that failed MAX_ATTEMPTS times"""
+    if not jobs:
+        return
+    job_ids = [job.pk for job in jobs]
+    EmbeddingJob.objects.filter(pk__in=job_ids).update(
+        attempts=F('attempts') + 1,
+        last_error=error,
+        locked_until=timezone.now() + timedelta(seconds=RETRY_DELAY)
+    )
+    dropped, _ = EmbeddingJob.objects.filter(pk__in=job_ids, attempts__gte=MAX_ATTEMPTS).delete()
+    if dropped:
+        logger.warning(f"Dropped {dropped} embedding jobs after {MAX_ATTEMPTS} failed attempts: {error}")
+
+
+def process_embedding_jobs(limit=DEFAULT_QUEUE_PAGE_SIZE, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Claim a page of jobs, embed their objects together and store the vectors
+
+    Args:
+        limit (int): Maximum number of jobs to claim
+        batch_size (int): Texts per forward pass of the model
+
+    Returns:
+        dict: Number of jobs 'claimed', objects 'embedded', jobs 'skipped'
+        (deleted objects, unpublished videos) and 'failed', and the stored
+        embedding rows under 'stored'
+    """
+    jobs = claim_jobs(limit)
+    summary = {'claimed': len(jobs), 'embedded': 0, 'skipped': 0, 'failed': 0, 'stored': []}
+    if not jobs:
+        return summary
+
+    objects = _load_objects(jobs)
+    skipped = [job for job in jobs if job.pk not in objects]
+
+    try:
+        stored = bulk_embed(list(objects.values()), batch_size)
+        error = "Embedding failed or the object has no text"
+    except Exception as e:
+        logger.error(f"Error embedding {len(objects)} queued objects: {e}")
+        stored = []
+        error = str(e)
+
+    video_type_id = ContentType.objects.get_for_model(Video).id
+    stored_keys = {
+        (video_type_id, row.video_id) if isinstance(row, VideoEmbedding) else (row.content_type_id, row.object_id)
+        for row in stored
+    }
+    embedded = [job for job in jobs if job.pk in objects and (job.content_type_id, job.object_id) in stored_keys]
+    failed = [job for job in jobs if job.pk in objects and (job.content_type_id, job.object_id) not in stored_keys]
+
+    _finish_jobs(skipped + embedded)
+    _fail_jobs(failed, error)
+
+    summary.update(embedded=len(embedded), skipped=len(skipped), failed=len(failed), stored=stored)
+    return summary
+
+
+def index_stored_embeddings(stored):
+    """
+    Add freshly stored embeddings to this process's ANN indexes
+
+    bulk_embed sends no post_save signals, so the worker adds the vectors
+    itself; saving the indexes lets the web workers pick them up.
+
+    Args:
+        stored (list): VideoEmbedding and ContentEmbedding rows
+    """
+    from core.ann_index import encode_content_id, get_content_index, get_video_index
+
+    videos = {row.video_id: row for row in stored if isinstance(row, VideoEmbedding) and row.matches_model()}
+    if videos:
+        visible = Video.objects.filter(
+            id__in=list(videos), is_published=True, moderation_status='approved'
+        ).values_list('id', flat=True)
+        rows = [videos[video_id] for video_id in visible]
+        if rows:
+            get_video_index().add([row.video_id for row in rows], [row.get_vector() for row in rows])
+
+    contents = [row for row in stored if not isinstance(row, VideoEmbedding) and row.matches_model()]
+    if contents:
+        get_content_index().add(
+            [encode_content_id(row.content_type_id, row.object_id) for row in contents],
+            [row.get_vector() for row in contents]
+        )
+
+
+def queue_length():
+    """Number of queued embedding jobs, including claimed and failed ones"""
+    return EmbeddingJob.objects.count()
@@ -0,0 +1,327 @@
+import threading
+import logging
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+from django.contrib.contenttypes.models import ContentType
+
+from videos.models import Video
+from core.models import STORED_EMBEDDING_FIELDS, ContentEmbedding, VideoEmbedding
+from core.embedding_store import EMBEDDING_DIMENSION, EMBEDDING_MODEL_NAME
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+MAX_TOKENS = 512  # Longer texts are truncated
+DEFAULT_BATCH_SIZE = 32  # Texts per forward pass
+
+
+class EmbeddingModel:
+    """
+    The transformer shared by recommendations and search.
+
+    Loaded once per process on first use. Texts are embedded by mean pooling
+    the token embeddings over the attention mask and L2-normalising the
+    result (see EMBEDDING_VERSION), so video, blog and post vectors all live
+    in one space and are compared by inner product.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        """Load the tokenizer and model"""
+        try:
+            self.tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+            self.model = AutoModel.from_pretrained(EMBEDDING_MODEL_NAME)
+            # Set model to evaluation mode
+            self.model.eval()
+            logger.info(f"Embedding model {EMBEDDING_MODEL_NAME} loaded successfully")
+        except Exception as e:
+            logger.error(f"Error loading embedding model: {e}")
+            self.tokenizer = None
+            self.model = None
+
+    def embed(self, texts, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Embed texts in batches of similar length
+
+        Texts are tokenised once and sorted by token count, and each batch is
+        padded only to its own longest text, so short texts do not pay for
+        the padding of long ones.
+
+        Args:
+            texts (list): Strings to embed
+            batch_size (int): Texts per forward pass
+
+        Returns:
+            numpy.ndarray: (len(texts), EMBEDDING_DIMENSION) float32 matrix of
+            unit vectors in the order of `texts`; rows for empty texts, or for
+            batches that failed, are zero
+        """
+        vectors = np.zeros((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+        present = np.array([row for row, text in enumerate(texts) if text], dtype=np.int64)
+        if not len(present):
+            return vectors
+
+        if self.model is None or self.tokenizer is None:
+            logger.error("Embedding model not initialized")
+            return vectors
+
+        try:
+            encoded = self.tokenizer([texts[row] for row in present], truncation=True, max_length=MAX_TOKENS)
+        except Exception as e:
+            logger.error(f"Error tokenizing {len(present)} texts: {e}")
+            return vectors
+
+        order = np.argsort([len(input_ids) for input_ids in encoded['input_ids']], kind='stable')
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            try:
+                inputs = self.tokenizer.pad(
+                    {key: [values[position] for position in batch] for key, values in encoded.items()},
+                    return_tensors='pt'
+                )
+                with torch.inference_mode():
+                    outputs = self.model(**inputs)
+                    mask = inputs['attention_mask'].unsqueeze(-1).float()
+                    pooled = ((outputs.last_hidden_state * mask).sum(1) / mask.sum(1).clamp(min=1e-9)).numpy()
+
+                norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                vectors[present[batch]] = pooled / norms
+            except Exception as e:
+                logger.error(f"Error creating embedding for {len(batch)} texts: {e}")
+        return vectors
+
+
+def get_embedding_model():
+    """Get the process-wide embedding model"""
+    return EmbeddingModel.get_instance()
+
+
+def embed_text(text):
+    """
+    Embed one text
+
+    Returns:
+        numpy.ndarray: Unit vector, or a zero vector if the text is empty or embedding failed
+    """
+    return get_embedding_model().embed([text])[0]
+
+
+def video_text(video):
+    """
+    Text a video is embedded from: title (x3), description (x2), tags and categories
+    """
+    metadata = []
+
+    # Title is most important (weight: 3)
+    if video.title:
+        metadata.extend([video.title] * 3)
+
+    # Description is next (weight: 2)
+    if video.description:
+        metadata.extend([video.description] * 2)
+
+    # Tags (weight: 1)
+    try:
+        tags = ' '.join([tag.name for tag in video.tags.all()])
+        if tags:
+            metadata.append(tags)
+    except Exception as e:
+        logger.error(f"Error reading tags of video {video.id}: {e}")
+
+    # Categories (weight: 1)
+    try:
+        categories = ' '.join([cat.name for cat in video.categories.all()])
+        if categories:
+            metadata.append(categories)
+    except Exception as e:
+        logger.error(f"Error reading categories of video {video.id}: {e}")
+
+    return ' '.join(metadata)
+
+
+def content_text(content_object):
+    """
+    Text a blog or post is embedded from
+
+    Returns:
+        str or None: None if the object has no suitable text fields
+    """
+    if hasattr(content_object, 'title') and hasattr(content_object, 'description'):
+        # For content with title and description
+        return f"{content_object.title} {content_object.description}"
+    if hasattr(content_object, 'title') and hasattr(content_object, 'content'):
+        # For blog or similar content with title and content
+        return f"{content_object.title} {content_object.content}"
+    if hasattr(content_object, 'content'):
+        # For post or similar content with only content
+        return content_object.content
+    return None
+
+
+def create_or_update_content_embedding(content_object):
+    """
+    Embed a video, blog or post and store the vector
+
+    Videos are stored in VideoEmbedding, where both recommendations and
+    search read them; other content in ContentEmbedding.
+
+    Returns:
+        VideoEmbedding, ContentEmbedding or None: None if there was nothing to embed
+    """
+    if isinstance(content_object, Video):
+        vector = embed_text(video_text(content_object))
+        if not vector.any():
+            return None
+        return VideoEmbedding.create_from_video(content_object, vector)
+
+    text = content_text(content_object)
+    if not text:
+        return None
+    vector = embed_text(text)
+    if not vector.any():
+        return None
+
+    content_type = ContentType.objects.get_for_model(content_object)
+    content_embedding, created = ContentEmbedding.objects.update_or_create(
+        content_type=content_type,
+        object_id=content_object.id,
+        defaults=ContentEmbedding.encode_fields(vector)
+    )
+    return content_embedding
+
+
+def bulk_embed(objects, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Embed and store many videos, blogs or posts
+
+    Texts go through the model in batches (see EmbeddingModel.embed) and the
+    vectors are written with one upserting bulk_create per table. Fetch
+    videos with prefetch_related('tags', 'categories') so that building
+    their text costs no queries. bulk_create sends no post_save signals, so
+    cached video vectors are invalidated here; ANN indexes pick the new
+    vectors up when they are rebuilt (build_ann_index).
+
+    Args:
+        objects (list): Videos, blogs and posts
+        batch_size (int): Texts per forward pass
+
+    Returns:
+        list: Stored VideoEmbedding and ContentEmbedding rows; objects without
+        text or whose embedding failed are left out
+    """
+    from core.embedding_cache import invalidate_video_embeddings
+
+    model = get_embedding_model()
+    stored = []
+
+    videos = [obj for obj in objects if isinstance(obj, Video)]
+    if videos:
+        vectors = model.embed([video_text(video) for video in videos], batch_size)
+        rows = [
+            VideoEmbedding(video=video, **VideoEmbedding.encode_fields(vector))
+            for video, vector in zip(videos, vectors) if vector.any()
+        ]
+        VideoEmbedding.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['video'],
+            update_fields=STORED_EMBEDDING_FIELDS + ['updated_at']
+        )
+        invalidate_video_embeddings([row.video_id for row in rows])
+        stored.extend(rows)
+
+    others = [(obj, content_text(obj)) for obj in objects if not isinstance(obj, Video)]
+    others = [(obj, text) for obj, text in others if text]
+    if others:
+        vectors = model.embed([text for _, text in others], batch_size)
+        rows = [
+            ContentEmbedding(
+                content_type=ContentType.objects.get_for_model(obj),
+                object_id=obj.id,
+                **ContentEmbedding.encode_fields(vector)
+            )
+            for (obj, _), vector in zip(others, vectors) if vector.any()
+        ]
+        ContentEmbedding.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['content_type', 'object_id'],
+            update_fields=STORED_EMBEDDING_FIELDS + ['updated_at']
+        )
+        stored.extend(rows)
+
+    return stored
+
+
+def semantic_search(query, content_types=None, limit=20):
+    """
+    Perform semantic search using the shared embeddings
+
+    Videos are searched in the video ANN index the recommender also uses;
+    blogs and posts in the content index. The two result lists are merged
+    by similarity.
+
+    Args:
+        query (str): The search query text
+        content_types (list): Optional list of content_type models to search in
+        limit (int): Maximum number of results to return
+
+    Returns:
+        List of (content_object, similarity_score) tuples
+    """
+    from .ann_index import get_content_index, get_video_index, decode_content_id, CONTENT_ID_SHIFT
+
+    query_embedding = embed_text(query)
+    if not query_embedding.any():
+        return []
+
+    video_type_id = ContentType.objects.get_for_model(Video).id
+    if content_types:
+        content_type_ids = {ContentType.objects.get_for_model(model).id for model in content_types}
+    else:
+        content_type_ids = None
+
+    matches = []  # (score, content_type_id, object_id)
+    if content_type_ids is None or video_type_id in content_type_ids:
+        ids, scores = get_video_index().search(query_embedding, limit)
+        matches.extend((score, video_type_id, video_id) for video_id, score in zip(ids.tolist(), scores.tolist()))
+
+    other_type_ids = None if content_type_ids is None else content_type_ids - {video_type_id}
+    if other_type_ids is None or other_type_ids:
+        # Videos are only searched in the video index
+        if other_type_ids is None:
+            search_filter = lambda ids: (ids >> CONTENT_ID_SHIFT) != video_type_id
+        else:
+            search_filter = lambda ids: np.isin(ids >> CONTENT_ID_SHIFT, list(other_type_ids))
+        ids, scores = get_content_index().search(query_embedding, limit, filter=search_filter)
+        matches.extend((score, *decode_content_id(index_id)) for index_id, score in zip(ids.tolist(), scores.tolist()))
+
+    matches.sort(key=lambda match: -match[0])
+    matches = matches[:limit]
+
+    # Load the matched objects with one query per content type
+    objects = {}
+    for content_type_id in {content_type_id for _, content_type_id, _ in matches}:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        object_ids = [object_id for _, ct_id, object_id in matches if ct_id == content_type_id]
+        for object_id, obj in model.objects.in_bulk(object_ids).items():
+            objects[(content_type_id, object_id)] = obj
+
+    return [
+        (objects[(content_type_id, object_id)], float(score))
+        for score, content_type_id, object_id in matches
+        if (content_type_id, object_id) in objects
+    ]
@@ -0,0 +1,149 @@
+import logging
+
+import numpy as np
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"  # Hugging Face model loaded by core.embedding_service
+EMBEDDING_POOLING = 'mean'  # Sentence vector = attention-masked mean of the token embeddings
+EMBEDDING_VERSION = f"{EMBEDDING_MODEL_NAME}:{EMBEDDING_POOLING}"  # Recorded with every stored vector
+EMBEDDING_DIMENSION = 384  # Output size of EMBEDDING_MODEL_NAME
+DEFAULT_ENCODING = 'float16'  # Half the size of float32, ~1e-3 relative error
+NORMALIZED_TOLERANCE = 1e-3  # A vector counts as unit length when its norm is within this of 1
+INT8_LEVELS = 127  # Codes run from -127 to 127, so the midpoint of the range encodes exactly
+
+ENCODING_CHOICES = (
+    ('float32', 'float32 (4 bytes per value)'),
+    ('float16', 'float16 (2 bytes per value)'),
+    ('int8', 'int8 with scale and offset (1 byte per value)'),
+)
+
+_DTYPES = {
+    'float32': np.float32,
+    'float16': np.float16,
+    'int8': np.int8,
+}
+
+
+class EmbeddingDimensionError(ValueError):
+    """A stored vector does not have the dimension recorded for it"""
+
+
+def is_normalized(vector):
+    """Whether `vector` has unit length"""
+    return abs(float(np.linalg.norm(vector)) - 1.0) <= NORMALIZED_TOLERANCE
+
+
+def encode_vector(vector, encoding=DEFAULT_ENCODING):
+    """
+    Serialize a vector for storage
+
+    int8 maps the vector's [min, max] range linearly onto [-127, 127];
+    the scale and offset needed to undo that are returned with the bytes.
+
+    Args:
+        vector (numpy.ndarray): Embedding to store
+        encoding (str): One of ENCODING_CHOICES
+
+    Returns:
+        tuple: (bytes, scale, offset)
+    """
+    if encoding not in _DTYPES:
+        raise ValueError(f"Unknown embedding encoding: {encoding}")
+
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    if encoding != 'int8':
+        return vector.astype(_DTYPES[encoding]).tobytes(), 1.0, 0.0
+
+    if not len(vector):
+        return b'', 1.0, 0.0
+    low, high = float(vector.min()), float(vector.max())
+    offset = (high + low) / 2
+    scale = (high - low) / (2 * INT8_LEVELS) or 1.0
+    codes = np.clip(np.rint((vector - offset) / scale), -INT8_LEVELS, INT8_LEVELS).astype(np.int8)
+    return codes.tobytes(), scale, offset
+
+
+def decode_vector(data, encoding='float32', dimension=0, scale=1.0, offset=0.0):
+    """
+    Deserialize a stored vector into float32
+
+    Args:
+        data (bytes): Stored payload
+        encoding (str): Encoding the payload was written with
+        dimension (int): Recorded dimension; 0 for rows written before it was recorded
+        scale, offset (float): int8 dequantization parameters
+
+    Returns:
+        numpy.ndarray: float32 vector
+
+    Raises:
+        EmbeddingDimensionError: If the payload does not hold `dimension` values
+    """
+    if encoding not in _DTYPES:
+        raise ValueError(f"Unknown embedding encoding: {encoding}")
+
+    dtype = np.dtype(_DTYPES[encoding])
+    data = bytes(data)
+    if len(data) % dtype.itemsize:
+        raise EmbeddingDimensionError(
+            f"{len(data)} bytes is not a whole number of {encoding} values"
+        )
+    if dimension and len(data) != dimension * dtype.itemsize:
+        raise EmbeddingDimensionError(
+            f"Expected {dimension} {encoding} values, found {len(data) // dtype.itemsize}"
+        )
+
+    vector = np.frombuffer(data, dtype=dtype)
+    if encoding == 'int8':
+        return (vector.astype(np.float32) * np.float32(scale) + np.float32(offset)).astype(np.float32)
+    return vector.astype(np.float32)
+
+
+# Columns needed to decode a stored vector, in decode_vector's argument order
+ENCODED_FIELDS = ('embedding_vector', 'encoding', 'dimension', 'quant_scale', 'quant_offset')
+
+
+def decode_rows(rows, model_name=EMBEDDING_VERSION, dimension=None, label='embeddings'):
+    """
+    Decode `values_list(key, *ENCODED_FIELDS, 'model_name', ...)` rows
+
+    Rows from another model or pooling (including rows written before the
+    model was recorded), rows whose payload does not match their recorded
+    dimension and (when `dimension` is given) rows of another dimension are
+    skipped and counted in one warning, instead of mixing vector spaces or
+    failing later on a shape mismatch.
+
+    Args:
+        rows (iterable): Tuples of (key, data, encoding, dimension, scale, offset, model_name, *extra)
+        model_name (str): Model version the caller's vectors must come from
+        dimension (int): Dimension the caller expects, or None to accept any
+        label (str): What the rows are, for the warning
+
+    Returns:
+        list: (key, vector, *extra) tuples
+    """
+    decoded = []
+    skipped = 0
+    for key, data, encoding, row_dimension, scale, offset, row_model, *extra in rows:
+        if row_model != model_name:
+            skipped += 1
+            continue
+        try:
+            vector = decode_vector(data, encoding, row_dimension, scale, offset)
+        except EmbeddingDimensionError:
+            skipped += 1
+            continue
+        if dimension is not None and len(vector) != dimension:
+            skipped += 1
+            continue
+        decoded.append((key, vector, *extra))
+
+    if skipped:
+        logger.warning(
+            f"Skipped {skipped} {label} from another model or with an unexpected dimension "
+            f"(expected {model_name}, {dimension or 'any'}-d); regenerate them with generate_embeddings"
+        )
+    return decoded
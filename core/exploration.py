@@ -0,0 +1,155 @@
+import threading
+import time
+import logging
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from videos.models import Video
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+RECENT_DAYS = 30  # Videos newer than this are sampled first
+REBUILD_INTERVAL = 60 * 60  # Seconds between full rebuilds (moves ageing videos out of the recent bucket)
+OVERSAMPLE = 2  # Draws per missing sample in each rejection round
+MAX_DRAW_ROUNDS = 4  # Rejection rounds before falling back to filtering the whole bucket
+BUCKETS = ('recent', 'older')
+
+
+class ExplorationSampler:
+    """
+    Process-wide arrays of explorable video IDs, one per freshness bucket.
+
+    Published, approved videos are split into 'recent' and 'older' buckets of
+    dense ID arrays. Sampling draws random positions with NumPy and rejects
+    watched or repeated IDs, so drawing k videos costs O(k) instead of an
+    ORDER BY RANDOM() over the catalogue. Arrays are replaced rather than
+    modified, so samplers read them without locking; publish and unpublish
+    events update them through signals.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        """Initialize empty buckets; they are loaded lazily on first use"""
+        self._lock = threading.Lock()
+        self.buckets = {bucket: np.zeros(0, dtype=np.int64) for bucket in BUCKETS}
+        self.built_at = 0.0
+        self.rng = np.random.default_rng()
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.buckets.values())
+
+    @staticmethod
+    def bucket_for(created_at):
+        """Freshness bucket of a video created at `created_at`"""
+        return 'recent' if created_at >= timezone.now() - timedelta(days=RECENT_DAYS) else 'older'
+
+    def build(self):
+        """Load the IDs of every explorable video from the database"""
+        recent_cutoff = timezone.now() - timedelta(days=RECENT_DAYS)
+        eligible = Video.objects.filter(is_published=True, moderation_status='approved')
+        buckets = {
+            'recent': np.fromiter(eligible.filter(created_at__gte=recent_cutoff).values_list('id', flat=True), dtype=np.int64),
+            'older': np.fromiter(eligible.filter(created_at__lt=recent_cutoff).values_list('id', flat=True), dtype=np.int64),
+        }
+        with self._lock:
+            self.buckets = buckets
+            self.built_at = time.monotonic()
+        logger.info(f"Built exploration sampler with {len(self)} videos")
+
+    def refresh(self):
+        """Rebuild on first use and every REBUILD_INTERVAL"""
+        if self.built_at == 0.0 or time.monotonic() - self.built_at > REBUILD_INTERVAL:
+            self.build()
+
+    def add(self, video_id, created_at):
+        """Make a newly published or approved video explorable"""
+        if self.built_at == 0.0:
+            return
+        video_id = int(video_id)
+        bucket = self.bucket_for(created_at)
+        with self._lock:
+            if (self.buckets[bucket] == video_id).any():
+                return
+            buckets = self._without(self.buckets, video_id)
+            buckets[bucket] = np.append(buckets[bucket], np.int64(video_id))
+            self.buckets = buckets
+
+    def remove(self, video_id):
+        """Stop sampling an unpublished, rejected or deleted video"""
+        if self.built_at == 0.0:
+            return
+        with self._lock:
+            self.buckets = self._without(self.buckets, int(video_id))
+
+    @staticmethod
+    def _without(buckets, video_id):
+        """Copy of `buckets` without `video_id`"""
+        return {
+            bucket: ids[ids != video_id] if (ids == video_id).any() else ids
+            for bucket, ids in buckets.items()
+        }
+
+    def _sample_bucket(self, ids, num_videos, exclude):
+        """
+        Draw up to `num_videos` distinct IDs from one bucket, skipping `exclude`
+
+        Rejection sampling keeps the cost proportional to `num_videos`; when the
+        bucket is small relative to the request or mostly excluded, it filters
+        the bucket once and shuffles instead.
+        """
+        if num_videos <= 0 or not len(ids):
+            return []
+
+        chosen = []
+        seen = set(exclude)
+        if num_videos * OVERSAMPLE < len(ids) and len(exclude) < len(ids) // 2:
+            for _ in range(MAX_DRAW_ROUNDS):
+                draws = ids[self.rng.integers(0, len(ids), size=(num_videos - len(chosen)) * OVERSAMPLE)]
+                for video_id in draws.tolist():
+                    if video_id not in seen:
+                        seen.add(video_id)
+                        chosen.append(video_id)
+                        if len(chosen) == num_videos:
+                            return chosen
+
+        remaining = ids[~np.isin(ids, np.fromiter(seen, dtype=np.int64, count=len(seen)))]
+        chosen.extend(self.rng.permutation(remaining)[:num_videos - len(chosen)].tolist())
+        return chosen
+
+    def sample(self, num_videos, exclude=()):
+        """
+        Draw random explorable videos, recent ones first
+
+        Args:
+            num_videos (int): Number of IDs to draw
+            exclude (set): IDs that must not be drawn (e.g. watched videos)
+
+        Returns:
+            list: Up to `num_videos` distinct video IDs
+        """
+        self.refresh()
+        buckets = self.buckets
+        exclude = set(exclude)
+
+        chosen = self._sample_bucket(buckets['recent'], num_videos, exclude)
+        if len(chosen) < num_videos:
+            chosen += self._sample_bucket(buckets['older'], num_videos - len(chosen), exclude)
+        return chosen
+
+
+def get_exploration_sampler():
+    """Get the process-wide exploration sampler"""
+    return ExplorationSampler.get_instance()
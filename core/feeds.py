@@ -0,0 +1,205 @@
+import base64
+import json
+import logging
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+from videos.models import Video
+from core.models import TrendingScore
+from core.recommender import ContextualBanditRecommender, get_ranked_video_ids
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+FEED_PAGE_SIZE = 24  # Video cards per feed page
+MAX_FEED_PAGE_SIZE = 60
+FEED_TYPES = ('for_you', 'trending', 'latest')
+
+
+# Keyset fields a cursor of each feed may carry, with a parser for their JSON value
+CURSOR_FIELDS = {
+    'for_you': {},
+    'trending': {'trending': float, 'views': int},
+    'latest': {'created_at': parse_datetime},
+}
+
+
+def encode_cursor(position):
+    """Encode a feed position as an opaque URL-safe cursor"""
+    raw = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _parse_int(value):
+    """int(value) for JSON integers only (not booleans, floats or strings)"""
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"Expected an integer, got {value!r}")
+    return value
+
+
+def _parse_keyset_value(parser, value):
+    """Parse a keyset value, rejecting values of the wrong JSON type"""
+    if parser is parse_datetime:
+        if not isinstance(value, str) or parse_datetime(value) is None:
+            raise ValueError(f"Expected a datetime, got {value!r}")
+        return parse_datetime(value)
+    if parser is int:
+        return _parse_int(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"Expected a number, got {value!r}")
+    return float(value)
+
+
+def decode_cursor(cursor, feed_type=None):
+    """
+    Decode and validate a cursor produced by encode_cursor
+
+    The cursor must belong to `feed_type` (when given), carry a non-negative
+    integer offset and, for keyset feeds, an integer id with a keyset value
+    of the right type. Keyset datetimes are returned parsed.
+
+    Returns:
+        dict or None: The position, or None for a missing, malformed or foreign
+        cursor (callers then serve the first page)
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(position, dict):
+            raise ValueError("Cursor is not an object")
+        if feed_type is not None and position.get('feed') != feed_type:
+            raise ValueError(f"Cursor belongs to feed {position.get('feed')!r}")
+
+        decoded = {'feed': position.get('feed'), 'offset': _parse_int(position.get('offset', 0))}
+        if decoded['offset'] < 0:
+            raise ValueError("Negative offset")
+
+        fields = CURSOR_FIELDS.get(position.get('feed'), {})
+        keyset = [field for field in fields if field in position]
+        if len(keyset) > 1:
+            raise ValueError("Cursor carries several keyset fields")
+        if keyset:
+            field = keyset[0]
+            decoded[field] = _parse_keyset_value(fields[field], position[field])
+            decoded['id'] = _parse_int(position.get('id'))
+        return decoded
+    except (ValueError, TypeError):
+        logger.warning(f"Ignoring malformed feed cursor: {cursor!r}")
+        return None
+
+
+def get_cursor_offset(cursor, feed_type=None):
+    """Position of the first video on the page a cursor points to (0 for the first page)"""
+    return (decode_cursor(cursor, feed_type) or {}).get('offset', 0)
+
+
+def _ranked_page(ranked_ids, position, page_size, feed_type):
+    """A page of a ranked id list, addressed by offset"""
+    offset = position['offset'] if position else 0
+    videos = ContextualBanditRecommender().hydrate_ranked(ranked_ids, offset, page_size)
+    end = offset + page_size
+    next_cursor = encode_cursor({'feed': feed_type, 'offset': end}) if end < len(ranked_ids) else None
+    return videos, next_cursor
+
+
+def _keyset_page(queryset, field, position, page_size, feed_type, offset=0):
+    """
+    A page of `queryset` ordered by (field, id) descending, starting after `position`
+
+    Uses a keyset predicate instead of OFFSET so deep pages cost the same as the first.
+    The cursor also carries the running offset, which is only used to number slots.
+    """
+    if position and field in position:
+        value = position[field]
+        queryset = queryset.filter(
+            Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': position['id']})
+        )
+
+    videos = list(queryset.order_by(f'-{field}', '-id').select_related('creator')[:page_size + 1])
+    next_cursor = None
+    if len(videos) > page_size:
+        videos = videos[:page_size]
+        last = videos[-1]
+        value = getattr(last, field)
+        next_cursor = encode_cursor({
+            'feed': feed_type,
+            field: value.isoformat() if field == 'created_at' else value,
+            'id': last.id,
+            'offset': offset + page_size
+        })
+    return videos, next_cursor
+
+
+def _trending_page(position, page_size):
+    """
+    A page of the trending feed
+
+    Videos with a trending score come first, by score; the feed then
+    continues with the remaining videos by all-time views. Before
+    refresh_trending has run, every video is ordered by views.
+    """
+    offset = position['offset'] if position else 0
+    published = Video.objects.filter(is_published=True)
+    if not TrendingScore.objects.exists():
+        return _keyset_page(published, 'views', position, page_size, 'trending', offset)
+
+    videos, next_cursor = [], None
+    if position is None or 'trending' in position:
+        scored = published.filter(trending_score__isnull=False).annotate(trending=F('trending_score__score'))
+        videos, next_cursor = _keyset_page(scored, 'trending', position, page_size, 'trending', offset)
+        position = None  # The unscored tail starts from its beginning
+
+    if next_cursor is None:
+        unscored = published.filter(trending_score__isnull=True)
+        remaining = page_size - len(videos)
+        if remaining:
+            tail, next_cursor = _keyset_page(unscored, 'views', position, remaining, 'trending', offset + len(videos))
+            videos += tail
+        elif unscored.exists():
+            # A cursor without a keyset value points at the start of the tail
+            next_cursor = encode_cursor({'feed': 'trending', 'offset': offset + len(videos)})
+    return videos, next_cursor
+
+
+def get_feed_page(feed_type, user=None, cursor=None, page_size=FEED_PAGE_SIZE):
+    """
+    Get one page of a home feed
+
+    'for_you' pages through the user's cached ranked recommendation list (the
+    popular list for anonymous users); 'trending' and 'latest' use keyset
+    pagination on (trending score, id), then (views, id), and (created_at, id).
+    Cursors that are malformed or belong to another feed give the first page.
+
+    Args:
+        feed_type (str): 'for_you', 'trending' or 'latest'
+        user (User): Requesting user (None or anonymous for logged-out visitors)
+        cursor (str): Cursor from the previous page, or None for the first page
+        page_size (int): Number of videos per page
+
+    Returns:
+        tuple: (videos, next_cursor, is_personalized); next_cursor is None on the last page
+    """
+    page_size = max(1, min(page_size, MAX_FEED_PAGE_SIZE))
+    position = decode_cursor(cursor, feed_type)
+
+    if feed_type == 'trending':
+        videos, next_cursor = _trending_page(position, page_size)
+        return videos, next_cursor, False
+
+    if feed_type == 'latest':
+        offset = position['offset'] if position else 0
+        videos, next_cursor = _keyset_page(
+            Video.objects.filter(is_published=True), 'created_at', position, page_size, feed_type, offset
+        )
+        return videos, next_cursor, False
+
+    if user is not None and user.is_authenticated:
+        videos, next_cursor = _ranked_page(get_ranked_video_ids(user.id), position, page_size, feed_type)
+        return videos, next_cursor, True
+
+    videos, next_cursor = _ranked_page(ContextualBanditRecommender().get_popular_video_ids(), position, page_size, feed_type)
+    return videos, next_cursor, False
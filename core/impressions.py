@@ -0,0 +1,182 @@
+import atexit
+import threading
+import logging
+from collections import Counter, deque
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.utils import timezone
+
+from videos.models import Video
+from core.models import Impression
+from core.bandit_buffer import get_bandit_buffer
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+FLUSH_INTERVAL = 10  # Seconds between background flushes
+FLUSH_THRESHOLD = 2000  # Flush early once this many impressions are buffered
+MAX_BUFFERED_IMPRESSIONS = 50000  # Ring buffer size; the oldest impressions are dropped beyond this
+INSERT_BATCH_SIZE = 1000  # Rows per bulk INSERT
+
+
+class ImpressionLogger:
+    """
+    In-process ring buffer of rendered recommendations.
+
+    Views append (user, video, slot, source, timestamp) tuples, which costs a
+    lock and a deque append per page. A background thread drains the buffer,
+    writes the impressions with bulk_create and passes per-video impression
+    counts to the bandit update buffer. If the database falls behind, the
+    oldest impressions are dropped rather than growing memory or blocking
+    requests.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+                    atexit.register(cls._instance.flush)
+        return cls._instance
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD, capacity=MAX_BUFFERED_IMPRESSIONS):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = deque(maxlen=capacity)
+        self._flusher = None
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def record(self, user_id, video_ids, source, first_slot=0):
+        """
+        Buffer impressions for a rendered list of videos
+
+        Args:
+            user_id (int): ID of the viewer, or None for anonymous visitors
+            video_ids (list): IDs of the videos, in display order
+            source (str): Where the list was shown, e.g. 'for_you' or 'related'
+            first_slot (int): Slot of the first video (the offset of a feed page)
+        """
+        shown_at = timezone.now()
+        with self._lock:
+            overflow = len(self._buffer) + len(video_ids) - self._buffer.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self._buffer.extend(
+                (user_id, int(video_id), first_slot + slot, source, shown_at)
+                for slot, video_id in enumerate(video_ids)
+            )
+            pending = len(self._buffer)
+
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name='impression-flusher', daemon=True)
+                self._flusher.start()
+
+        if pending >= self.flush_threshold:
+            self._wakeup.set()
+
+    def _run_flusher(self):
+        """Flush periodically (or early when woken) off the request threads"""
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in impression flusher: {e}")
+            finally:
+                connection.close()
+
+    def flush(self):
+        """
+        Write all buffered impressions to the database
+
+        Returns:
+            int: Number of impressions written
+        """
+        with self._lock:
+            pending = list(self._buffer)
+            self._buffer.clear()
+            dropped, self.dropped = self.dropped, 0
+
+        if dropped:
+            logger.warning(f"Impression buffer overflowed; dropped {dropped} impressions")
+
+        if not pending:
+            return 0
+
+        with self._flush_lock:
+            try:
+                return write_impressions(pending)
+            except Exception as e:
+                logger.error(f"Error writing {len(pending)} impressions: {e}")
+                return 0
+
+
+def write_impressions(impressions):
+    """
+    Insert a batch of impressions and queue their bandit impression counts
+
+    Impressions of videos or users deleted since rendering are skipped. Only
+    logged-in impressions are counted for the bandit, since clicks are only
+    recorded for logged-in users.
+
+    Args:
+        impressions (list): (user_id, video_id, slot, source, shown_at) tuples
+
+    Returns:
+        int: Number of impressions written
+    """
+    video_ids = set(Video.objects.filter(
+        id__in={video_id for _, video_id, _, _, _ in impressions}
+    ).values_list('id', flat=True))
+    user_ids = set(get_user_model().objects.filter(
+        id__in={user_id for user_id, _, _, _, _ in impressions if user_id is not None}
+    ).values_list('id', flat=True))
+
+    rows = [
+        Impression(user_id=user_id, video_id=video_id, slot=slot, source=source, shown_at=shown_at)
+        for user_id, video_id, slot, source, shown_at in impressions
+        if video_id in video_ids and (user_id is None or user_id in user_ids)
+    ]
+    Impression.objects.bulk_create(rows, batch_size=INSERT_BATCH_SIZE)
+
+    counts = Counter(row.video_id for row in rows if row.user_id is not None)
+    if counts:
+        get_bandit_buffer().record_impressions(counts)
+
+    return len(rows)
+
+
+def get_impression_logger():
+    """Get the process-wide impression logger"""
+    return ImpressionLogger.get_instance()
+
+
+def log_impressions(user, videos, source, first_slot=0):
+    """
+    Record that a list of videos was rendered to a user
+
+    Never raises, so a logging problem can't break the page.
+
+    Args:
+        user (User): Requesting user (anonymous users are logged without a user)
+        videos (iterable): Video objects in display order
+        source (str): Where the list was shown, e.g. 'for_you' or 'related'
+        first_slot (int): Slot of the first video
+    """
+    try:
+        user_id = user.id if user is not None and user.is_authenticated else None
+        get_impression_logger().record(user_id, [video.id for video in videos], source, first_slot)
+    except Exception as e:
+        logger.error(f"Error logging impressions for {source}: {e}")
@@ -0,0 +1,371 @@
+import os
+import threading
+import time
+import logging
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from videos.models import VideoView
+from core.models import Like
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_NEIGHBORS = 50  # Similar videos kept per video
+LIKE_INTERACTION_WEIGHT = 2.0  # A like counts as much as ~6 repeat views
+BLOCK_SIZE = 2048  # Videos per block when computing similarities (bounds peak memory)
+RELOAD_CHECK_INTERVAL = 60  # Seconds between checks for a newer model file on disk
+MODEL_FILENAME = 'item_similarity.npz'
+
+
+def get_model_path():
+    """Path of the persisted item-item similarity model"""
+    base_dir = getattr(settings, 'RECOMMENDER_DATA_DIR', os.path.join(settings.BASE_DIR, 'recommender_data'))
+    return os.path.join(base_dir, MODEL_FILENAME)
+
+
+def load_interactions(user_ids=None):
+    """
+    Build the implicit-feedback user x video matrix
+
+    Each cell is log(1 + views) plus LIKE_INTERACTION_WEIGHT if the user liked
+    the video. Anonymous views are ignored.
+
+    Args:
+        user_ids (list): Restrict to these users (all users if None)
+
+    Returns:
+        tuple: (user_ids, video_ids, scipy.sparse.csr_matrix) with rows/columns
+        aligned to the sorted id arrays
+    """
+    views = VideoView.objects.filter(user__isnull=False)
+    likes = Like.objects.filter(video__isnull=False)
+    if user_ids is not None:
+        views = views.filter(user_id__in=user_ids)
+        likes = likes.filter(user_id__in=user_ids)
+
+    view_rows = np.array(
+        list(views.values_list('user_id', 'video_id').annotate(n=Count('id')).order_by()),
+        dtype=np.int64
+    ).reshape(-1, 3)
+    like_rows = np.array(list(likes.values_list('user_id', 'video_id')), dtype=np.int64).reshape(-1, 2)
+
+    users = np.concatenate([view_rows[:, 0], like_rows[:, 0]])
+    videos = np.concatenate([view_rows[:, 1], like_rows[:, 1]])
+    weights = np.concatenate([
+        np.log1p(view_rows[:, 2]).astype(np.float32),
+        np.full(len(like_rows), LIKE_INTERACTION_WEIGHT, dtype=np.float32)
+    ])
+
+    user_index, rows = np.unique(users, return_inverse=True)
+    video_index, cols = np.unique(videos, return_inverse=True)
+
+    # Duplicate (user, video) pairs are summed by the CSR conversion
+    matrix = sparse.csr_matrix(
+        (weights, (rows, cols)),
+        shape=(len(user_index), len(video_index)),
+        dtype=np.float32
+    )
+    return user_index, video_index, matrix
+
+
+def column_norms(matrix):
+    """L2 norm of every column of a sparse matrix"""
+    return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()).astype(np.float32)
+
+
+def top_neighbors(similarity, row_video_ids, col_video_ids, num_neighbors):
+    """
+    Keep the strongest `num_neighbors` entries of every row of a sparse similarity block
+
+    Returns:
+        tuple: (source_ids, neighbor_ids, scores) as flat COO arrays
+    """
+    similarity = similarity.tocoo()
+    keep = similarity.data > 0
+    rows, cols, data = similarity.row[keep], similarity.col[keep], similarity.data[keep]
+    sources = row_video_ids[rows]
+    neighbors = col_video_ids[cols]
+
+    # Drop self-similarity
+    keep = sources != neighbors
+    return truncate_neighbors(sources[keep], neighbors[keep], data[keep], num_neighbors)
+
+
+def truncate_neighbors(sources, neighbors, scores, num_neighbors):
+    """Sort COO entries by (source, -score) and keep the first `num_neighbors` per source"""
+    order = np.lexsort((-scores, sources))
+    sources, neighbors, scores = sources[order], neighbors[order], scores[order]
+
+    starts = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]]) if len(sources) else np.zeros(0, dtype=np.int64)
+    run_lengths = np.diff(np.r_[starts, len(sources)])
+    rank = np.arange(len(sources)) - np.repeat(starts, run_lengths)
+    keep = rank < num_neighbors
+    return sources[keep], neighbors[keep], scores[keep]
+
+
+class ItemSimilarityModel:
+    """
+    Top-N item-item cosine neighbours computed from views and likes.
+
+    Stored compactly as CSR-style arrays: sorted `video_ids`, `indptr` into the
+    flat `neighbor_ids` (int64) and `scores` (float16). Column norms of the
+    interaction matrix are kept alongside so that new interactions only require
+    recomputing the rows of the videos they touch.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, num_neighbors=DEFAULT_NEIGHBORS):
+        self.num_neighbors = num_neighbors
+        self.video_ids = np.zeros(0, dtype=np.int64)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.neighbor_ids = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0, dtype=np.float16)
+        self.watermark = None
+        self.loaded_mtime = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    @property
+    def is_empty(self):
+        return len(self.neighbor_ids) == 0
+
+    def _set_entries(self, video_ids, norms, sources, neighbors, scores):
+        """
+        Swap in new neighbour lists
+
+        Args:
+            video_ids (numpy.ndarray): Sorted ids of every video in the model
+            norms (numpy.ndarray): Interaction column norm per video
+            sources, neighbors, scores (numpy.ndarray): COO entries sorted by (source, -score)
+        """
+        counts = np.bincount(np.searchsorted(video_ids, sources), minlength=len(video_ids))
+        with self._lock:
+            self.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            self.neighbor_ids = neighbors.astype(np.int64)
+            self.scores = scores.astype(np.float16)
+            self.video_ids = video_ids
+            self.norms = norms
+
+    def _entries(self):
+        """Current neighbour lists as flat COO arrays"""
+        counts = np.diff(self.indptr)
+        sources = np.repeat(self.video_ids, counts)
+        return sources, self.neighbor_ids, self.scores.astype(np.float32)
+
+    def build(self):
+        """Compute the model from scratch over all interactions"""
+        started_at = timezone.now()
+        _, video_ids, interactions = load_interactions()
+
+        norms = column_norms(interactions)
+        normalized = interactions @ sparse.diags(1.0 / np.maximum(norms, 1e-12))
+        normalized = normalized.tocsc()
+
+        parts = []
+        for start in range(0, len(video_ids), BLOCK_SIZE):
+            block = normalized[:, start:start + BLOCK_SIZE]
+            similarity = block.T @ normalized
+            parts.append(top_neighbors(similarity, video_ids[start:start + BLOCK_SIZE], video_ids, self.num_neighbors))
+
+        sources, neighbors, scores = self._concat(parts)
+        self._set_entries(video_ids, norms, sources, neighbors, scores)
+        self.watermark = started_at
+
+        logger.info(f"Built item similarity model for {len(video_ids)} videos ({len(neighbors)} neighbour entries)")
+
+    def update(self):
+        """
+        Fold in interactions recorded since the last build or update
+
+        Only the rows of videos with new views or likes are recomputed, using the
+        interactions of the users who touched them. Their scores are then merged
+        into the lists of the other videos, since cosine similarity is symmetric.
+        Lists that lose a neighbour are not back-filled until the next full rebuild.
+
+        Returns:
+            int: Number of videos whose neighbours were recomputed
+        """
+        if self.watermark is None:
+            self.build()
+            return len(self.video_ids)
+
+        started_at = timezone.now()
+        touched = np.unique(np.array(
+            list(VideoView.objects.filter(user__isnull=False, created_at__gt=self.watermark).values_list('video_id', flat=True).distinct()) +
+            list(Like.objects.filter(video__isnull=False, created_at__gt=self.watermark).values_list('video_id', flat=True).distinct()),
+            dtype=np.int64
+        ))
+        if not len(touched):
+            self.watermark = started_at
+            return 0
+
+        touching_users = list(
+            VideoView.objects.filter(video_id__in=touched.tolist(), user__isnull=False).values_list('user_id', flat=True).distinct()
+        ) + list(
+            Like.objects.filter(video_id__in=touched.tolist()).values_list('user_id', flat=True).distinct()
+        )
+        _, video_ids, interactions = load_interactions(user_ids=sorted(set(touching_users)))
+
+        # Norms: fresh for the touched videos (all of their interactions are loaded),
+        # stored for the rest (their columns did not change)
+        all_ids = np.union1d(self.video_ids, video_ids)
+        norms = np.zeros(len(all_ids), dtype=np.float32)
+        norms[np.searchsorted(all_ids, self.video_ids)] = self.norms
+        touched_columns = np.flatnonzero(np.isin(video_ids, touched))
+        interactions = interactions.tocsc()
+        norms[np.searchsorted(all_ids, video_ids[touched_columns])] = column_norms(interactions[:, touched_columns])
+
+        loaded_norms = norms[np.searchsorted(all_ids, video_ids)]
+        normalized = (interactions @ sparse.diags(1.0 / np.maximum(loaded_norms, 1e-12))).tocsc()
+        similarity = normalized[:, touched_columns].T @ normalized
+        new_sources, new_neighbors, new_scores = top_neighbors(
+            similarity, video_ids[touched_columns], video_ids, self.num_neighbors
+        )
+
+        # Drop every stale pair involving a touched video, then add the new pairs in
+        # both directions (pairs between two touched videos are already present twice)
+        sources, neighbors, scores = self._entries()
+        keep = ~np.isin(sources, touched) & ~np.isin(neighbors, touched)
+        mirrored = ~np.isin(new_neighbors, touched)
+        sources, neighbors, scores = truncate_neighbors(
+            np.concatenate([sources[keep], new_sources, new_neighbors[mirrored]]),
+            np.concatenate([neighbors[keep], new_neighbors, new_sources[mirrored]]),
+            np.concatenate([scores[keep], new_scores, new_scores[mirrored]]),
+            self.num_neighbors
+        )
+
+        self._set_entries(all_ids, norms, sources, neighbors, scores)
+        self.watermark = started_at
+
+        logger.info(f"Updated item similarity neighbours for {len(touched)} videos")
+        return len(touched)
+
+    @staticmethod
+    def _concat(parts):
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def score(self, seed_ids, seed_weights=None):
+        """
+        Sum the neighbour scores of a set of seed videos
+
+        Args:
+            seed_ids (array-like): Videos the user interacted with
+            seed_weights (array-like): Optional weight per seed
+
+        Returns:
+            tuple: (video_ids, scores) of every neighbour reached, unsorted
+        """
+        with self._lock:
+            video_ids, indptr, neighbor_ids, scores = self.video_ids, self.indptr, self.neighbor_ids, self.scores
+
+        seed_ids = np.asarray(seed_ids, dtype=np.int64)
+        if seed_weights is None:
+            seed_weights = np.ones(len(seed_ids), dtype=np.float32)
+        seed_weights = np.asarray(seed_weights, dtype=np.float32)
+
+        positions = np.searchsorted(video_ids, seed_ids)
+        positions = np.minimum(positions, max(len(video_ids) - 1, 0))
+        known = (video_ids[positions] == seed_ids) if len(video_ids) else np.zeros(len(seed_ids), dtype=bool)
+        positions, seed_weights = positions[known], seed_weights[known]
+        if not len(positions):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        # Gather the neighbour slices of every seed and sum the scores per neighbour
+        starts, ends = indptr[positions], indptr[positions + 1]
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(np.r_[0, lengths[:-1]]), lengths) + np.arange(lengths.sum())
+        gathered_ids = neighbor_ids[offsets]
+        gathered_scores = scores[offsets].astype(np.float32) * np.repeat(seed_weights, lengths)
+
+        unique_ids, inverse = np.unique(gathered_ids, return_inverse=True)
+        return unique_ids, np.bincount(inverse, weights=gathered_scores).astype(np.float32)
+
+    def save(self):
+        """Persist the model atomically"""
+        path = get_model_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    video_ids=self.video_ids,
+                    norms=self.norms,
+                    indptr=self.indptr,
+                    neighbor_ids=self.neighbor_ids,
+                    scores=self.scores,
+                    num_neighbors=np.array(self.num_neighbors),
+                    watermark=np.array(self.watermark.isoformat() if self.watermark else '')
+                )
+        os.replace(tmp_path, path)
+        self.loaded_mtime = os.path.getmtime(path)
+
+    def load(self):
+        """
+        Load the model from disk if a newer file is available
+
+        Returns:
+            bool: Whether a model is available
+        """
+        path = get_model_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return not self.is_empty
+
+        if self.loaded_mtime is not None and mtime <= self.loaded_mtime:
+            return True
+
+        data = np.load(path)
+        watermark = str(data['watermark'])
+        with self._lock:
+            self.video_ids = data['video_ids']
+            self.norms = data['norms']
+            self.indptr = data['indptr']
+            self.neighbor_ids = data['neighbor_ids']
+            self.scores = data['scores']
+            self.num_neighbors = int(data['num_neighbors'])
+            self.watermark = datetime.fromisoformat(watermark) if watermark else None
+            self.loaded_mtime = mtime
+        logger.info(f"Loaded item similarity model for {len(self.video_ids)} videos from {path}")
+        return True
+
+    def ensure_loaded(self):
+        """Pick up the model file on first use and whenever a newer one is written"""
+        now = time.monotonic()
+        if self.loaded_mtime is not None and now - self.checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        self.load()
+
+
+def get_item_similarity_model():
+    """Get the shared item-item model, loading it from disk if needed"""
+    model = ItemSimilarityModel.get_instance()
+    try:
+        model.ensure_loaded()
+    except Exception as e:
+        logger.error(f"Error loading item similarity model: {e}")
+    return model
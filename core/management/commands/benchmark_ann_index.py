@@ -0,0 +1,109 @@
+from django.core.management.base import BaseCommand
+from core.ann_index import ANNIndex, load_video_vectors, normalize_rows, FAISS_AVAILABLE
+from core.embedding_matrix import EmbeddingMatrix
+import numpy as np
+import time
+
+
+class Command(BaseCommand):
+    help = 'Measure recall and latency of the ANN index against exact brute-force scoring'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            default=0,
+            help='Benchmark on N synthetic clustered vectors instead of stored video embeddings'
+        )
+        parser.add_argument(
+            '--dimension',
+            type=int,
+            default=384,
+            help='Dimension of synthetic vectors'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=200,
+            help='Number of queries to run'
+        )
+        parser.add_argument(
+            '--k',
+            type=int,
+            default=10,
+            help='Number of neighbours per query'
+        )
+        parser.add_argument(
+            '--nprobe',
+            default='1,2,4,8,16,32',
+            help='Comma-separated list of nprobe values to evaluate'
+        )
+        parser.add_argument(
+            '--numpy',
+            action='store_true',
+            help='Use the NumPy IVF implementation even if FAISS is installed'
+        )
+    
+    def handle(self, *args, **options):
+        k = options['k']
+        rng = np.random.default_rng(0)
+        
+        if options['synthetic']:
+            ids, vectors = self._synthetic_vectors(options['synthetic'], options['dimension'], rng)
+        else:
+            ids, vectors = load_video_vectors()
+        
+        if len(ids) < k:
+            self.stderr.write(self.style.ERROR(f"Need at least {k} vectors, found {len(ids)}"))
+            return
+        
+        vectors = normalize_rows(vectors)
+        
+        # Queries are perturbed catalogue vectors, like user/like profiles close to real items
+        query_rows = rng.choice(len(ids), options['queries'])
+        queries = normalize_rows(vectors[query_rows] + 0.1 * rng.standard_normal(vectors[query_rows].shape).astype(np.float32))
+        
+        self.stdout.write(f"Benchmarking {len(ids)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries, k={k}")
+        
+        # Exact brute-force scorer
+        exact_results = []
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            top_ids, _ = EmbeddingMatrix.top_k(ids, vectors @ query, k)
+            latencies.append(time.perf_counter() - start)
+            exact_results.append(set(top_ids.tolist()))
+        self._report('exact', latencies, 1.0)
+        
+        # Approximate index
+        use_faiss = FAISS_AVAILABLE and not options['numpy']
+        index = ANNIndex('benchmark', use_faiss=use_faiss)
+        start = time.perf_counter()
+        index.build(ids, vectors)
+        self.stdout.write(f"Built {'FAISS' if use_faiss else 'NumPy IVF'} index in {time.perf_counter() - start:.2f}s")
+        
+        for nprobe in [int(value) for value in options['nprobe'].split(',')]:
+            latencies = []
+            hits = 0
+            for query, expected in zip(queries, exact_results):
+                start = time.perf_counter()
+                found, _ = index.search(query, k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - start)
+                hits += len(expected & set(found.tolist()))
+            self._report(f"ann nprobe={nprobe}", latencies, hits / (len(queries) * k))
+    
+    def _synthetic_vectors(self, count, dimension, rng):
+        """Generate clustered unit vectors so IVF partitioning is meaningful"""
+        centers = rng.standard_normal((max(1, count // 1000), dimension)).astype(np.float32)
+        assignments = rng.integers(0, len(centers), count)
+        vectors = centers[assignments] + 0.5 * rng.standard_normal((count, dimension)).astype(np.float32)
+        return np.arange(1, count + 1, dtype=np.int64), vectors
+    
+    def _report(self, label, latencies, recall):
+        latencies_ms = np.array(latencies) * 1000
+        self.stdout.write(
+            f"{label:<18} recall@k={recall:.3f}  "
+            f"p50={np.percentile(latencies_ms, 50):.2f}ms  "
+            f"p95={np.percentile(latencies_ms, 95):.2f}ms  "
+            f"mean={latencies_ms.mean():.2f}ms"
+        )
@@ -0,0 +1,120 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases, override_settings
+from core.benchmarks import (
+    REPORT_FORMAT, seed_synthetic_dataset, build_user_embeddings, build_models,
+    run_recommender_benchmark, compare_reports
+)
+from core.ann_index import FAISS_AVAILABLE
+import django
+import json
+import os
+import platform
+import tempfile
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Benchmark recommender latency and SQL query counts on a synthetic dataset and write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of synthetic users')
+        parser.add_argument('--videos', type=int, default=5000, help='Number of synthetic videos')
+        parser.add_argument('--views-per-user', type=int, default=30, help='Distinct videos viewed per user')
+        parser.add_argument('--likes-per-user', type=int, default=5, help='Videos liked per user')
+        parser.add_argument('--categories', type=int, default=20, help='Number of categories')
+        parser.add_argument('--dimension', type=int, default=384, help='Embedding dimension')
+        parser.add_argument('--samples', type=int, default=50, help='Users measured per stage')
+        parser.add_argument('--num', type=int, default=24, help='Recommendations requested per call')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes for the precompute stage')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--baseline', help='Earlier report to compare against; exits with an error on regressions')
+        parser.add_argument(
+            '--max-regression',
+            type=float,
+            default=20.0,
+            help='Allowed p95 slowdown against the baseline, in percent'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        dataset_options = {
+            'users': options['users'],
+            'videos': options['videos'],
+            'views_per_user': options['views_per_user'],
+            'likes_per_user': options['likes_per_user'],
+            'categories': options['categories'],
+            'dimension': options['dimension'],
+            'seed': options['seed'],
+        }
+
+        # The synthetic data lives in a throwaway test database, with a private
+        # cache and model directory, so nothing leaks into the real deployment
+        self.stderr.write("Creating benchmark database")
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with tempfile.TemporaryDirectory() as data_dir, override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                RECOMMENDER_DATA_DIR=data_dir
+            ):
+                self.stderr.write(f"Seeding {options['users']} users and {options['videos']} videos")
+                dataset = seed_synthetic_dataset(**dataset_options)
+                dataset['user_embeddings'] = build_user_embeddings()
+                build_models()
+
+                self.stderr.write(f"Measuring {options['samples']} users per stage")
+                results = run_recommender_benchmark(
+                    samples=options['samples'],
+                    num_recommendations=options['num'],
+                    precompute_workers=options['workers'],
+                    seed=options['seed']
+                )
+        except Exception as e:
+            logger.exception('Error running recommender benchmark')
+            raise CommandError(f"Benchmark failed: {str(e)}")
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'format': REPORT_FORMAT,
+            'dataset': dataset,
+            'settings': {
+                'samples': options['samples'],
+                'num_recommendations': options['num'],
+                'precompute_workers': options['workers'],
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'numpy': np.__version__,
+                'database': connection.vendor,
+                'faiss': FAISS_AVAILABLE,
+                'cpus': os.cpu_count(),
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare_reports(baseline, report, options['max_regression'] / 100)
+            if regressions:
+                raise CommandError("Regressions against baseline:\n" + "\n".join(regressions))
+            self.stderr.write(self.style.SUCCESS("No regressions against baseline"))
+
+        elapsed = time.time() - start_time
+        self.stderr.write(self.style.SUCCESS(f"Benchmark finished in {elapsed:.2f}s"))
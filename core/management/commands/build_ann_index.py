@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from core.ann_index import ANNIndex, build_video_index, build_content_index, FAISS_AVAILABLE
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Build the approximate nearest-neighbour indexes for videos and semantic search and save them to disk'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index',
+            choices=['video', 'content', 'all'],
+            default='all',
+            help='Which index to build'
+        )
+        parser.add_argument(
+            '--nlist',
+            type=int,
+            default=None,
+            help='Number of inverted lists (default: sqrt of the number of vectors)'
+        )
+        parser.add_argument(
+            '--numpy',
+            action='store_true',
+            help='Use the NumPy IVF implementation even if FAISS is installed'
+        )
+    
+    def handle(self, *args, **options):
+        names = ['video', 'content'] if options['index'] == 'all' else [options['index']]
+        use_faiss = FAISS_AVAILABLE and not options['numpy']
+        
+        self.stdout.write(f"Building ANN indexes with {'FAISS' if use_faiss else 'NumPy IVF'}")
+        
+        for name in names:
+            start_time = time.time()
+            try:
+                index = ANNIndex(name, use_faiss=use_faiss)
+                if name == 'video':
+                    build_video_index(index, nlist=options['nlist'])
+                else:
+                    build_content_index(index, nlist=options['nlist'])
+                index.save()
+                
+                elapsed = time.time() - start_time
+                self.stdout.write(self.style.SUCCESS(
+                    f"Built {name} index with {len(index)} vectors in {elapsed:.2f}s -> {index.path}"
+                ))
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Error building {name} index: {str(e)}"))
+                logger.exception(f"Error building {name} ANN index")
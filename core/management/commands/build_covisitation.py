@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from core.covisitation import CovisitationModel, get_model_path
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Build or incrementally update the co-visitation counts behind "up next" suggestions'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recount from scratch instead of folding in views since the last run'
+        )
+    
+    def handle(self, *args, **options):
+        start_time = time.time()
+        model = CovisitationModel()
+        
+        try:
+            if not options['full'] and model.load():
+                self.stdout.write(f"Updating co-visitation counts since {model.watermark}")
+                pairs = model.update()
+                summary = f"Folded in {pairs} new pairs"
+            else:
+                self.stdout.write("Counting co-visitation from scratch")
+                model.build()
+                summary = f"Counted co-visits for {len(model)} videos"
+            
+            model.save()
+            
+            elapsed = time.time() - start_time
+            self.stdout.write(self.style.SUCCESS(
+                f"{summary} ({len(model.neighbor_ids)} entries) in {elapsed:.2f}s -> {get_model_path()}"
+            ))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error building co-visitation model: {str(e)}"))
+            logger.exception("Error building co-visitation model")
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from core.item_similarity import ItemSimilarityModel, DEFAULT_NEIGHBORS, get_model_path
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Build or incrementally update the item-item collaborative filtering model from views and likes'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rebuild from scratch instead of folding in interactions since the last run'
+        )
+        parser.add_argument(
+            '--neighbors',
+            type=int,
+            default=DEFAULT_NEIGHBORS,
+            help='Number of similar videos kept per video (full rebuilds only)'
+        )
+    
+    def handle(self, *args, **options):
+        start_time = time.time()
+        model = ItemSimilarityModel(num_neighbors=options['neighbors'])
+        
+        try:
+            if not options['full'] and model.load():
+                self.stdout.write(f"Updating item similarity model since {model.watermark}")
+                updated = model.update()
+                summary = f"Recomputed neighbours for {updated} videos"
+            else:
+                self.stdout.write("Building item similarity model from scratch")
+                model.build()
+                summary = f"Built neighbours for {len(model)} videos"
+            
+            model.save()
+            
+            elapsed = time.time() - start_time
+            self.stdout.write(self.style.SUCCESS(
+                f"{summary} ({len(model.neighbor_ids)} entries) in {elapsed:.2f}s -> {get_model_path()}"
+            ))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error building item similarity model: {str(e)}"))
+            logger.exception("Error building item similarity model")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from core.related import build_related_lists, get_videos_to_refresh
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed related-videos lists shown on the watch page'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rebuild every list instead of only missing and out-of-date ones'
+        )
+    
+    def handle(self, *args, **options):
+        start_time = time.time()
+        
+        try:
+            video_ids = None if options['full'] else get_videos_to_refresh()
+            if video_ids is not None and not video_ids:
+                self.stdout.write(self.style.SUCCESS("All related video lists are up to date"))
+                return
+            
+            summary = build_related_lists(video_ids)
+            
+            elapsed = time.time() - start_time
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {summary['written']} related video lists and deleted {summary['deleted']} in {elapsed:.2f}s"
+            ))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error building related video lists: {str(e)}"))
+            logger.exception("Error building related video lists")
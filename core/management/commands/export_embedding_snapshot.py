@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from core.embedding_matrix import export_snapshot
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Export published video embeddings as a memory-mapped snapshot shared by all web workers'
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+
+        try:
+            version_dir, count = export_snapshot()
+            size = os.path.getsize(os.path.join(version_dir, 'vectors.npy'))
+
+            elapsed = time.time() - start_time
+            self.stdout.write(self.style.SUCCESS(
+                f"Exported {count} video embeddings ({size / 1024 / 1024:.1f} MB) in {elapsed:.2f}s -> {version_dir}"
+            ))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error exporting embedding snapshot: {str(e)}"))
+            logger.exception("Error exporting embedding snapshot")
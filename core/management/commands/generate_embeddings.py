@@ -1,16 +1,18 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Q
 from videos.models import Video
-from core.models import Blog, Post
-from core.bert_utils import create_or_update_content_embedding
-from django.db import transaction
+from core.models import Blog, Post, ContentEmbedding
+from core.embedding_store import EMBEDDING_VERSION
+from core.embedding_service import DEFAULT_BATCH_SIZE, bulk_embed
+from django.contrib.contenttypes.models import ContentType
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Generate BERT embeddings for all content in the database'
-    
+    help = 'Generate embeddings for all content in the database (videos feed both recommendations and search)'
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--content-type',
@@ -21,133 +23,111 @@ class Command(BaseCommand):
         parser.add_argument(
             '--batch-size',
             type=int,
-            default=100,
-            help='Number of items to process per batch'
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of texts per forward pass of the model'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=1000,
+            help='Number of items loaded, embedded and written together'
+        )
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='Only embed items without an embedding from the current model'
         )
-    
+
     def handle(self, *args, **options):
         content_type = options['content_type']
-        batch_size = options['batch_size']
-        
+
         self.stdout.write(f"Generating embeddings for content type: {content_type}")
-        
+
         stats = {
-            'video': {'total': 0, 'success': 0, 'failed': 0},
-            'blog': {'total': 0, 'success': 0, 'failed': 0},
-            'post': {'total': 0, 'success': 0, 'failed': 0},
+            'video': {'total': 0, 'success': 0, 'failed': 0, 'elapsed': 0.0},
+            'blog': {'total': 0, 'success': 0, 'failed': 0, 'elapsed': 0.0},
+            'post': {'total': 0, 'success': 0, 'failed': 0, 'elapsed': 0.0},
         }
-        
+
         if content_type in ['video', 'all']:
-            self._process_videos(batch_size, stats['video'])
-        
+            videos = Video.objects.filter(is_published=True).prefetch_related('tags', 'categories')
+            if options['missing_only']:
+                videos = videos.filter(Q(embedding__isnull=True) | ~Q(embedding__model_name=EMBEDDING_VERSION))
+            self._process('video', videos, options, stats['video'])
+
         if content_type in ['blog', 'all']:
-            self._process_blogs(batch_size, stats['blog'])
-        
+            self._process('blog', self._content_queryset(Blog, options), options, stats['blog'])
+
         if content_type in ['post', 'all']:
-            self._process_posts(batch_size, stats['post'])
-        
+            self._process('post', self._content_queryset(Post, options), options, stats['post'])
+
         # Print summary
         self.stdout.write(self.style.SUCCESS("\nEmbedding Generation Summary:"))
         for ctype, stat in stats.items():
             if stat['total'] > 0:
-                self.stdout.write(f"{ctype.title()}s: {stat['success']}/{stat['total']} successful ({100 * stat['success'] / stat['total']:.1f}%)")
+                self.stdout.write(
+                    f"{ctype.title()}s: {stat['success']}/{stat['total']} successful ({100 * stat['success'] / stat['total']:.1f}%) "
+                    f"- {stat['total'] / max(stat['elapsed'], 1e-9):.1f} items/s"
+                )
                 if stat['failed'] > 0:
                     self.stdout.write(self.style.WARNING(f"  {stat['failed']} failed"))
-        
+
         self.stdout.write(self.style.SUCCESS('Done!'))
-    
-    def _process_videos(self, batch_size, stats):
-        """Process all videos in batches"""
-        videos = Video.objects.filter(is_published=True).order_by('id')
-        total = videos.count()
-        stats['total'] = total
-        
-        if total == 0:
-            self.stdout.write("No videos found.")
-            return
-        
-        self.stdout.write(f"Processing {total} videos...")
-        
-        start_time = time.time()
-        processed = 0
-        
-        for i in range(0, total, batch_size):
-            batch = videos[i:i+batch_size]
-            with transaction.atomic():
-                for video in batch:
-                    try:
-                        create_or_update_content_embedding(video)
-                        stats['success'] += 1
-                    except Exception as e:
-                        stats['failed'] += 1
-                        logger.error(f"Error generating embedding for Video {video.id}: {str(e)}")
-            
-            processed += len(batch)
-            elapsed = time.time() - start_time
-            remaining = (elapsed / processed) * (total - processed) if processed > 0 else 0
-            
-            self.stdout.write(f"Progress: {processed}/{total} videos - {100 * processed / total:.1f}% - ETA: {remaining:.1f}s")
-    
-    def _process_blogs(self, batch_size, stats):
-        """Process all blogs in batches"""
-        blogs = Blog.objects.all().order_by('id')
-        total = blogs.count()
-        stats['total'] = total
-        
-        if total == 0:
-            self.stdout.write("No blogs found.")
-            return
-        
-        self.stdout.write(f"Processing {total} blogs...")
-        
-        start_time = time.time()
-        processed = 0
-        
-        for i in range(0, total, batch_size):
-            batch = blogs[i:i+batch_size]
-            with transaction.atomic():
-                for blog in batch:
-                    try:
-                        create_or_update_content_embedding(blog)
-                        stats['success'] += 1
-                    except Exception as e:
-                        stats['failed'] += 1
-                        logger.error(f"Error generating embedding for Blog {blog.id}: {str(e)}")
-            
-            processed += len(batch)
-            elapsed = time.time() - start_time
-            remaining = (elapsed / processed) * (total - processed) if processed > 0 else 0
-            
-            self.stdout.write(f"Progress: {processed}/{total} blogs - {100 * processed / total:.1f}% - ETA: {remaining:.1f}s")
-    
-    def _process_posts(self, batch_size, stats):
-        """Process all posts in batches"""
-        posts = Post.objects.all().order_by('id')
-        total = posts.count()
+
+    def _content_queryset(self, model, options):
+        """Blogs or posts to embed"""
+        queryset = model.objects.all()
+        if options['missing_only']:
+            current = ContentEmbedding.objects.filter(
+                content_type=ContentType.objects.get_for_model(model),
+                model_name=EMBEDDING_VERSION
+            ).values('object_id')
+            queryset = queryset.exclude(id__in=current)
+        return queryset
+
+    def _process(self, label, queryset, options, stats):
+        """
+        Embed a queryset page by page
+
+        Pages are read with keyset pagination (id > last id seen), so each
+        page costs the same however deep into the table it is, and every page
+        goes through the model in batches and is written with one bulk upsert.
+        """
+        total = queryset.count()
         stats['total'] = total
-        
+
         if total == 0:
-            self.stdout.write("No posts found.")
+            self.stdout.write(f"No {label}s found.")
             return
-        
-        self.stdout.write(f"Processing {total} posts...")
-        
+
+        self.stdout.write(f"Processing {total} {label}s...")
+
         start_time = time.time()
         processed = 0
-        
-        for i in range(0, total, batch_size):
-            batch = posts[i:i+batch_size]
-            with transaction.atomic():
-                for post in batch:
-                    try:
-                        create_or_update_content_embedding(post)
-                        stats['success'] += 1
-                    except Exception as e:
-                        stats['failed'] += 1
-                        logger.error(f"Error generating embedding for Post {post.id}: {str(e)}")
-            
-            processed += len(batch)
+        last_id = 0
+
+        while True:
+            page = list(queryset.filter(id__gt=last_id).order_by('id')[:options['page_size']])
+            if not page:
+                break
+            last_id = page[-1].id
+
+            try:
+                stored = len(bulk_embed(page, options['batch_size']))
+            except Exception as e:
+                stored = 0
+                logger.error(f"Error generating embeddings for {label}s {page[0].id}-{last_id}: {str(e)}")
+            stats['success'] += stored
+            stats['failed'] += len(page) - stored
+
+            processed += len(page)
             elapsed = time.time() - start_time
-            remaining = (elapsed / processed) * (total - processed) if processed > 0 else 0
-            
-            self.stdout.write(f"Progress: {processed}/{total} posts - {100 * processed / total:.1f}% - ETA: {remaining:.1f}s") 
\ No newline at end of file
+            rate = processed / max(elapsed, 1e-9)
+            remaining = max(total - processed, 0) / rate
+
+            self.stdout.write(
+                f"Progress: {processed}/{total} {label}s - {100 * min(processed / total, 1):.1f}% - "
+                f"{rate:.1f} items/s - ETA: {remaining:.1f}s"
+            )
+
+        stats['elapsed'] = time.time() - start_time
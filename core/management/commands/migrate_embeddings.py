@@ -0,0 +1,106 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.models import STORED_EMBEDDING_FIELDS, ContentEmbedding, UserEmbedding, VideoEmbedding
+from core.embedding_store import (
+    DEFAULT_ENCODING, EMBEDDING_DIMENSION, EMBEDDING_VERSION, ENCODING_CHOICES, EmbeddingDimensionError
+)
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = ('Rewrite stored video, user and content embeddings in the given encoding, '
+            'and report rows from another model version or with the wrong dimension')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--encoding',
+            choices=[choice for choice, _ in ENCODING_CHOICES],
+            default=DEFAULT_ENCODING,
+            help=f'Encoding to store vectors in (default: {DEFAULT_ENCODING})'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows read and written per batch'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report what would change'
+        )
+        parser.add_argument(
+            '--delete-mismatched',
+            action='store_true',
+            help='Delete rows from another model or with the wrong dimension (regenerate them with generate_embeddings)'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+
+        for model in (VideoEmbedding, UserEmbedding, ContentEmbedding):
+            try:
+                self.migrate(model, options)
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Error migrating {model.__name__} rows: {str(e)}"))
+                logger.exception(f"Error migrating {model.__name__} rows")
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(f"Embedding migration finished in {elapsed:.2f}s"))
+
+    def migrate(self, model, options):
+        """Rewrite one model's rows in keyset-paginated batches"""
+        encoding = options['encoding']
+        rewritten = unchanged = 0
+        bytes_before = bytes_after = 0
+        mismatched = []
+
+        now = timezone.now()
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            changed = []
+            for embedding in batch:
+                try:
+                    vector = embedding.get_vector()
+                except EmbeddingDimensionError:
+                    vector = None
+                if vector is None or not embedding.matches_model(EMBEDDING_VERSION, EMBEDDING_DIMENSION):
+                    mismatched.append(embedding.pk)
+                    continue
+
+                bytes_before += len(embedding.embedding_vector)
+                if embedding.encoding == encoding and embedding.dimension:
+                    unchanged += 1
+                    bytes_after += len(embedding.embedding_vector)
+                    continue
+
+                embedding.set_vector(vector, encoding=encoding)
+                embedding.updated_at = now  # So running embedding matrices pick the row up on their next refresh
+                bytes_after += len(embedding.embedding_vector)
+                changed.append(embedding)
+
+            if changed and not options['dry_run']:
+                model.objects.bulk_update(changed, STORED_EMBEDDING_FIELDS + ['updated_at'])
+            rewritten += len(changed)
+
+        verb = 'Would rewrite' if options['dry_run'] else 'Rewrote'
+        self.stdout.write(
+            f"{model.__name__}: {verb} {rewritten} rows as {encoding}, {unchanged} already up to date "
+            f"({bytes_before / 1024:.1f} KiB -> {bytes_after / 1024:.1f} KiB)"
+        )
+
+        if mismatched:
+            self.stdout.write(self.style.WARNING(
+                f"{model.__name__}: {len(mismatched)} rows are not {EMBEDDING_DIMENSION}-d {EMBEDDING_VERSION} "
+                f"vectors (first ids: {mismatched[:20]})"
+            ))
+            if options['delete_mismatched'] and not options['dry_run']:
+                deleted, _ = model.objects.filter(pk__in=mismatched).delete()
+                self.stdout.write(f"{model.__name__}: Deleted {deleted} mismatched rows")
@@ -1,5 +1,5 @@
-from django.core.management.base import BaseCommand
-from core.recommender import precompute_recommendations
+from django.core.management.base import BaseCommand, CommandError
+from core.recommender import precompute_recommendations, parse_shard
 import time
 import logging
 
@@ -20,10 +20,33 @@ class Command(BaseCommand):
             default=3600,
             help='Sleep interval in seconds when running in loop mode (default: 1 hour)'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes used to rank users (default: 1)'
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            default=None,
+            help='Only precompute this shard of users, as i/N (e.g. 0/4), split by a hash of the user id'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Recompute every active user instead of only those with new views or likes'
+        )
     
     def handle(self, *args, **options):
         loop_mode = options['loop']
         interval = options['interval']
+        self.workers = options['workers']
+        self.full = options['full']
+        try:
+            self.shard = parse_shard(options['shard']) if options['shard'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
         
         if loop_mode:
             self.stdout.write(self.style.SUCCESS(f'Starting recommendation precomputation in loop mode with {interval}s interval'))
@@ -42,17 +65,23 @@ class Command(BaseCommand):
         """Run the precomputation function and log results"""
         start_time = time.time()
         try:
-            result = precompute_recommendations()
+            result = precompute_recommendations(workers=self.workers, shard=self.shard, full=self.full)
             elapsed = time.time() - start_time
             
-            if result:
+            if not result['failed']:
                 self.stdout.write(self.style.SUCCESS(
-                    f'Successfully precomputed recommendations in {elapsed:.2f} seconds'
+                    f"Successfully precomputed recommendations for {result['users']} users in {elapsed:.2f} seconds"
                 ))
             else:
                 self.stdout.write(self.style.WARNING(
-                    f'Precomputation completed with issues in {elapsed:.2f} seconds'
+                    f"Precomputation completed with {result['failed']} of {result['users']} users failing in {elapsed:.2f} seconds"
                 ))
+            
+            if result['users']:
+                self.stdout.write(
+                    f"Per-user latency: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, "
+                    f"p99 {result['p99_ms']:.1f}ms, max {result['max_ms']:.1f}ms"
+                )
                 
         except Exception as e:
             elapsed = time.time() - start_time
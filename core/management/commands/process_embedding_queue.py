@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+from core.embedding_queue import DEFAULT_QUEUE_PAGE_SIZE, index_stored_embeddings, process_embedding_jobs, queue_length
+from core.embedding_service import DEFAULT_BATCH_SIZE
+from core.ann_index import ANNIndex
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_SAVE_INTERVAL = 60  # Seconds between saves of the ANN indexes while new vectors arrive
+
+class Command(BaseCommand):
+    help = 'Embed queued videos, blogs and posts in batches (run continuously, or with --once from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=DEFAULT_QUEUE_PAGE_SIZE,
+            help='Number of jobs claimed and embedded together'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of texts per forward pass of the model'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5.0,
+            help='Seconds to wait before polling an empty queue again'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of waiting for new jobs'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Processing embedding queue ({queue_length()} jobs queued)")
+
+        totals = {'embedded': 0, 'skipped': 0, 'failed': 0}
+        start_time = time.time()
+        pending_index_save = False
+        saved_at = time.monotonic()
+
+        try:
+            while True:
+                pass_start = time.time()
+                try:
+                    summary = process_embedding_jobs(options['page_size'], options['batch_size'])
+                except Exception as e:
+                    self.stderr.write(self.style.ERROR(f"Error processing embedding queue: {str(e)}"))
+                    logger.exception("Error processing embedding queue")
+                    summary = {'claimed': 0}
+
+                if summary['claimed']:
+                    for key in totals:
+                        totals[key] += summary[key]
+                    if summary['stored']:
+                        try:
+                            index_stored_embeddings(summary['stored'])
+                            pending_index_save = True
+                        except Exception as e:
+                            logger.error(f"Error indexing queued embeddings: {str(e)}")
+
+                    elapsed = time.time() - pass_start
+                    self.stdout.write(
+                        f"Embedded {summary['embedded']}/{summary['claimed']} jobs "
+                        f"({summary['skipped']} skipped, {summary['failed']} failed) - "
+                        f"{summary['claimed'] / max(elapsed, 1e-9):.1f} items/s"
+                    )
+
+                if pending_index_save and (not summary['claimed'] or time.monotonic() - saved_at >= INDEX_SAVE_INTERVAL):
+                    self._save_indexes()
+                    pending_index_save = False
+                    saved_at = time.monotonic()
+
+                if not summary['claimed']:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted")
+        finally:
+            if pending_index_save:
+                self._save_indexes()
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Embedded {totals['embedded']} objects ({totals['skipped']} skipped, {totals['failed']} failed) "
+            f"in {elapsed:.2f}s"
+        ))
+
+    def _save_indexes(self):
+        """Write the ANN indexes so web workers load the new vectors"""
+        for name in ('video', 'content'):
+            index = ANNIndex.get_instance(name)
+            try:
+                index.save()
+            except Exception as e:
+                logger.error(f"Error saving {name} ANN index: {str(e)}")
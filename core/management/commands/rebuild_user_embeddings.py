@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from core.models import UserEmbedding
+from core.nlp import calculate_user_preference_embedding, CACHE_TTL
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Rebuild user preference embeddings from scratch (interaction events keep them current in between)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-days',
+            type=int,
+            default=7,
+            help='Rebuild embeddings not updated for this many days, plus users without one'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild every user that has interactions'
+        )
+
+    def handle(self, *args, **options):
+        start_time = time.time()
+        User = get_user_model()
+
+        # Only users with some interaction can have a non-zero embedding
+        users = User.objects.filter(
+            Q(all_likes__video__isnull=False) |
+            Q(all_comments__video__isnull=False) |
+            Q(video_views__isnull=False)
+        ).distinct()
+
+        if not options['all']:
+            cutoff = timezone.now() - timezone.timedelta(days=options['stale_days'])
+            users = users.filter(Q(embedding__isnull=True) | Q(embedding__updated_at__lt=cutoff))
+
+        user_ids = list(users.values_list('id', flat=True))
+        self.stdout.write(f"Rebuilding preference embeddings for {len(user_ids)} users")
+
+        rebuilt = 0
+        for user in User.objects.filter(id__in=user_ids).iterator():
+            try:
+                embedding = calculate_user_preference_embedding(user)
+                UserEmbedding.create_from_user(user, embedding)
+                cache.set(f"user_embedding_{user.id}", embedding, CACHE_TTL)
+                rebuilt += 1
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"Error rebuilding embedding for user {user.id}: {str(e)}"))
+                logger.exception(f"Error rebuilding embedding for user {user.id}")
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {rebuilt}/{len(user_ids)} user embeddings in {elapsed:.2f}s"
+        ))
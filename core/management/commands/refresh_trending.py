@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.core.cache import cache
+from core.trending import refresh_trending
+from core.recommender import POPULAR_VIDEOS_CACHE_KEY
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Fold new views into hourly buckets and refresh the time-decayed trending scores'
+    
+    def handle(self, *args, **options):
+        start_time = time.time()
+        
+        try:
+            summary = refresh_trending()
+            
+            # Let the popular list pick up the new ranking
+            cache.delete(POPULAR_VIDEOS_CACHE_KEY)
+            
+            elapsed = time.time() - start_time
+            self.stdout.write(self.style.SUCCESS(
+                f"Updated {summary['buckets']} view buckets and scored {summary['videos']} trending videos in {elapsed:.2f}s"
+            ))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error refreshing trending scores: {str(e)}"))
+            logger.exception("Error refreshing trending scores")
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from core.matrix_factorization import (
+    load_feedback, train_als, save_factors,
+    DEFAULT_FACTORS, DEFAULT_ITERATIONS, DEFAULT_REGULARIZATION
+)
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Train implicit-feedback ALS factors from watch time and likes and write them as memory-mappable .npy files'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--factors',
+            type=int,
+            default=DEFAULT_FACTORS,
+            help='Number of latent dimensions'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=DEFAULT_ITERATIONS,
+            help='Number of alternating least squares passes'
+        )
+        parser.add_argument(
+            '--regularization',
+            type=float,
+            default=DEFAULT_REGULARIZATION,
+            help='L2 regularization strength'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes used for the least squares solves'
+        )
+    
+    def handle(self, *args, **options):
+        start_time = time.time()
+        try:
+            user_ids, video_ids, feedback = load_feedback()
+            self.stdout.write(
+                f"Loaded {feedback.nnz} interactions for {len(user_ids)} users and {len(video_ids)} videos"
+            )
+            
+            if not feedback.nnz:
+                self.stdout.write(self.style.WARNING('No interactions to train on'))
+                return
+            
+            user_factors, item_factors = train_als(
+                feedback,
+                factors=options['factors'],
+                iterations=options['iterations'],
+                regularization=options['regularization'],
+                workers=options['workers']
+            )
+            version_dir = save_factors(user_ids, video_ids, user_factors, item_factors)
+            
+            elapsed = time.time() - start_time
+            self.stdout.write(self.style.SUCCESS(
+                f"Trained {options['factors']}-factor ALS model in {elapsed:.2f}s -> {version_dir}"
+            ))
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f"Error training ALS factors: {str(e)}"))
+            logger.exception('Error in train_als command')
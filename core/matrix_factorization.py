@@ -0,0 +1,350 @@
+import os
+import shutil
+import threading
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db.models import Sum
+
+from videos.models import VideoView
+from core.models import Like
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_FACTORS = 64  # Latent dimensions
+DEFAULT_ITERATIONS = 15
+DEFAULT_REGULARIZATION = 0.1
+CONFIDENCE_ALPHA = 10.0  # Scales implicit feedback into confidence (Hu, Koren & Volinsky)
+LIKE_WATCH_MINUTES = 10  # A like counts as this many minutes of watch time
+SOLVE_BATCH_NNZ = 2048  # Interactions per batched solve (bounds the (nnz, k, k) temporary)
+LONG_ROW_NNZ = 256  # Rows with more interactions are accumulated with a matrix product instead
+KEEP_VERSIONS = 2  # Factor directories kept on disk; workers may still map the previous one
+RELOAD_CHECK_INTERVAL = 60  # Seconds between checks for newer factors on disk
+CURRENT_POINTER = 'CURRENT'
+
+
+def get_factors_dir():
+    """Directory holding the versioned factor files"""
+    base_dir = getattr(settings, 'RECOMMENDER_DATA_DIR', os.path.join(settings.BASE_DIR, 'recommender_data'))
+    return os.path.join(base_dir, 'als')
+
+
+def load_feedback():
+    """
+    Build the implicit-feedback confidence matrix
+
+    Preference strength is log(1 + minutes watched), with a like adding
+    LIKE_WATCH_MINUTES; confidence is 1 + CONFIDENCE_ALPHA * strength.
+
+    Returns:
+        tuple: (user_ids, video_ids, scipy.sparse.csr_matrix of confidence - 1)
+    """
+    watch_rows = np.array(
+        list(
+            VideoView.objects.filter(user__isnull=False)
+            .values_list('user_id', 'video_id')
+            .annotate(total_time=Sum('view_time'))
+            .order_by()
+        ),
+        dtype=np.float64
+    ).reshape(-1, 3)
+    like_rows = np.array(
+        list(Like.objects.filter(video__isnull=False).values_list('user_id', 'video_id')),
+        dtype=np.float64
+    ).reshape(-1, 2)
+
+    users = np.concatenate([watch_rows[:, 0], like_rows[:, 0]]).astype(np.int64)
+    videos = np.concatenate([watch_rows[:, 1], like_rows[:, 1]]).astype(np.int64)
+    minutes = np.concatenate([
+        np.nan_to_num(watch_rows[:, 2]) / 60.0,
+        np.full(len(like_rows), LIKE_WATCH_MINUTES, dtype=np.float64)
+    ])
+
+    user_ids, rows = np.unique(users, return_inverse=True)
+    video_ids, cols = np.unique(videos, return_inverse=True)
+
+    minutes_matrix = sparse.csr_matrix((minutes, (rows, cols)), shape=(len(user_ids), len(video_ids)))
+    # Zero-minute views stay as explicit entries: observed, with base confidence
+    minutes_matrix.data = (CONFIDENCE_ALPHA * np.log1p(minutes_matrix.data)).astype(np.float32)
+    return user_ids, video_ids, minutes_matrix
+
+
+def _solve_rows(indptr, indices, data, fixed, gram, regularization):
+    """
+    Solve the ALS normal equations for a contiguous block of rows
+
+    For row u: (Y^T Y + Y_u^T (C_u - I) Y_u + reg * I) x_u = Y_u^T C_u p_u,
+    where p_u is 1 on observed items. The per-row corrections are built for the
+    whole block at once and solved with one batched np.linalg.solve.
+
+    Args:
+        indptr, indices, data: CSR slice of (confidence - 1) for the block (indptr starts at 0)
+        fixed (numpy.ndarray): (n_items, k) factors held fixed
+        gram (numpy.ndarray): Precomputed fixed^T fixed
+        regularization (float): L2 penalty
+
+    Returns:
+        numpy.ndarray: (n_rows, k) solved factors
+    """
+    num_rows = len(indptr) - 1
+    k = fixed.shape[1]
+    lengths = np.diff(indptr)
+    gathered = fixed[indices]
+
+    lhs = np.broadcast_to(gram + regularization * np.eye(k, dtype=fixed.dtype), (num_rows, k, k)).copy()
+    rhs = np.zeros((num_rows, k), dtype=fixed.dtype)
+
+    weighted = gathered * data[:, None]
+
+    nonempty = lengths > 0
+    if nonempty.any():
+        rhs[nonempty] = np.add.reduceat(weighted + gathered, indptr[:-1][nonempty], axis=0)
+
+    # Short rows: outer products for the whole block, summed per row
+    short = nonempty & (lengths <= LONG_ROW_NNZ)
+    entries = short[np.repeat(np.arange(num_rows), lengths)]
+    if entries.any():
+        starts = np.concatenate([[0], np.cumsum(lengths[short])[:-1]])
+        outer = np.einsum('ni,nj->nij', weighted[entries], gathered[entries])
+        lhs[short] += np.add.reduceat(outer, starts, axis=0)
+
+    # Long rows (e.g. popular videos): one matrix product each, without the (nnz, k, k) temporary
+    for row in np.flatnonzero(lengths > LONG_ROW_NNZ):
+        start, end = indptr[row], indptr[row + 1]
+        lhs[row] += weighted[start:end].T @ gathered[start:end]
+
+    return np.linalg.solve(lhs, rhs[..., None])[..., 0]
+
+
+def _row_blocks(matrix):
+    """Split CSR rows into blocks of roughly SOLVE_BATCH_NNZ interactions"""
+    boundaries = np.searchsorted(matrix.indptr, np.arange(SOLVE_BATCH_NNZ, matrix.nnz, SOLVE_BATCH_NNZ))
+    edges = np.unique(np.concatenate([[0], boundaries, [matrix.shape[0]]]))
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _solve_blocks(blocks, fixed, gram, regularization):
+    """Solve a list of CSR row blocks; one task per worker so `fixed` is sent once"""
+    return [_solve_rows(indptr, indices, data, fixed, gram, regularization) for indptr, indices, data in blocks]
+
+
+def solve_side(matrix, fixed, regularization, executor=None, workers=1):
+    """
+    Recompute one side of the factorisation with the other side held fixed
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): (confidence - 1), rows are the side being solved
+        fixed (numpy.ndarray): Factors of the other side
+        regularization (float): L2 penalty
+        executor (ProcessPoolExecutor): Optional pool to spread the row blocks over
+        workers (int): Number of processes in the pool
+
+    Returns:
+        numpy.ndarray: New factors for the rows of `matrix`
+    """
+    gram = fixed.T @ fixed
+    blocks = []
+    for start, end in _row_blocks(matrix):
+        lo, hi = matrix.indptr[start], matrix.indptr[end]
+        blocks.append((matrix.indptr[start:end + 1] - lo, matrix.indices[lo:hi], matrix.data[lo:hi]))
+
+    if executor is not None and len(blocks) > 1:
+        # Contiguous groups keep the row order when the results are stacked
+        groups = [group.tolist() for group in np.array_split(np.arange(len(blocks)), min(workers, len(blocks)))]
+        futures = [
+            executor.submit(_solve_blocks, [blocks[i] for i in group], fixed, gram, regularization)
+            for group in groups
+        ]
+        results = [result for future in futures for result in future.result()]
+    else:
+        results = _solve_blocks(blocks, fixed, gram, regularization)
+
+    if not results:
+        return np.zeros((0, fixed.shape[1]), dtype=fixed.dtype)
+    return np.vstack(results)
+
+
+def train_als(matrix, factors=DEFAULT_FACTORS, iterations=DEFAULT_ITERATIONS,
+              regularization=DEFAULT_REGULARIZATION, workers=1, seed=0):
+    """
+    Train implicit-feedback ALS factors
+
+    Args:
+        matrix (scipy.sparse.csr_matrix): (users x videos) confidence - 1
+        factors (int): Latent dimensions
+        iterations (int): Alternating passes
+        regularization (float): L2 penalty
+        workers (int): Processes used for the batched solves (1 = in process)
+        seed (int): Random seed for the initial factors
+
+    Returns:
+        tuple: (user_factors, item_factors) as float32 arrays
+    """
+    rng = np.random.default_rng(seed)
+    user_factors = (rng.standard_normal((matrix.shape[0], factors)) * 0.01).astype(np.float32)
+    item_factors = (rng.standard_normal((matrix.shape[1], factors)) * 0.01).astype(np.float32)
+    matrix = matrix.astype(np.float32).tocsr()
+    transposed = matrix.T.tocsr()
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for iteration in range(iterations):
+            user_factors = solve_side(matrix, item_factors, regularization, executor, workers)
+            item_factors = solve_side(transposed, user_factors, regularization, executor, workers)
+            logger.debug(f"ALS iteration {iteration + 1}/{iterations} done")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return user_factors.astype(np.float32), item_factors.astype(np.float32)
+
+
+def save_factors(user_ids, video_ids, user_factors, item_factors):
+    """
+    Write the factors as .npy files into a new version directory and point CURRENT at it
+
+    Web workers memory-map these files, so existing versions are never modified
+    in place; only the last KEEP_VERSIONS directories are retained.
+
+    Returns:
+        str: Path of the new version directory
+    """
+    base_dir = get_factors_dir()
+    version = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    version_dir = os.path.join(base_dir, version)
+    os.makedirs(version_dir)
+
+    np.save(os.path.join(version_dir, 'user_ids.npy'), np.asarray(user_ids, dtype=np.int64))
+    np.save(os.path.join(version_dir, 'video_ids.npy'), np.asarray(video_ids, dtype=np.int64))
+    np.save(os.path.join(version_dir, 'user_factors.npy'), np.ascontiguousarray(user_factors, dtype=np.float32))
+    np.save(os.path.join(version_dir, 'item_factors.npy'), np.ascontiguousarray(item_factors, dtype=np.float32))
+
+    pointer = os.path.join(base_dir, CURRENT_POINTER)
+    with open(f"{pointer}.tmp", 'w') as f:
+        f.write(version)
+    os.replace(f"{pointer}.tmp", pointer)
+
+    versions = sorted(
+        name for name in os.listdir(base_dir)
+        if os.path.isdir(os.path.join(base_dir, name))
+    )
+    for old_version in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(base_dir, old_version), ignore_errors=True)
+
+    return version_dir
+
+
+class FactorModel:
+    """
+    Read-only view of the latest ALS factors, memory-mapped from disk.
+
+    Every web worker maps the same .npy files, so the model is shared through
+    the page cache instead of being copied into each process.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.version = None
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.video_ids = np.zeros(0, dtype=np.int64)
+        self.user_factors = np.zeros((0, 0), dtype=np.float32)
+        self.item_factors = np.zeros((0, 0), dtype=np.float32)
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self.version is not None
+
+    def load(self):
+        """
+        Map the version named by CURRENT if it differs from the loaded one
+
+        Returns:
+            bool: Whether factors are available
+        """
+        base_dir = get_factors_dir()
+        try:
+            with open(os.path.join(base_dir, CURRENT_POINTER)) as f:
+                version = f.read().strip()
+        except OSError:
+            return self.is_loaded
+
+        if version == self.version:
+            return True
+
+        version_dir = os.path.join(base_dir, version)
+        user_ids = np.load(os.path.join(version_dir, 'user_ids.npy'))
+        video_ids = np.load(os.path.join(version_dir, 'video_ids.npy'))
+        user_factors = np.load(os.path.join(version_dir, 'user_factors.npy'), mmap_mode='r')
+        item_factors = np.load(os.path.join(version_dir, 'item_factors.npy'), mmap_mode='r')
+
+        with self._lock:
+            self.user_ids, self.video_ids = user_ids, video_ids
+            self.user_factors, self.item_factors = user_factors, item_factors
+            self.version = version
+        logger.info(f"Mapped ALS factors {version} ({len(user_ids)} users, {len(video_ids)} videos)")
+        return True
+
+    def ensure_loaded(self):
+        """Pick up new factor versions at most every RELOAD_CHECK_INTERVAL seconds"""
+        now = time.monotonic()
+        if now - self.checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        self.load()
+
+    def score(self, user_id, candidate_ids):
+        """
+        Dot-product scores of a user's factors against candidate videos
+
+        Args:
+            user_id (int): ID of the user
+            candidate_ids (numpy.ndarray): IDs of eligible videos
+
+        Returns:
+            tuple: (ids, scores) for the candidates known to the model; empty
+            if the user has no factors
+        """
+        with self._lock:
+            user_ids, video_ids = self.user_ids, self.video_ids
+            user_factors, item_factors = self.user_factors, self.item_factors
+
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        user_row = np.searchsorted(user_ids, user_id)
+        if user_row >= len(user_ids) or user_ids[user_row] != user_id:
+            return empty
+
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(video_ids, candidate_ids), max(len(video_ids) - 1, 0))
+        known = video_ids[rows] == candidate_ids if len(video_ids) else np.zeros(len(candidate_ids), dtype=bool)
+        if not known.any():
+            return empty
+
+        return candidate_ids[known], item_factors[rows[known]] @ user_factors[user_row]
+
+
+def get_factor_model():
+    """Get the shared ALS factor model, mapping newer factors if available"""
+    model = FactorModel.get_instance()
+    try:
+        model.ensure_loaded()
+    except Exception as e:
+        logger.error(f"Error loading ALS factors: {e}")
+    return model
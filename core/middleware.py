@@ -2,6 +2,7 @@ import re
 from django.utils.deprecation import MiddlewareMixin
 from django.utils import timezone
 from core.recommender import ContextualBanditRecommender
+from core.timing import TIMING_HEADER, collect_request_traces, reset_request_traces
 import logging
 
 logger = logging.getLogger(__name__)
@@ -90,4 +91,28 @@ class RecommendationTrackingMiddleware(MiddlewareMixin):
             except Exception as e:
                 logger.error(f"Error adding tracking to recommendations: {e}")
         
-        return response 
\ No newline at end of file
+        return response
+
+
+class RecommendationTimingMiddleware:
+    """
+    Middleware exposing recommendation stage timings to staff.
+    
+    Collects the RecommendationTrace of every recommend_for_user call made while
+    handling the request and, for staff users, adds them to the response as an
+    X-Rec-Timing header (Server-Timing syntax, one trace per ' | ' separated part).
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        traces, token = collect_request_traces()
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_request_traces(token)
+
+        user = getattr(request, 'user', None)
+        if traces and user is not None and user.is_authenticated and user.is_staff:
+            response[TIMING_HEADER] = ' | '.join(trace.header_value() for trace in traces)
+        return response
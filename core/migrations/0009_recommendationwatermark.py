@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0008_contentembedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precomputed_at', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='recommendation_watermark', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
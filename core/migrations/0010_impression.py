@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0003_video_feed_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0009_recommendationwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Impression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot', models.PositiveSmallIntegerField()),
+                ('source', models.CharField(max_length=16)),
+                ('shown_at', models.DateTimeField()),
+                ('user', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='impressions', to=settings.AUTH_USER_MODEL)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='impressions', to='videos.video')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'shown_at'], name='impression_user_shown_idx'), models.Index(fields=['shown_at'], name='impression_shown_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0004_videoview_created_index'),
+        ('core', '0010_impression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending_score', serialize=False, to='videos.video')),
+                ('score', models.FloatField()),
+                ('scored_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score', '-video'], name='trending_score_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VideoViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_buckets', to='videos.video')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='view_bucket_hour_idx')],
+                'unique_together': {('video', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0004_videoview_created_index'),
+        ('core', '0011_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedVideos',
+            fields=[
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='related_list', serialize=False, to='videos.video')),
+                ('video_ids', models.BinaryField()),
+                ('dtype', models.CharField(max_length=8)),
+                ('computed_at', models.DateTimeField()),
+                ('is_stale', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_related_videos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userembedding',
+            name='dimension',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userembedding',
+            name='encoding',
+            field=models.CharField(choices=[('float32', 'float32 (4 bytes per value)'), ('float16', 'float16 (2 bytes per value)'), ('int8', 'int8 with scale and offset (1 byte per value)')], default='float32', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='userembedding',
+            name='is_normalized',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='userembedding',
+            name='model_name',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='userembedding',
+            name='quant_offset',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='userembedding',
+            name='quant_scale',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.AddField(
+            model_name='videoembedding',
+            name='dimension',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='videoembedding',
+            name='encoding',
+            field=models.CharField(choices=[('float32', 'float32 (4 bytes per value)'), ('float16', 'float16 (2 bytes per value)'), ('int8', 'int8 with scale and offset (1 byte per value)')], default='float32', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='videoembedding',
+            name='is_normalized',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='videoembedding',
+            name='model_name',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='videoembedding',
+            name='quant_offset',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='videoembedding',
+            name='quant_scale',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
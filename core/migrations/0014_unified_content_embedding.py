@@ -0,0 +1,96 @@
+import pickle
+
+import numpy as np
+from django.db import migrations, models
+
+# Label written by core.embedding_store at the time of this migration; the
+# pickled search embeddings were already mean-pooled MiniLM vectors.
+EMBEDDING_VERSION = 'sentence-transformers/all-MiniLM-L6-v2:mean'
+
+
+def convert_pickled_embeddings(apps, schema_editor):
+    """Re-encode pickled vectors as float16 and drop video rows (videos are searched via VideoEmbedding)"""
+    ContentEmbedding = apps.get_model('core', 'ContentEmbedding')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    ContentEmbedding.objects.filter(
+        content_type__in=ContentType.objects.filter(app_label='videos', model='video')
+    ).delete()
+
+    converted = []
+    unreadable = []
+    for embedding in ContentEmbedding.objects.exclude(embedding__isnull=True).iterator():
+        try:
+            vector = np.asarray(pickle.loads(bytes(embedding.embedding)), dtype=np.float32).ravel()
+        except Exception:
+            unreadable.append(embedding.pk)
+            continue
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            unreadable.append(embedding.pk)
+            continue
+        vector = vector / norm
+        embedding.embedding_vector = vector.astype(np.float16).tobytes()
+        embedding.encoding = 'float16'
+        embedding.dimension = len(vector)
+        embedding.model_name = EMBEDDING_VERSION
+        embedding.is_normalized = True
+        converted.append(embedding)
+
+    ContentEmbedding.objects.bulk_update(
+        converted, ['embedding_vector', 'encoding', 'dimension', 'model_name', 'is_normalized'], batch_size=1000
+    )
+    ContentEmbedding.objects.filter(embedding__isnull=True).delete()
+    ContentEmbedding.objects.filter(pk__in=unreadable).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0013_embedding_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentembedding',
+            name='embedding_vector',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='contentembedding',
+            name='dimension',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='contentembedding',
+            name='encoding',
+            field=models.CharField(choices=[('float32', 'float32 (4 bytes per value)'), ('float16', 'float16 (2 bytes per value)'), ('int8', 'int8 with scale and offset (1 byte per value)')], default='float32', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='contentembedding',
+            name='is_normalized',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='contentembedding',
+            name='model_name',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='contentembedding',
+            name='quant_offset',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='contentembedding',
+            name='quant_scale',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.RunPython(convert_pickled_embeddings, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='contentembedding',
+            name='embedding',
+        ),
+    ]
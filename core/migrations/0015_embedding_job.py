@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 22:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0014_unified_content_embedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('enqueued_at', models.DateTimeField()),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['enqueued_at'], name='embedding_job_enqueued_idx')],
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+    ]
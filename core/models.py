@@ -8,7 +8,12 @@ from django.utils.translation import gettext_lazy as _
 import numpy as np
 from django.utils.text import slugify
 from django.utils import timezone
+from django.core.cache import cache
 from videos.models import Video
+from core.embedding_store import (
+    DEFAULT_ENCODING, EMBEDDING_DIMENSION, EMBEDDING_VERSION, ENCODING_CHOICES,
+    EmbeddingDimensionError, decode_vector, encode_vector, is_normalized
+)
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -242,29 +247,89 @@ class AdminLog(models.Model):
     def __str__(self):
         return f"{self.admin.username} - {self.get_action_type_display()} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
 
-class VideoEmbedding(models.Model):
+class StoredEmbedding(models.Model):
     """
-    Stores BERT embeddings for videos to be used by the recommendation engine.
+    Embedding vector stored together with the model, dimension and encoding that produced it.
+
+    Vectors are written as float16 by default (see core.embedding_store), half the
+    size of float32 in the database and in caches; int8 with a per-row scale and
+    offset halves that again. Rows written before this metadata existed have an
+    empty model_name and dimension 0 and decode as float32; readers skip rows
+    whose model_name is not the current EMBEDDING_VERSION.
     """
-    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='embedding')
-    embedding_vector = models.BinaryField()  # Stores the serialized numpy array
+    embedding_vector = models.BinaryField()  # Stores the encoded vector
+    model_name = models.CharField(max_length=200, blank=True, default='')  # Model and pooling that produced the vector ('' = unknown)
+    dimension = models.PositiveSmallIntegerField(default=0)  # Number of values (0 = infer from the payload)
+    encoding = models.CharField(max_length=10, choices=ENCODING_CHOICES, default='float32')
+    is_normalized = models.BooleanField(default=False)  # Whether the vector had unit length when stored
+    quant_scale = models.FloatField(default=1.0)  # int8 dequantization: value = code * scale + offset
+    quant_offset = models.FloatField(default=0.0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
-    def __str__(self):
-        return f"Embedding for {self.video.title}"
-    
+
+    class Meta:
+        abstract = True
+
     def get_vector(self):
         """
-        Deserialize the stored binary data into a numpy array
+        Decode the stored vector into a float32 numpy array
+
+        Raises:
+            EmbeddingDimensionError: If the payload does not match the recorded dimension
         """
-        return np.frombuffer(self.embedding_vector, dtype=np.float32)
-    
-    def set_vector(self, vector):
+        return decode_vector(self.embedding_vector, self.encoding, self.dimension, self.quant_scale, self.quant_offset)
+
+    def set_vector(self, vector, encoding=DEFAULT_ENCODING, model_name=EMBEDDING_VERSION):
         """
-        Serialize a numpy array for storage
+        Encode a numpy array for storage and record its metadata
         """
-        self.embedding_vector = vector.astype(np.float32).tobytes()
+        for field, value in self.encode_fields(vector, encoding, model_name).items():
+            setattr(self, field, value)
+
+    @staticmethod
+    def encode_fields(vector, encoding=DEFAULT_ENCODING, model_name=EMBEDDING_VERSION):
+        """
+        Field values storing `vector`, e.g. for update_or_create defaults or bulk_create
+
+        Returns:
+            dict: field name -> value
+        """
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        data, scale, offset = encode_vector(vector, encoding)
+        return {
+            'embedding_vector': data,
+            'model_name': model_name,
+            'dimension': len(vector),
+            'encoding': encoding,
+            'is_normalized': is_normalized(vector),
+            'quant_scale': scale,
+            'quant_offset': offset,
+        }
+
+    def matches_model(self, model_name=EMBEDDING_VERSION, dimension=EMBEDDING_DIMENSION):
+        """Whether the vector comes from `model_name` and has `dimension` values"""
+        if self.model_name != model_name:
+            return False
+        try:
+            return len(self.get_vector()) == dimension
+        except EmbeddingDimensionError:
+            return False
+
+
+# Fields rewritten by StoredEmbedding.set_vector, for bulk_update
+STORED_EMBEDDING_FIELDS = [
+    'embedding_vector', 'model_name', 'dimension', 'encoding', 'is_normalized', 'quant_scale', 'quant_offset'
+]
+
+
+class VideoEmbedding(StoredEmbedding):
+    """
+    Stores BERT embeddings for videos to be used by the recommendation engine.
+    """
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='embedding')
+    
+    def __str__(self):
+        return f"Embedding for {self.video.title}"
     
     @classmethod
     def create_from_video(cls, video, vector):
@@ -273,34 +338,19 @@ class VideoEmbedding(models.Model):
         """
         obj, created = cls.objects.update_or_create(
             video=video,
-            defaults={'embedding_vector': vector.astype(np.float32).tobytes()}
+            defaults=cls.encode_fields(vector)
         )
         return obj
 
-class UserEmbedding(models.Model):
+class UserEmbedding(StoredEmbedding):
     """
     Stores user preference embeddings based on their interactions.
     """
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='embedding')
-    embedding_vector = models.BinaryField()  # Stores the serialized numpy array
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"Preference embedding for {self.user.username}"
     
-    def get_vector(self):
-        """
-        Deserialize the stored binary data into a numpy array
-        """
-        return np.frombuffer(self.embedding_vector, dtype=np.float32)
-    
-    def set_vector(self, vector):
-        """
-        Serialize a numpy array for storage
-        """
-        self.embedding_vector = vector.astype(np.float32).tobytes()
-    
     @classmethod
     def create_from_user(cls, user, vector):
         """
@@ -308,10 +358,13 @@ class UserEmbedding(models.Model):
         """
         obj, created = cls.objects.update_or_create(
             user=user,
-            defaults={'embedding_vector': vector.astype(np.float32).tobytes()}
+            defaults=cls.encode_fields(vector)
         )
         return obj
 
+BANDIT_ARM_COUNT_CACHE_KEY = 'bandit_arm_count'
+BANDIT_ARM_COUNT_CACHE_TTL = 60 * 10  # 10 minutes in seconds
+
 class BanditStats(models.Model):
     """
     Stores statistics for the Contextual Bandit algorithm.
@@ -331,6 +384,17 @@ class BanditStats(models.Model):
     def __str__(self):
         return f"Bandit stats for {self.video.title}"
     
+    @classmethod
+    def get_arm_count(cls):
+        """
+        Total number of arms, cached so UCB updates don't run COUNT(*) every time
+        """
+        count = cache.get(BANDIT_ARM_COUNT_CACHE_KEY)
+        if count is None:
+            count = cls.objects.count()
+            cache.set(BANDIT_ARM_COUNT_CACHE_KEY, count, BANDIT_ARM_COUNT_CACHE_TTL)
+        return count
+    
     def update_stats(self, clicked=False, watch_time=0):
         """
         Update statistics after a recommendation is made
@@ -342,7 +406,7 @@ class BanditStats(models.Model):
             self.total_watch_time += watch_time
             
             # Calculate reward based on watch time
-            reward = min(1.0, watch_time / (self.video.duration or 300))  # Normalize, default to 5 min if no duration
+            reward = min(1.0, watch_time / (getattr(self.video, 'duration', None) or 300))  # Normalize, default to 5 min if no duration
             self.reward_sum += reward
             
         # Update UCB score
@@ -365,19 +429,20 @@ class BanditStats(models.Model):
         average_reward = self.reward_sum / self.impression_count if self.impression_count > 0 else 0
         
         # Exploration bonus (sqrt(2 * ln(total_count) / arm_count))
-        exploration_bonus = math.sqrt(2 * math.log(BanditStats.objects.count() or 1) / self.impression_count)
+        exploration_bonus = math.sqrt(2 * math.log(BanditStats.get_arm_count() or 1) / self.impression_count)
         
         # UCB score
         self.ucb_score = average_reward + exploration_bonus
 
-class ContentEmbedding(models.Model):
-    """Model to store pre-computed BERT embeddings for content"""
+class ContentEmbedding(StoredEmbedding):
+    """
+    Stores embeddings of blogs and posts for semantic search.
+    
+    Videos are embedded once, in VideoEmbedding, which search shares with the recommender.
+    """
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
-    embedding = models.BinaryField(null=True, blank=True, help_text="BERT embedding vector for the content")
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         unique_together = ('content_type', 'object_id')
@@ -387,3 +452,107 @@ class ContentEmbedding(models.Model):
     
     def __str__(self):
         return f"Embedding for {self.content_object}"
+
+class EmbeddingJob(models.Model):
+    """
+    A video, blog or post waiting to be embedded by the process_embedding_queue
+    worker (see core.embedding_queue).
+
+    There is at most one job per object: saving an object that is already
+    queued only moves its enqueued_at forward.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    enqueued_at = models.DateTimeField()  # Last time the object was queued
+    locked_until = models.DateTimeField(null=True, blank=True)  # Claimed by a worker, or waiting to be retried, until then
+    attempts = models.PositiveSmallIntegerField(default=0)  # Failed embedding attempts since the object was last queued
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+        indexes = [
+            models.Index(fields=['enqueued_at'], name='embedding_job_enqueued_idx'),
+        ]
+
+    def __str__(self):
+        return f"Embedding job for {self.content_type_id}:{self.object_id}"
+
+class RecommendationWatermark(models.Model):
+    """
+    Tracks when a user's recommendations were last precomputed, so the
+    precompute job only re-ranks users with new views or likes since then.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='recommendation_watermark')
+    precomputed_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"Recommendations for {self.user.username} precomputed at {self.precomputed_at}"
+
+class Impression(models.Model):
+    """
+    A recommended video rendered to a user, written in batches by the
+    impression logger (see core.impressions).
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name='impressions', db_index=False)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='impressions')
+    slot = models.PositiveSmallIntegerField()  # Position in the rendered list, from 0
+    source = models.CharField(max_length=16)  # Feed or widget the video was shown in, e.g. 'for_you', 'related'
+    shown_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'shown_at'], name='impression_user_shown_idx'),
+            models.Index(fields=['shown_at'], name='impression_shown_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Video {self.video_id} shown in {self.source} slot {self.slot}"
+
+class VideoViewBucket(models.Model):
+    """
+    Number of views a video received in one hour, the input to trending scores.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='view_buckets')
+    hour = models.DateTimeField()  # Start of the hour
+    views = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('video', 'hour')
+        indexes = [
+            models.Index(fields=['hour'], name='view_bucket_hour_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.views} views of video {self.video_id} at {self.hour}"
+
+class TrendingScore(models.Model):
+    """
+    Time-decayed view score of a recently viewed video, maintained by the
+    refresh_trending command so trending lookups are a single indexed read.
+    """
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='trending_score')
+    score = models.FloatField()
+    scored_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score', '-video'], name='trending_score_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Trending score {self.score:.2f} for video {self.video_id}"
+
+class RelatedVideos(models.Model):
+    """
+    Precomputed "related videos" list of a video, stored as a packed array of
+    video IDs and maintained by the build_related_videos command (see core.related).
+    """
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='related_list')
+    video_ids = models.BinaryField()  # Packed IDs, best match first
+    dtype = models.CharField(max_length=8)  # NumPy dtype of the packed IDs, e.g. '<u4'
+    computed_at = models.DateTimeField()
+    is_stale = models.BooleanField(default=False)  # Tags or categories changed since computed_at
+    
+    def __str__(self):
+        return f"Related videos for video {self.video_id}"
@@ -1,9 +1,9 @@
 import numpy as np
-import torch
-from transformers import AutoTokenizer, AutoModel
 from django.conf import settings
 from videos.models import Video
 from core.models import VideoEmbedding, UserEmbedding
+from core.embedding_store import EMBEDDING_DIMENSION, EMBEDDING_VERSION
+from core.embedding_service import DEFAULT_BATCH_SIZE, bulk_embed, embed_text, video_text
 import logging
 from django.core.cache import cache
 from django.db.models import Q
@@ -13,211 +13,162 @@ import time
 logger = logging.getLogger(__name__)
 
 # Constants
-EMBEDDING_DIMENSION = 768  # BERT base embedding dimension
-MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"  # Smaller, faster model that works well for similarity
 CACHE_TTL = 60 * 60 * 24  # 24 hours in seconds
+USER_EMBEDDING_HALF_LIFE_DAYS = 30  # Interactions lose half their weight in the user embedding after this long
+LIKE_INTERACTION_WEIGHT = 5.0  # Likes have high weight
+COMMENT_INTERACTION_WEIGHT = 3.0  # Comments have medium weight
+WATCH_MINUTE_WEIGHT = 1.0  # Weight per minute of watch time
+EMBEDDING_WRITE_SIZE = 500  # Videos loaded, embedded and written together by batch_generate_embeddings
 
-# Singleton pattern for model and tokenizer to avoid loading multiple times
-class BERTSingleton:
-    _instance = None
-    
-    @classmethod
-    def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = cls()
-        return cls._instance
-    
-    def __init__(self):
-        """Initialize the BERT model and tokenizer"""
-        try:
-            self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-            self.model = AutoModel.from_pretrained(MODEL_NAME)
-            # Set model to evaluation mode
-            self.model.eval()
-            logger.info(f"BERT model {MODEL_NAME} loaded successfully")
-        except Exception as e:
-            logger.error(f"Error loading BERT model: {e}")
-            self.tokenizer = None
-            self.model = None
-
-# Functions for generating and retrieving embeddings
-def get_bert_embedding(text):
+def generate_video_embedding(video):
     """
-    Generate a BERT embedding for a text string.
+    Generate embedding for a video by combining title, description, tags and categories.
     
     Args:
-        text (str): Text to generate embedding for
+        video (Video): Video object
         
     Returns:
-        numpy.ndarray: Embedding vector or None if failed
+        numpy.ndarray: Unit-length embedding, or a zero vector if it could not be generated
     """
-    if not text:
-        return np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
-    
-    # Get model instance
-    bert = BERTSingleton.get_instance()
-    if bert.model is None or bert.tokenizer is None:
-        logger.error("BERT model not initialized")
-        return np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
-    
-    try:
-        # Tokenize and get embeddings
-        with torch.no_grad():
-            inputs = bert.tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
-            outputs = bert.model(**inputs)
-            
-            # Use the [CLS] token embedding as the sentence embedding
-            embedding = outputs.last_hidden_state[:, 0, :].numpy().flatten()
-            
-            return embedding
-    except Exception as e:
-        logger.error(f"Error generating embedding: {e}")
-        return np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
+    return embed_text(video_text(video))
 
-def generate_video_embedding(video):
+def _decay(age_seconds):
+    """Weight multiplier for an interaction `age_seconds` old"""
+    return 0.5 ** (np.asarray(age_seconds, dtype=np.float64) / (USER_EMBEDDING_HALF_LIFE_DAYS * 86400))
+
+
+def calculate_user_preference_embedding(user):
     """
-    Generate embedding for a video by combining title, description, and tags.
+    Calculate a user's preference embedding from scratch based on their interactions
+    
+    The embedding is the time-decayed, weighted sum of the embeddings of every
+    video the user liked, commented on or watched (see apply_user_interaction,
+    which maintains the same sum incrementally). Only stored video embeddings
+    are used; unembedded videos are skipped rather than run through the model.
     
     Args:
-        video (Video): Video object
+        user (CustomUser): User object
         
     Returns:
-        numpy.ndarray: Combined embedding vector
+        numpy.ndarray: User preference embedding (not normalised)
     """
-    # Combine metadata with appropriate weighting
-    metadata = []
-    
-    # Title is most important (weight: 3)
-    if video.title:
-        metadata.extend([video.title] * 3)
-    
-    # Description is next (weight: 2)
-    if video.description:
-        metadata.extend([video.description] * 2)
-    
-    # Tags (weight: 1)
-    try:
-        # Assuming tags are stored as a related model or in a field
-        if hasattr(video, 'tags'):
-            tags = ' '.join([tag.name for tag in video.tags.all()])
-            if tags:
-                metadata.append(tags)
-    except:
-        pass
+    from django.utils import timezone
+    from core.models import Like, Comment
+    from core.embedding_matrix import get_embedding_matrix
+    from videos.models import VideoView
+    
+    # One flat query per interaction type instead of a joined annotate
+    events = [
+        (video_id, LIKE_INTERACTION_WEIGHT, created_at)
+        for video_id, created_at in Like.objects.filter(user=user, video__isnull=False).values_list('video_id', 'created_at')
+    ] + [
+        (video_id, COMMENT_INTERACTION_WEIGHT, created_at)
+        for video_id, created_at in Comment.objects.filter(user=user, video__isnull=False).values_list('video_id', 'created_at')
+    ] + [
+        (video_id, view_time / 60 * WATCH_MINUTE_WEIGHT, created_at)
+        for video_id, view_time, created_at in VideoView.objects.filter(user=user, view_time__gt=0).values_list('video_id', 'view_time', 'created_at')
+    ]
+    
+    matrix = get_embedding_matrix()
+    if not events or matrix.dimension is None:
+        # If user has no interactions, return zero vector
+        return np.zeros(matrix.dimension or EMBEDDING_DIMENSION, dtype=np.float32)
+    
+    now = timezone.now()
+    video_ids = np.array([video_id for video_id, _, _ in events], dtype=np.int64)
+    weights = np.array([weight for _, weight, _ in events], dtype=np.float64)
+    weights *= _decay([(now - created_at).total_seconds() for _, _, created_at in events])
+    
+    # Sum the weights per video, then take one weighted sum over the embedding rows
+    unique_ids, inverse = np.unique(video_ids, return_inverse=True)
+    per_video = np.bincount(inverse, weights=weights)
+    id_to_row = matrix.id_to_row
+    present = np.array([int(video_id) in id_to_row for video_id in unique_ids], dtype=bool)
+    if not present.any():
+        return np.zeros(matrix.dimension, dtype=np.float32)
+    
+    return (per_video[present] @ matrix.get_vectors(unique_ids[present])).astype(np.float32)
+
+
+def get_stored_video_vector(video_id):
+    """
+    Get a video's normalised embedding without running the model
     
-    # Categories (weight: 1)
-    try:
-        if hasattr(video, 'categories'):
-            categories = ' '.join([cat.name for cat in video.categories.all()])
-            if categories:
-                metadata.append(categories)
-    except:
-        pass
+    Returns:
+        numpy.ndarray or None: The embedding, or None if the video has none yet
+    """
+    from core.embedding_matrix import EmbeddingMatrix
     
-    # Combine all metadata
-    combined_text = ' '.join(metadata)
+    vector = EmbeddingMatrix.get_instance().get_vector(video_id)
+    if vector is not None:
+        return vector
     
-    # Get embedding
-    return get_bert_embedding(combined_text)
+    from core.embedding_cache import get_video_embeddings
+    vector = get_video_embeddings([video_id])[0]
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else None
 
-def calculate_user_preference_embedding(user):
+
+def apply_user_interaction(user_id, video_id, weight):
     """
-    Calculate a user's preference embedding based on their interactions
+    Fold one interaction into the stored user embedding
+    
+    The stored vector is decayed by the time since its last update and the
+    video's embedding is added with the given weight. This keeps the embedding
+    current without a rebuild; full rebuilds only run in the background
+    (see the rebuild_user_embeddings command).
     
     Args:
-        user (CustomUser): User object
+        user_id (int): ID of the user
+        video_id (int): ID of the video interacted with
+        weight (float): Interaction weight (e.g. LIKE_INTERACTION_WEIGHT)
         
     Returns:
-        numpy.ndarray: User preference embedding
+        bool: Whether the embedding was updated
     """
-    from django.db.models import Count, F, Sum
-    
-    # Get videos the user has interacted with, ordered by interaction strength
-    # Combine likes, comments, and views with different weights
-    videos = Video.objects.filter(
-        Q(likes__user=user) |  # User liked the video
-        Q(comments__user=user) |  # User commented on the video
-        Q(video_views__user=user)  # User viewed the video
-    ).annotate(
-        interaction_score=Count('likes', filter=Q(likes__user=user)) * 5 +  # Likes have high weight
-                      Count('comments', filter=Q(comments__user=user)) * 3 +  # Comments have medium weight
-                      Sum(F('video_views__view_time'), filter=Q(video_views__user=user)) / 60  # View time in minutes
-    ).order_by('-interaction_score')[:20]  # Limit to top 20 videos
-    
-    if not videos:
-        # If user has no interactions, return zero vector
-        return np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
-    
-    # Get embeddings for these videos
-    embeddings = []
-    
-    for video in videos:
-        # Try to get from database first
-        try:
-            video_embedding = VideoEmbedding.objects.get(video=video)
-            embedding = video_embedding.get_vector()
-            embeddings.append(embedding * (video.interaction_score / 10.0))  # Weight by interaction score
-        except VideoEmbedding.DoesNotExist:
-            # Generate embedding if not in database
-            embedding = generate_video_embedding(video)
-            # Store for future use
-            VideoEmbedding.create_from_video(video, embedding)
-            embeddings.append(embedding * (video.interaction_score / 10.0))
-    
-    if not embeddings:
-        return np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
+    from django.db import transaction
+    from django.utils import timezone
     
-    # Average the embeddings
-    user_embedding = np.mean(embeddings, axis=0)
+    if weight <= 0:
+        return False
     
-    # Normalize the embedding
-    norm = np.linalg.norm(user_embedding)
-    if norm > 0:
-        user_embedding = user_embedding / norm
+    video_vector = get_stored_video_vector(video_id)
+    if video_vector is None:
+        return False
     
-    return user_embedding
+    with transaction.atomic():
+        embedding_obj = UserEmbedding.objects.select_for_update().filter(user_id=user_id).first()
+        
+        vector = weight * video_vector
+        if embedding_obj is not None:
+            current = embedding_obj.get_vector()
+            if len(current) == len(video_vector):
+                age = (timezone.now() - embedding_obj.updated_at).total_seconds()
+                vector = current * _decay(age) + vector
+        
+        vector = vector.astype(np.float32)
+        UserEmbedding.objects.update_or_create(
+            user_id=user_id,
+            defaults=UserEmbedding.encode_fields(vector)
+        )
+    
+    cache.set(f"user_embedding_{user_id}", vector, CACHE_TTL)
+    return True
 
 def get_or_create_video_embedding(video_id):
     """
     Get a video's embedding from cache or database, or create if doesn't exist
     
+    Prefer get_video_embeddings (core.embedding_cache) when looking up several videos.
+    
     Args:
         video_id (int): ID of the video
         
     Returns:
         numpy.ndarray: Video embedding
     """
-    # Try cache first
-    cache_key = f"video_embedding_{video_id}"
-    cached_embedding = cache.get(cache_key)
-    
-    if cached_embedding is not None:
-        return cached_embedding
-    
-    # Try database
-    try:
-        video = Video.objects.get(id=video_id)
-        try:
-            embedding_obj = VideoEmbedding.objects.get(video=video)
-            embedding = embedding_obj.get_vector()
-            
-            # Store in cache
-            cache.set(cache_key, embedding, CACHE_TTL)
-            
-            return embedding
-        except VideoEmbedding.DoesNotExist:
-            # Generate new embedding
-            embedding = generate_video_embedding(video)
-            
-            # Store in database
-            VideoEmbedding.create_from_video(video, embedding)
-            
-            # Store in cache
-            cache.set(cache_key, embedding, CACHE_TTL)
-            
-            return embedding
-    except Video.DoesNotExist:
-        return np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
+    from core.embedding_cache import get_video_embeddings
+    return get_video_embeddings([video_id], create_missing=True)[0]
 
 def get_or_create_user_embedding(user_id):
     """
@@ -229,9 +180,6 @@ def get_or_create_user_embedding(user_id):
     Returns:
         numpy.ndarray: User preference embedding
     """
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
-    
     # Try cache first
     cache_key = f"user_embedding_{user_id}"
     cached_embedding = cache.get(cache_key)
@@ -241,33 +189,17 @@ def get_or_create_user_embedding(user_id):
     
     # Try database
     try:
-        user = User.objects.get(id=user_id)
-        
-        try:
-            embedding_obj = UserEmbedding.objects.get(user=user)
-            # Check if it's recent enough (less than 24 hours old)
-            from django.utils import timezone
-            if timezone.now() - embedding_obj.updated_at < timezone.timedelta(days=1):
-                embedding = embedding_obj.get_vector()
-                
-                # Store in cache
-                cache.set(cache_key, embedding, CACHE_TTL)
-                
-                return embedding
-        except UserEmbedding.DoesNotExist:
-            pass
-        
-        # Generate new embedding
-        embedding = calculate_user_preference_embedding(user)
-        
-        # Store in database
-        UserEmbedding.create_from_user(user, embedding)
+        # Interaction events keep the stored embedding current, so it is used
+        # whatever its age; rebuilds only happen in the background job
+        embedding_obj = UserEmbedding.objects.get(user_id=user_id)
+        embedding = embedding_obj.get_vector()
         
         # Store in cache
         cache.set(cache_key, embedding, CACHE_TTL)
         
         return embedding
-    except User.DoesNotExist:
+    except UserEmbedding.DoesNotExist:
+        # Not built yet: no personalisation until the first interaction or rebuild
         return np.zeros(EMBEDDING_DIMENSION, dtype=np.float32)
 
 def calculate_similarity(embedding1, embedding2):
@@ -284,6 +216,10 @@ def calculate_similarity(embedding1, embedding2):
     if embedding1 is None or embedding2 is None:
         return 0.0
     
+    if len(embedding1) != len(embedding2):
+        logger.warning(f"Cannot compare embeddings of dimension {len(embedding1)} and {len(embedding2)}")
+        return 0.0
+    
     # Check for zero vectors
     if np.all(embedding1 == 0) or np.all(embedding2 == 0):
         return 0.0
@@ -292,35 +228,41 @@ def calculate_similarity(embedding1, embedding2):
     similarity = np.dot(embedding1, embedding2) / (np.linalg.norm(embedding1) * np.linalg.norm(embedding2))
     return float(similarity)
 
-def batch_generate_embeddings(max_videos=1000):
+def batch_generate_embeddings(max_videos=1000, batch_size=DEFAULT_BATCH_SIZE):
     """
     Generate embeddings for videos that don't have them yet
-    
+
+    The newest videos without an embedding from the current model are
+    embedded with batched inference and written in bulk (see bulk_embed),
+    EMBEDDING_WRITE_SIZE videos at a time.
+
     Args:
         max_videos (int): Maximum number of videos to process
-        
+        batch_size (int): Texts per forward pass
+
     Returns:
         int: Number of embeddings generated
     """
-    # Get videos without embeddings
-    videos_without_embeddings = Video.objects.filter(
-        ~Q(embedding__isnull=False)
-    ).order_by('-created_at')[:max_videos]
-    
+    # Get videos without embeddings (or with one from another model version)
+    video_ids = list(Video.objects.filter(
+        Q(embedding__isnull=True) | ~Q(embedding__model_name=EMBEDDING_VERSION)
+    ).order_by('-created_at').values_list('id', flat=True)[:max_videos])
+
     count = 0
     start_time = time.time()
-    
-    for video in videos_without_embeddings:
-        embedding = generate_video_embedding(video)
-        VideoEmbedding.create_from_video(video, embedding)
-        count += 1
-        
+
+    for start in range(0, len(video_ids), EMBEDDING_WRITE_SIZE):
+        videos = list(
+            Video.objects.filter(id__in=video_ids[start:start + EMBEDDING_WRITE_SIZE])
+            .prefetch_related('tags', 'categories')
+        )
+        count += len(bulk_embed(videos, batch_size))
+
         # Log progress
-        if count % 100 == 0:
-            elapsed = time.time() - start_time
-            logger.info(f"Generated {count} embeddings in {elapsed:.2f} seconds")
-    
+        elapsed = time.time() - start_time
+        logger.info(f"Generated {count} embeddings in {elapsed:.2f} seconds ({count / max(elapsed, 1e-9):.1f} videos/s)")
+
     elapsed = time.time() - start_time
     logger.info(f"Finished generating {count} embeddings in {elapsed:.2f} seconds")
-    
-    return count 
\ No newline at end of file
+
+    return count
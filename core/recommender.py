@@ -1,15 +1,26 @@
 import numpy as np
-from django.db.models import F, Q, Count, Avg, Sum, Case, When, Value, FloatField
+from django.db.models import F, Q, Count, Avg, Sum, Max, Case, When, Value, FloatField
 from django.core.cache import cache
 from videos.models import Video, VideoView
 from core.models import BanditStats, VideoEmbedding, UserEmbedding, Like
 from core.nlp import get_or_create_video_embedding, get_or_create_user_embedding, calculate_similarity
+from core.embedding_matrix import get_embedding_matrix
+from core.ann_index import get_video_index
+from core.bandit_buffer import get_bandit_buffer
+from core.item_similarity import get_item_similarity_model
+from core.matrix_factorization import get_factor_model
+from core.trending import get_trending_video_ids
+from core.exploration import get_exploration_sampler
+from core.timing import RecommendationTrace, mark_cache
 import logging
+import multiprocessing
 import random
+import time
+import zlib
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.contenttypes.models import ContentType
-from django.db import connection
+from django.db import connection, connections
 from functools import lru_cache
 
 # Set up logging
@@ -19,12 +30,118 @@ logger = logging.getLogger(__name__)
 DEFAULT_NUM_RECOMMENDATIONS = 100  # Increased to show more videos by default
 MAX_RECOMMENDATIONS = 1000  # Maximum number of videos to fetch
 CACHE_TTL = 60 * 10  # 10 minutes in seconds
+PRECOMPUTED_CACHE_TTL = CACHE_TTL * 6  # Precomputed lists live longer than ones ranked on demand
 POPULARITY_WEIGHT = 0.3  # Weight given to popularity versus similarity
 NOVELTY_WEIGHT = 0.2  # Weight for novelty (recency)
 EXPLORATION_RATE = 0.1  # Probability of exploring random videos
 WATCH_TIME_WEIGHT = 0.4  # Weight for user watch time patterns
 LIKE_WEIGHT = 0.5  # Weight for liked content (strong signal)
 COLLAB_WEIGHT = 0.3  # Weight for collaborative filtering
+RANKED_LIST_SIZE = MAX_RECOMMENDATIONS  # Length of the cached ranked list shared by all callers
+RANKED_LIST_FORMAT = 1  # Bump when the cached ranked list layout changes
+POPULAR_VIDEOS_CACHE_KEY = 'popular_video_ids'
+ANN_CATALOGUE_THRESHOLD = 200000  # Use the ANN index instead of exact scoring above this many embeddings
+RECENT_HISTORY_SIZE = 50  # Most recently watched videos used as item-item seeds
+LIKED_SEED_WEIGHT = 2.0  # Item-item seed weight of a liked video relative to a watched one
+
+def get_recommendation_version():
+    """Current generation of cached ranked lists (see bump_recommendation_version)"""
+    return cache.get_or_set('recommendation_version', 1, None)
+
+
+def bump_recommendation_version():
+    """Invalidate every cached ranked list, e.g. after the models were retrained"""
+    try:
+        cache.incr('recommendation_version')
+    except ValueError:
+        cache.set('recommendation_version', 2, None)
+
+
+def ranked_cache_key(user_id, exclude_watched=True):
+    return f"user_ranked_recommendations_{user_id}_{exclude_watched}"
+
+
+def get_cached_ranked_ids(user_id, exclude_watched=True):
+    """
+    Get a user's cached ranked recommendation list
+    
+    Returns:
+        numpy.ndarray or None: Ranked video IDs, or None if missing or stale
+    """
+    entry = cache.get(ranked_cache_key(user_id, exclude_watched))
+    if not entry or entry.get('version') != (RANKED_LIST_FORMAT, get_recommendation_version()):
+        return None
+    return np.frombuffer(entry['ids'], dtype=entry['dtype']).astype(np.int64)
+
+
+def cache_ranked_ids(user_id, exclude_watched, video_ids, timeout=CACHE_TTL):
+    """Store a ranked list as packed integers with a version stamp"""
+    video_ids = np.asarray(video_ids, dtype=np.int64)
+    dtype = np.uint32 if not len(video_ids) or video_ids.max() < 2 ** 32 else np.int64
+    cache.set(ranked_cache_key(user_id, exclude_watched), {
+        'version': (RANKED_LIST_FORMAT, get_recommendation_version()),
+        'dtype': np.dtype(dtype).str,
+        'ids': video_ids.astype(dtype).tobytes(),
+    }, timeout)
+
+
+class RecommendationContext:
+    """
+    Per-request state shared by all recommendation sources.
+    
+    The user's watched, liked and subscribed ids, the candidate catalogue and the
+    user vector are loaded once here, so the individual sources work on arrays
+    instead of each re-querying the same rows.
+    """
+    
+    def __init__(self, user, exclude_watched=True):
+        """
+        Load the shared state for a user
+        
+        Args:
+            user (User): User object
+            exclude_watched (bool): Whether to drop watched videos from the candidates
+        """
+        self.user = user
+        self.exclude_watched = exclude_watched
+        
+        # Watch history, most recent first
+        history = np.fromiter(
+            VideoView.objects.filter(user=user, video__isnull=False).order_by('-created_at').values_list('video_id', flat=True),
+            dtype=np.int64
+        )
+        self.watched_ids, first_seen = np.unique(history, return_index=True)
+        self.recent_ids = history[np.sort(first_seen)][:RECENT_HISTORY_SIZE]
+        self.liked_ids = np.unique(np.fromiter(
+            Like.objects.filter(user=user, video__isnull=False).values_list('video_id', flat=True),
+            dtype=np.int64
+        ))
+        self.subscribed_creator_ids = np.fromiter(
+            user.subscribed_to.values_list('id', flat=True),
+            dtype=np.int64
+        )
+        
+        # Only the columns needed for scoring; full objects are loaded for the top-k only
+        candidates = list(
+            Video.objects.filter(
+                is_published=True,
+                moderation_status='approved'
+            ).values_list('id', 'views', 'created_at', 'creator_id')
+        )
+        now = timezone.now()
+        ids = np.array([row[0] for row in candidates], dtype=np.int64)
+        keep = ~np.isin(ids, self.watched_ids) if exclude_watched else np.ones(len(ids), dtype=bool)
+        
+        self.candidate_ids = ids[keep]
+        self.candidate_views = np.array([row[1] for row in candidates], dtype=np.float32)[keep]
+        self.candidate_created_at = np.array([row[2].timestamp() for row in candidates], dtype=np.float64)[keep]
+        self.candidate_days_old = np.array([(now - row[2]).days for row in candidates], dtype=np.float32)[keep]
+        self.candidate_creator_ids = np.array([row[3] for row in candidates], dtype=np.int64)[keep]
+        
+        # Embed any new candidates once, up front, for every source
+        self.matrix = get_embedding_matrix()
+        self.matrix.ensure(self.candidate_ids)
+        self.user_query = self.matrix.prepare_query(get_or_create_user_embedding(user.id))
 
 class ContextualBanditRecommender:
     """
@@ -41,114 +158,139 @@ class ContextualBanditRecommender:
         """
         self.exploration_rate = exploration_rate
     
-    def recommend_for_user(self, user_id, num_recommendations=DEFAULT_NUM_RECOMMENDATIONS, exclude_watched=True):
+    def recommend_for_user(self, user_id, num_recommendations=DEFAULT_NUM_RECOMMENDATIONS, exclude_watched=True, trace=None):
         """
         Generate recommendations for a user
         
+        Every call is traced: each stage's wall time, SQL queries, candidate
+        counts and cache outcome are logged as one structured line (see core.timing).
+        
         Args:
             user_id (int): ID of the user
             num_recommendations (int): Number of videos to recommend
             exclude_watched (bool): Whether to exclude videos the user has already watched
+            trace (RecommendationTrace): Trace to record into (a new one if omitted)
             
         Returns:
             list: List of Video objects
         """
+        with trace or RecommendationTrace('recommend_for_user', user_id) as trace:
+            # Try cache first: one ranked list per user, sliced to the requested size
+            with trace.stage('ranked_cache') as stage:
+                ranked_ids = get_cached_ranked_ids(user_id, exclude_watched)
+                stage.cache = 'miss' if ranked_ids is None else 'hit'
+            if ranked_ids is not None:
+                with trace.stage('hydrate', len(ranked_ids)) as stage:
+                    videos = self.hydrate_ranked(ranked_ids, 0, num_recommendations)
+                    stage.candidates_out = len(videos)
+                return videos
+            
+            return self._rank_for_user(user_id, num_recommendations, exclude_watched, trace)
+    
+    def _rank_for_user(self, user_id, num_recommendations, exclude_watched, trace):
+        """Uncached part of recommend_for_user, recording each stage into `trace`"""
         from django.contrib.auth import get_user_model
         User = get_user_model()
         
-        # Try cache first for frequent users
-        cache_key = f"user_recommendations_{user_id}_{num_recommendations}_{exclude_watched}"
-        cached_recs = cache.get(cache_key)
-        
-        if cached_recs is not None:
-            try:
-                # Convert cached video IDs back to Video objects
-                videos = Video.objects.filter(id__in=cached_recs)
-                if len(videos) == len(cached_recs):
-                    return videos
-            except:
-                pass  # If there's any issue, just regenerate recommendations
-        
         try:
             user = User.objects.get(id=user_id)
         except User.DoesNotExist:
             # If user doesn't exist, return popular videos
-            return self.get_popular_videos(num_recommendations)
+            with trace.stage('popular') as stage:
+                videos = self.get_popular_videos(num_recommendations)
+                stage.candidates_out = len(videos)
+            return videos
             
         # Decide if we should explore or exploit
         if random.random() < self.exploration_rate:
             # Exploration: Get some random recent videos
-            return self.get_exploration_videos(user, num_recommendations, exclude_watched)
+            with trace.stage('exploration') as stage:
+                videos = self.get_exploration_videos(user, num_recommendations, exclude_watched)
+                stage.candidates_out = len(videos)
+            return videos
         else:
             # Exploitation: Get personalized recommendations using our hybrid approach
             
+            # Rank a full list once, whatever size this caller asked for
+            list_size = max(num_recommendations, RANKED_LIST_SIZE)
+            
+            # Load the user's history, the candidate catalogue and the user vector once
+            with trace.stage('context') as stage:
+                context = RecommendationContext(user, exclude_watched)
+                stage.candidates_out = len(context.candidate_ids)
+            
+            def run_source(name, source, num_videos):
+                with trace.stage(name, len(context.candidate_ids)) as stage:
+                    videos = source(user, num_videos, exclude_watched, context)
+                    stage.candidates_out = len(videos)
+                return videos
+            
             # 1. Content-based recommendations
-            content_based_videos = self.get_personalized_videos(user, num_recommendations * 2, exclude_watched)
+            content_based_videos = run_source('personalized', self.get_personalized_videos, list_size * 2)
             
             # 2. Collaborative filtering recommendations
-            collaborative_videos = self.get_collaborative_recommendations(user, num_recommendations, exclude_watched)
+            collaborative_videos = run_source('collaborative', self.get_collaborative_recommendations, list_size)
             
             # 3. Videos from categories user has watched most
-            category_videos = self.get_category_recommendations(user, num_recommendations, exclude_watched)
+            category_videos = run_source('category', self.get_category_recommendations, list_size)
             
             # 4. Videos similar to what user has liked
-            liked_content_videos = self.get_recommendations_from_likes(user, num_recommendations, exclude_watched)
+            liked_content_videos = run_source('likes', self.get_recommendations_from_likes, list_size)
             
             # 5. Videos user has watched longest (for similar content)
-            watch_time_videos = self.get_watch_time_recommendations(user, num_recommendations, exclude_watched)
+            watch_time_videos = run_source('watch_time', self.get_watch_time_recommendations, list_size)
+            
+            # 6. Matrix factorisation scores (only once factors have been trained)
+            factor_videos = run_source('factors', self.get_factor_recommendations, list_size)
             
             # Combine all recommendation sources with weights
             # Remove duplicates while preserving order of importance
+            merged_sources = (
+                # Liked content is highest priority (strongest signal)
+                liked_content_videos,
+                # Videos user has watched longest (strong signal of interest)
+                watch_time_videos,
+                # Content-based recommendations
+                content_based_videos,
+                # Matrix factorisation recommendations
+                factor_videos,
+                # Collaborative filtering recommendations
+                collaborative_videos,
+                # Category-based recommendations
+                category_videos,
+            )
             all_videos = []
             video_ids_seen = set()
             
-            # Liked content is highest priority (strongest signal)
-            for video in liked_content_videos:
-                if video.id not in video_ids_seen:
-                    all_videos.append(video)
-                    video_ids_seen.add(video.id)
-            
-            # Videos user has watched longest (strong signal of interest)  
-            for video in watch_time_videos:
-                if video.id not in video_ids_seen:
-                    all_videos.append(video)
-                    video_ids_seen.add(video.id)
-            
-            # Content-based recommendations
-            for video in content_based_videos:
-                if video.id not in video_ids_seen:
-                    all_videos.append(video)
-                    video_ids_seen.add(video.id)
-            
-            # Collaborative filtering recommendations
-            for video in collaborative_videos:
-                if video.id not in video_ids_seen:
-                    all_videos.append(video)
-                    video_ids_seen.add(video.id)
-            
-            # Category-based recommendations
-            for video in category_videos:
-                if video.id not in video_ids_seen:
-                    all_videos.append(video)
-                    video_ids_seen.add(video.id)
+            with trace.stage('merge', sum(len(videos) for videos in merged_sources)) as stage:
+                for videos in merged_sources:
+                    for video in videos:
+                        if video.id not in video_ids_seen:
+                            all_videos.append(video)
+                            video_ids_seen.add(video.id)
+                stage.candidates_out = len(all_videos)
             
             # If we don't have enough videos, supplement with popular ones
-            if len(all_videos) < num_recommendations:
-                popular_videos = self.get_popular_videos(num_recommendations - len(all_videos))
-                for video in popular_videos:
-                    if video.id not in video_ids_seen:
-                        all_videos.append(video)
-                        video_ids_seen.add(video.id)
+            if len(all_videos) < list_size:
+                with trace.stage('popular_fill', len(all_videos)) as stage:
+                    popular_videos = self.get_popular_videos(list_size - len(all_videos))
+                    for video in popular_videos:
+                        if video.id not in video_ids_seen:
+                            all_videos.append(video)
+                            video_ids_seen.add(video.id)
+                    stage.candidates_out = len(all_videos)
             
             # Apply UCB ranking to select final videos
-            ranked_videos = self.rank_videos_ucb(user, all_videos)[:num_recommendations]
+            with trace.stage('ucb_rank', len(all_videos)) as stage:
+                ranked_videos = self.rank_videos_ucb(user, all_videos, context)[:list_size]
+                stage.candidates_out = len(ranked_videos)
             
-            # Cache the recommendations
-            cache.set(cache_key, [video.id for video in ranked_videos], CACHE_TTL)
+            # Cache the full ranked list; every caller slices it
+            cache_ranked_ids(user_id, exclude_watched, [video.id for video in ranked_videos])
             
-            return ranked_videos
+            return ranked_videos[:num_recommendations]
     
-    def get_personalized_videos(self, user, num_videos, exclude_watched=True):
+    def get_personalized_videos(self, user, num_videos, exclude_watched=True, context=None):
         """
         Get personalized video recommendations for a user based on content similarity
         
@@ -156,87 +298,50 @@ class ContextualBanditRecommender:
             user (User): User object
             num_videos (int): Number of videos to recommend
             exclude_watched (bool): Whether to exclude videos the user has already watched
+            context (RecommendationContext): Shared per-request state (built if omitted)
             
         Returns:
             list: List of Video objects
         """
-        # Get user embedding
-        user_embedding = get_or_create_user_embedding(user.id)
-        
-        # Get candidate videos
-        # Start with recent videos that match the user's preferred categories/tags if available
-        candidate_videos = Video.objects.filter(
-            is_published=True,
-            moderation_status='approved'
-        )
+        context = context or RecommendationContext(user, exclude_watched)
+        candidate_ids = context.candidate_ids
+        if not len(candidate_ids):
+            return []
         
-        # Exclude watched videos if requested
-        if exclude_watched:
-            watched_video_ids = Video.objects.filter(
-                video_views__user=user
-            ).values_list('id', flat=True)
-            candidate_videos = candidate_videos.exclude(id__in=watched_video_ids)
-            
-        # Prioritize videos from subscribed channels
-        subscribed_creator_ids = user.subscribed_to.values_list('id', flat=True)
-        
-        # Mix of subscribed and general content
-        if subscribed_creator_ids:
-            # Get videos from subscribed channels
-            subscribed_videos = candidate_videos.filter(
-                creator_id__in=subscribed_creator_ids
-            ).order_by('-created_at')
-            
-            # Get videos from general content
-            other_videos = candidate_videos.exclude(
-                creator_id__in=subscribed_creator_ids
-            ).order_by('-created_at')
-            
-            # Combine both sets but prioritize subscribed content
-            candidate_videos = list(subscribed_videos) + list(other_videos)
+        # Videos without a usable embedding keep a low default similarity
+        similarity = np.full(len(candidate_ids), 0.1, dtype=np.float32)
+        query = context.user_query
+        if query is not None:
+            scored_ids, scored = context.matrix.score(query, candidate_ids)
+            similarity[np.isin(candidate_ids, scored_ids)] = scored
         else:
-            # If no subscriptions, just get recent videos
-            candidate_videos = candidate_videos.order_by('-created_at')
+            similarity[np.isin(candidate_ids, context.matrix.ids)] = 0.0
         
-        # Get video embeddings and calculate similarity scores
-        video_similarities = []
+        # Popularity factor (0 to 1 scale based on views)
+        popularity = np.minimum(1.0, context.candidate_views / 10000)
         
-        for video in candidate_videos:
-            try:
-                video_embedding = get_or_create_video_embedding(video.id)
-                similarity = calculate_similarity(user_embedding, video_embedding)
-                
-                # Adjust with popularity and recency boosts
-                try:
-                    # Popularity factor (0 to 1 scale based on views)
-                    popularity = min(1.0, video.views / 10000)
-                    
-                    # Recency factor (1.0 for new, decreasing with age)
-                    days_old = (timezone.now() - video.created_at).days
-                    recency = max(0.1, 1.0 - (days_old / 30))  # Linear decay over 30 days, minimum 0.1
-                    
-                    # Final score combining similarity, popularity, and recency
-                    score = (
-                        similarity * (1 - POPULARITY_WEIGHT - NOVELTY_WEIGHT) + 
-                        popularity * POPULARITY_WEIGHT + 
-                        recency * NOVELTY_WEIGHT
-                    )
-                except:
-                    # If any error calculating adjustments, just use similarity
-                    score = similarity
-                
-                video_similarities.append((video, score))
-            except:
-                # If any error with embeddings, just add with low score
-                video_similarities.append((video, 0.1))
+        # Recency factor (1.0 for new, linear decay over 30 days, minimum 0.1)
+        recency = np.maximum(0.1, 1.0 - (context.candidate_days_old / 30))
         
-        # Sort by similarity score
-        video_similarities.sort(key=lambda x: x[1], reverse=True)
+        # Final score combining similarity, popularity, and recency
+        scores = (
+            similarity * (1 - POPULARITY_WEIGHT - NOVELTY_WEIGHT) +
+            popularity * POPULARITY_WEIGHT +
+            recency * NOVELTY_WEIGHT
+        )
+        
+        # Take the top-k, then order it by score with ties going to subscribed
+        # channels first and newer videos next
+        if num_videos < len(scores):
+            selected = np.argpartition(-scores, num_videos - 1)[:num_videos]
+        else:
+            selected = np.arange(len(scores))
+        subscribed = np.isin(context.candidate_creator_ids[selected], context.subscribed_creator_ids)
+        order = np.lexsort((-context.candidate_created_at[selected], ~subscribed, -scores[selected]))
         
-        # Extract just the videos
-        return [video for video, _ in video_similarities[:num_videos]]
+        return self._hydrate(candidate_ids[selected[order]])
     
-    def get_recommendations_from_likes(self, user, num_videos, exclude_watched=True):
+    def get_recommendations_from_likes(self, user, num_videos, exclude_watched=True, context=None):
         """
         Get recommendations based on videos similar to what the user has liked
         
@@ -244,90 +349,85 @@ class ContextualBanditRecommender:
             user (User): User object
             num_videos (int): Number of videos to recommend
             exclude_watched (bool): Whether to exclude videos the user has already watched
+            context (RecommendationContext): Shared per-request state (built if omitted)
             
         Returns:
             list: List of Video objects
         """
-        # Get content types for videos
-        video_content_type = ContentType.objects.get_for_model(Video)
+        context = context or RecommendationContext(user, exclude_watched)
         
         # Get videos the user has liked
-        liked_videos = Video.objects.filter(
-            likes__user=user
-        )
-        
-        if not liked_videos.exists():
+        if not len(context.liked_ids):
             return []
         
-        # Get candidate videos
-        candidate_videos = Video.objects.filter(
-            is_published=True,
-            moderation_status='approved'
-        )
+        # Candidates, excluding already liked videos
+        candidate_ids = context.candidate_ids[~np.isin(context.candidate_ids, context.liked_ids)]
         
-        # Exclude watched videos if requested
-        if exclude_watched:
-            watched_video_ids = Video.objects.filter(
-                video_views__user=user
-            ).values_list('id', flat=True)
-            candidate_videos = candidate_videos.exclude(id__in=watched_video_ids)
-        
-        # Also exclude already liked videos
-        candidate_videos = candidate_videos.exclude(
-            id__in=liked_videos.values_list('id', flat=True)
-        )
+        matrix = context.matrix
+        matrix.ensure(context.liked_ids)
         
         # Get embeddings for liked videos
-        liked_embeddings = []
-        for video in liked_videos:
-            try:
-                embedding = get_or_create_video_embedding(video.id)
-                liked_embeddings.append(embedding)
-            except:
-                pass
-        
-        if not liked_embeddings:
+        liked_embeddings = matrix.get_vectors(context.liked_ids)
+        
+        if not len(liked_embeddings) or not len(candidate_ids):
             return []
         
-        # Calculate similarity between candidate videos and liked videos
-        similar_videos = []
-        for candidate in candidate_videos:
-            try:
-                candidate_embedding = get_or_create_video_embedding(candidate.id)
-                
-                # Calculate average similarity to all liked videos
-                total_similarity = sum(
-                    calculate_similarity(candidate_embedding, liked_embedding)
-                    for liked_embedding in liked_embeddings
-                )
-                avg_similarity = total_similarity / len(liked_embeddings)
-                
-                similar_videos.append((candidate, avg_similarity))
-            except:
-                pass
+        # The average cosine similarity to all liked videos equals the similarity
+        # to the mean of their unit vectors, so a single query suffices
+        top_ids = self._rank_by_similarity(matrix, liked_embeddings.mean(axis=0, keepdims=True), candidate_ids, num_videos)
+        return self._hydrate(top_ids)
+    
+    def get_collaborative_recommendations(self, user, num_videos, exclude_watched=True, context=None):
+        """
+        Get recommendations based on what similar users have watched
         
-        # Sort by similarity score
-        similar_videos.sort(key=lambda x: x[1], reverse=True)
+        Args:
+            user (User): User object
+            num_videos (int): Number of videos to recommend
+            exclude_watched (bool): Whether to exclude videos the user has already watched
+            context (RecommendationContext): Shared per-request state (built if omitted)
+            
+        Returns:
+            list: List of Video objects
+        """
+        context = context or RecommendationContext(user, exclude_watched)
+        
+        model = get_item_similarity_model()
+        if model.is_empty:
+            # No item-item model has been built yet
+            return self._get_similar_user_recommendations(user, num_videos, exclude_watched, context)
+        
+        # Seed with recent watches and likes (likes are the stronger signal)
+        seed_ids = np.concatenate([context.recent_ids, context.liked_ids])
+        seed_weights = np.concatenate([
+            np.ones(len(context.recent_ids), dtype=np.float32),
+            np.full(len(context.liked_ids), LIKED_SEED_WEIGHT, dtype=np.float32)
+        ])
+        if not len(seed_ids):
+            return []
         
-        # Extract just the videos
-        return [video for video, _ in similar_videos[:num_videos]]
+        # Sum the precomputed neighbour scores of the seeds, keeping eligible candidates only
+        neighbor_ids, scores = model.score(seed_ids, seed_weights)
+        eligible = np.isin(neighbor_ids, context.candidate_ids)
+        top_ids, _ = context.matrix.top_k(neighbor_ids[eligible], scores[eligible], num_videos)
+        return self._hydrate(top_ids)
     
-    def get_collaborative_recommendations(self, user, num_videos, exclude_watched=True):
+    def _get_similar_user_recommendations(self, user, num_videos, exclude_watched, context):
         """
-        Get recommendations based on what similar users have watched
+        Collaborative fallback used until the item-item model is built:
+        videos watched by users with overlapping watch history
         
         Args:
             user (User): User object
             num_videos (int): Number of videos to recommend
             exclude_watched (bool): Whether to exclude videos the user has already watched
+            context (RecommendationContext): Shared per-request state
             
         Returns:
             list: List of Video objects
         """
         # Find users with similar viewing patterns
-        watched_video_ids = VideoView.objects.filter(
-            user=user
-        ).values_list('video_id', flat=True).distinct()
+        watched_video_ids = context.watched_ids.tolist()
         
         if not watched_video_ids:
             return []
@@ -343,11 +443,11 @@ class ContextualBanditRecommender:
             overlap__gte=2
         ).order_by('-overlap')[:20]  # Top 20 similar users
         
-        if not similar_users:
-            return []
-        
         similar_user_ids = [u['user'] for u in similar_users]
         
+        if not similar_user_ids:
+            return []
+        
         # Get videos that these similar users have watched but user hasn't
         collaborative_videos = Video.objects.filter(
             video_views__user_id__in=similar_user_ids,
@@ -370,7 +470,31 @@ class ContextualBanditRecommender:
         
         return list(collaborative_videos[:num_videos])
     
-    def get_watch_time_recommendations(self, user, num_videos, exclude_watched=True):
+    def get_factor_recommendations(self, user, num_videos, exclude_watched=True, context=None):
+        """
+        Get recommendations from the trained ALS factors (see the train_als command)
+        
+        Args:
+            user (User): User object
+            num_videos (int): Number of videos to recommend
+            exclude_watched (bool): Whether to exclude videos the user has already watched
+            context (RecommendationContext): Shared per-request state (built if omitted)
+            
+        Returns:
+            list: List of Video objects
+        """
+        model = get_factor_model()
+        if not model.is_loaded:
+            return []
+        
+        context = context or RecommendationContext(user, exclude_watched)
+        
+        # One dot product per candidate against the memory-mapped item factors
+        scored_ids, scores = model.score(user.id, context.candidate_ids)
+        top_ids, _ = context.matrix.top_k(scored_ids, scores, num_videos)
+        return self._hydrate(top_ids)
+    
+    def get_watch_time_recommendations(self, user, num_videos, exclude_watched=True, context=None):
         """
         Get recommendations based on videos that the user has watched for longest time
         
@@ -378,10 +502,13 @@ class ContextualBanditRecommender:
             user (User): User object
             num_videos (int): Number of videos to recommend
             exclude_watched (bool): Whether to exclude videos the user has already watched
+            context (RecommendationContext): Shared per-request state (built if omitted)
             
         Returns:
             list: List of Video objects
         """
+        context = context or RecommendationContext(user, exclude_watched)
+        
         # Get the videos the user has watched the longest
         long_watch_videos = VideoView.objects.filter(
             user=user,
@@ -390,57 +517,28 @@ class ContextualBanditRecommender:
             total_time=Sum('view_time')
         ).order_by('-total_time')[:10]  # Top 10 videos with longest watch time
         
-        if not long_watch_videos:
+        long_watch_video_ids = [v['video'] for v in long_watch_videos]
+        
+        if not long_watch_video_ids:
             return []
         
-        long_watch_video_ids = [v['video'] for v in long_watch_videos]
+        # Find similar videos, excluding the source videos themselves
+        candidate_ids = context.candidate_ids[~np.isin(context.candidate_ids, long_watch_video_ids)]
         
-        # Get similar videos to those with long watch times
-        similar_videos = []
+        matrix = context.matrix
+        matrix.ensure(long_watch_video_ids)
         
-        for video_id in long_watch_video_ids:
-            try:
-                # Get embedding for this long-watched video
-                source_embedding = get_or_create_video_embedding(video_id)
-                
-                # Find similar videos
-                candidate_videos = Video.objects.filter(
-                    is_published=True,
-                    moderation_status='approved'
-                )
-                
-                if exclude_watched:
-                    watched_ids = VideoView.objects.filter(
-                        user=user
-                    ).values_list('video_id', flat=True).distinct()
-                    candidate_videos = candidate_videos.exclude(id__in=watched_ids)
-                
-                # Also exclude the source videos themselves
-                candidate_videos = candidate_videos.exclude(id__in=long_watch_video_ids)
-                
-                # Look for similar videos
-                for candidate in candidate_videos:
-                    try:
-                        candidate_embedding = get_or_create_video_embedding(candidate.id)
-                        similarity = calculate_similarity(source_embedding, candidate_embedding)
-                        similar_videos.append((candidate, similarity))
-                    except:
-                        pass
-            except:
-                pass
-        
-        # Remove duplicates and sort by similarity
-        deduplicated = {}
-        for video, score in similar_videos:
-            if video.id not in deduplicated or score > deduplicated[video.id][1]:
-                deduplicated[video.id] = (video, score)
-        
-        sorted_videos = sorted(deduplicated.values(), key=lambda x: x[1], reverse=True)
-        
-        # Extract just the videos
-        return [video for video, _ in sorted_videos[:num_videos]]
-    
-    def get_category_recommendations(self, user, num_videos, exclude_watched=True):
+        # Get embeddings for the long-watched videos
+        source_embeddings = matrix.get_vectors(long_watch_video_ids)
+        
+        if not len(source_embeddings) or not len(candidate_ids):
+            return []
+        
+        # Rank candidates by their best match among the source videos
+        top_ids = self._rank_by_similarity(matrix, source_embeddings, candidate_ids, num_videos)
+        return self._hydrate(top_ids)
+    
+    def get_category_recommendations(self, user, num_videos, exclude_watched=True, context=None):
         """
         Get recommendations based on the categories the user has watched most
         
@@ -448,20 +546,19 @@ class ContextualBanditRecommender:
             user (User): User object
             num_videos (int): Number of videos to recommend
             exclude_watched (bool): Whether to exclude videos the user has already watched
+            context (RecommendationContext): Shared per-request state (built if omitted)
             
         Returns:
             list: List of Video objects
         """
+        context = context or RecommendationContext(user, exclude_watched)
+        
         # Find the most watched categories
-        watched_video_ids = VideoView.objects.filter(
-            user=user
-        ).values_list('video_id', flat=True).distinct()
+        watched_video_ids = context.watched_ids.tolist()
         
         if not watched_video_ids:
             return []
         
-        from django.db.models import Count
-        
         # Get categories from watched videos with count
         from core.models import Category
         most_watched_categories = Category.objects.filter(
@@ -470,11 +567,11 @@ class ContextualBanditRecommender:
             watch_count=Count('videos')
         ).order_by('-watch_count')[:5]  # Top 5 categories
         
-        if not most_watched_categories:
-            return []
-        
         category_ids = [c.id for c in most_watched_categories]
         
+        if not category_ids:
+            return []
+        
         # Get videos from those categories
         category_videos = Video.objects.filter(
             categories__in=category_ids,
@@ -503,46 +600,42 @@ class ContextualBanditRecommender:
         Returns:
             list: List of Video objects
         """
-        # Try cache first
-        cache_key = f"popular_videos_{num_videos}"
-        cached_videos = cache.get(cache_key)
-        
-        if cached_videos is not None and num_videos <= MAX_RECOMMENDATIONS // 2:
-            try:
-                # Convert cached video IDs back to Video objects
-                videos = Video.objects.filter(id__in=cached_videos)
-                if len(videos) == num_videos:
-                    return videos
-            except:
-                pass  # If there's any issue, just regenerate recommendations
-        
-        # Get trending videos based on views in the past week
-        one_week_ago = timezone.now() - timedelta(days=7)
-        
-        videos = Video.objects.filter(
-            is_published=True,
-            moderation_status='approved',
-            created_at__gte=one_week_ago
-        ).annotate(
-            recent_views=Count('video_views', filter=Q(video_views__created_at__gte=one_week_ago))
-        ).order_by('-recent_views')
+        return self.hydrate_ranked(self.get_popular_video_ids(), 0, num_videos)
+    
+    def get_popular_video_ids(self):
+        """
+        Get the ranked IDs of popular videos, cached and shared by all callers
         
-        # If we don't have enough recent videos, get all-time popular videos
-        if len(videos) < num_videos:
-            more_videos = Video.objects.filter(
-                is_published=True,
-                moderation_status='approved'
-            ).exclude(
-                id__in=[v.id for v in videos]
-            ).order_by('-views')
-            
-            videos = list(videos) + list(more_videos)
+        Trending videos come first, in the order of their time-decayed score
+        (see core.trending), followed by all-time popular videos.
         
-        # Cache the results only if it's a reasonable size
-        if num_videos <= MAX_RECOMMENDATIONS // 2:
-            cache.set(cache_key, [video.id for video in videos[:num_videos]], CACHE_TTL)
+        Returns:
+            numpy.ndarray: Up to MAX_RECOMMENDATIONS ranked video IDs
+        """
+        # Try cache first
+        cached_ids = cache.get(POPULAR_VIDEOS_CACHE_KEY)
+        mark_cache(cached_ids is not None)
+        if cached_ids is not None:
+            return np.frombuffer(cached_ids, dtype=np.int64)
+        
+        # Both lists are top-k reads of an index
+        trending_ids = get_trending_video_ids(MAX_RECOMMENDATIONS)
+        
+        # Fill the rest of the list with all-time popular videos
+        more_ids = []
+        if len(trending_ids) < MAX_RECOMMENDATIONS:
+            more_ids = list(
+                Video.objects.filter(
+                    is_published=True,
+                    moderation_status='approved'
+                ).exclude(
+                    id__in=trending_ids
+                ).order_by('-views', '-id').values_list('id', flat=True)[:MAX_RECOMMENDATIONS - len(trending_ids)]
+            )
         
-        return videos[:num_videos]
+        video_ids = np.array(trending_ids + more_ids, dtype=np.int64)
+        cache.set(POPULAR_VIDEOS_CACHE_KEY, video_ids.tobytes(), CACHE_TTL)
+        return video_ids
     
     def get_exploration_videos(self, user, num_videos, exclude_watched=True):
         """
@@ -556,99 +649,190 @@ class ContextualBanditRecommender:
         Returns:
             list: List of Video objects
         """
-        # Get candidate videos
-        candidate_videos = Video.objects.filter(
-            is_published=True,
-            moderation_status='approved'
-        )
-        
         # Exclude watched videos if requested
+        watched_video_ids = ()
         if exclude_watched:
-            watched_video_ids = Video.objects.filter(
-                video_views__user=user
-            ).values_list('id', flat=True)
-            candidate_videos = candidate_videos.exclude(id__in=watched_video_ids)
-        
-        # Prioritize recent videos
-        recent_cutoff = timezone.now() - timedelta(days=30)
-        recent_videos = candidate_videos.filter(
-            created_at__gte=recent_cutoff
-        ).order_by('?')
-        
-        # If we don't have enough recent videos, get some random ones
-        if recent_videos.count() < num_videos:
-            more_videos = candidate_videos.exclude(
-                id__in=recent_videos.values_list('id', flat=True)
-            ).order_by('?')
-            
-            # Combine lists but limit to requested number
-            recent_list = list(recent_videos)
-            more_list = list(more_videos)
-            combined = recent_list + more_list
-            return combined[:num_videos]
-        else:
-            return list(recent_videos[:num_videos])
+            watched_video_ids = VideoView.objects.filter(
+                user=user
+            ).values_list('video_id', flat=True).distinct()
+        
+        # Random recent videos first, then older ones, drawn without scanning the catalogue
+        video_ids = get_exploration_sampler().sample(num_videos, exclude=watched_video_ids)
+        return self._hydrate(video_ids)
+    
+    def _rank_by_similarity(self, matrix, query_vectors, candidate_ids, num_videos):
+        """
+        Rank candidates by their highest cosine similarity to any query vector
+        
+        Small catalogues are scored exactly with one matrix product; past
+        ANN_CATALOGUE_THRESHOLD embeddings the ANN index is searched instead,
+        restricted to the candidate set.
+        
+        Args:
+            matrix (EmbeddingMatrix): Shared embedding matrix
+            query_vectors (numpy.ndarray): (Q, D) unit query vectors
+            candidate_ids (numpy.ndarray): IDs of eligible videos
+            num_videos (int): Number of videos to return
+            
+        Returns:
+            numpy.ndarray: Ranked video IDs
+        """
+        if len(matrix) >= ANN_CATALOGUE_THRESHOLD:
+            index = get_video_index()
+            if len(index):
+                allowed = np.sort(candidate_ids)
+                
+                def is_candidate(ids):
+                    positions = np.minimum(np.searchsorted(allowed, ids), len(allowed) - 1)
+                    return allowed[positions] == ids
+                
+                best = {}
+                for query in query_vectors:
+                    ids, scores = index.search(query, num_videos, filter=is_candidate)
+                    for video_id, score in zip(ids.tolist(), scores.tolist()):
+                        if score > best.get(video_id, -np.inf):
+                            best[video_id] = score
+                
+                ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)[:num_videos]
+                return np.array([video_id for video_id, _ in ranked], dtype=np.int64)
+        
+        scored_ids, similarities = matrix.score(query_vectors.T, candidate_ids)
+        top_ids, _ = matrix.top_k(scored_ids, similarities.max(axis=1), num_videos)
+        return top_ids
+    
+    def hydrate_ranked(self, ranked_ids, offset, count):
+        """
+        Load `count` videos from a ranked id list starting at `offset`
+        
+        IDs of videos deleted, unpublished or rejected since the list was ranked
+        are skipped and the slice is topped up from further down the list.
+        
+        Args:
+            ranked_ids (numpy.ndarray): Ranked video IDs
+            offset (int): Position in the list to start from
+            count (int): Number of videos wanted
+            
+        Returns:
+            list: List of Video objects in rank order
+        """
+        videos = []
+        while len(videos) < count and offset < len(ranked_ids):
+            batch = ranked_ids[offset:offset + count - len(videos)]
+            videos.extend(self._hydrate(batch))
+            offset += len(batch)
+        return videos
+    
+    def _hydrate(self, video_ids):
+        """
+        Load Video objects for a ranked list of IDs, preserving the ranking order
+        
+        Cached lists and the exploration sampler can lag behind moderation, so
+        only videos that are still published and approved are loaded.
+        
+        Args:
+            video_ids (array-like): Ranked video IDs
+            
+        Returns:
+            list: List of Video objects (IDs that are no longer servable are skipped)
+        """
+        video_ids = [int(video_id) for video_id in video_ids]
+        videos_by_id = Video.objects.filter(
+            is_published=True,
+            moderation_status='approved'
+        ).select_related('creator').in_bulk(video_ids)
+        return [videos_by_id[video_id] for video_id in video_ids if video_id in videos_by_id]
     
-    def rank_videos_ucb(self, user, videos):
+    def rank_videos_ucb(self, user, videos, context=None):
         """
         Rank videos using Upper Confidence Bound algorithm
         
         Args:
             user (User): User object
             videos (list): List of Video objects
+            context (RecommendationContext): Shared per-request state, reused for the user vector
             
         Returns:
             list: Sorted list of Video objects
         """
-        # Get bandit stats for each video
-        video_stats = []
+        videos = list(videos)
+        if not videos:
+            return []
         
-        for video in videos:
-            # Get or create bandit stats
-            stats, created = BanditStats.objects.get_or_create(video=video)
-            
-            if created:
-                # New videos get high UCB to encourage exploration
-                stats.ucb_score = float('inf')
-            
-            # Get user-video similarity as contextual information
-            try:
-                user_embedding = get_or_create_user_embedding(user.id)
-                video_embedding = get_or_create_video_embedding(video.id)
-                similarity = calculate_similarity(user_embedding, video_embedding)
-            except:
-                similarity = 0.0
-            
-            # Adjust UCB score based on similarity
-            adjusted_score = stats.ucb_score * (1.0 + similarity)
-            
-            video_stats.append((video, adjusted_score))
+        video_ids = np.array([video.id for video in videos], dtype=np.int64)
+        
+        # Load all arm stats in one query; arms never shown (including rows
+        # created before their score was stored) stay at infinity
+        ucb_by_id = {
+            video_id: ucb_score if max(impression_count, click_count) > 0 else np.inf
+            for video_id, ucb_score, impression_count, click_count in BanditStats.objects.filter(
+                video_id__in=video_ids.tolist()
+            ).values_list('video_id', 'ucb_score', 'impression_count', 'click_count')
+        }
+        
+        # Create missing arms in one statement; new videos get high UCB to encourage exploration
+        missing_ids = [video_id for video_id in video_ids.tolist() if video_id not in ucb_by_id]
+        if missing_ids:
+            BanditStats.objects.bulk_create(
+                [BanditStats(video_id=video_id, ucb_score=float('inf')) for video_id in missing_ids],
+                ignore_conflicts=True
+            )
         
-        # Sort by adjusted UCB score
-        video_stats.sort(key=lambda x: x[1], reverse=True)
+        ucb_scores = np.array(
+            [ucb_by_id.get(video_id, np.inf) for video_id in video_ids.tolist()],
+            dtype=np.float64
+        )
+        
+        # Get user-video similarity as contextual information, for all videos at once
+        similarity = np.zeros(len(video_ids), dtype=np.float64)
+        try:
+            if context is not None:
+                matrix, query = context.matrix, context.user_query
+            else:
+                matrix = get_embedding_matrix()
+                query = matrix.prepare_query(get_or_create_user_embedding(user.id))
+            matrix.ensure(video_ids)
+            if query is not None:
+                scored_ids, scores = matrix.score(query, video_ids)
+                similarity[np.isin(video_ids, scored_ids)] = scores
+        except Exception as e:
+            logger.error(f"Error computing UCB similarity for user {user.id}: {e}")
         
-        # Extract just the videos
-        return [video for video, _ in video_stats]
+        # Adjust UCB score based on similarity (unexplored arms stay at infinity)
+        with np.errstate(invalid='ignore'):
+            adjusted_scores = np.where(np.isinf(ucb_scores), np.inf, ucb_scores * (1.0 + similarity))
+        
+        # Sort by adjusted UCB score, keeping the incoming order for ties
+        order = np.argsort(-adjusted_scores, kind='stable')
+        
+        return [videos[i] for i in order]
     
-    def update_stats(self, video_id, user_id, clicked=False, watch_time=0):
+    def update_stats(self, video_id, user_id, clicked=False, watch_time=0, previous_watch_time=0):
         """
-        Update bandit statistics after a recommendation is shown or clicked
+        Update bandit statistics after a recommendation is shown, clicked or watched
         
         Args:
             video_id (int): ID of the video
             user_id (int): ID of the user
             clicked (bool): Whether the video was clicked
-            watch_time (int): Watch time in seconds (if clicked)
+            watch_time (int): Watch time of the view so far, in seconds
+            previous_watch_time (int): Watch time of the view already recorded
             
         Returns:
             bool: Success or failure
         """
         try:
-            # Get bandit stats
-            stats, created = BanditStats.objects.get_or_create(video_id=video_id)
-            
-            # Update stats
-            stats.update_stats(clicked=clicked, watch_time=watch_time)
+            # Queue the update; the write-behind buffer flushes it in bulk.
+            # Clicks and watch-time updates add no impression: logged lists were
+            # already counted by the impression logger, and apply_deltas keeps
+            # impressions at least equal to clicks for lists that are not logged.
+            impressions = 0 if clicked or watch_time else 1
+            get_bandit_buffer().record(
+                video_id,
+                clicked=clicked,
+                watch_time=watch_time,
+                impressions=impressions,
+                previous_watch_time=previous_watch_time
+            )
             
             return True
         except Exception as e:
@@ -677,43 +861,211 @@ def recommend_videos(user_id=None, num_recommendations=DEFAULT_NUM_RECOMMENDATIO
     else:
         return recommender.get_popular_videos(num_recommendations)
 
-def precompute_recommendations():
+def get_ranked_video_ids(user_id, exclude_watched=True):
     """
-    Background task to precompute recommendations for active users
-    Should be called periodically by a scheduler (e.g., Celery)
+    Get the full ranked recommendation list of a user as IDs
+    
+    Used by paginated feeds: the list is ranked (and cached) once and later
+    pages are slices of the same list.
+    
+    Args:
+        user_id (int): ID of the user
+        exclude_watched (bool): Whether to exclude videos the user has already watched
+        
+    Returns:
+        numpy.ndarray: Ranked video IDs
+    """
+    with RecommendationTrace('recommend_for_user', user_id) as trace:
+        with trace.stage('ranked_cache') as stage:
+            ranked_ids = get_cached_ranked_ids(user_id, exclude_watched)
+            stage.cache = 'miss' if ranked_ids is None else 'hit'
+            stage.candidates_out = None if ranked_ids is None else len(ranked_ids)
+        if ranked_ids is not None:
+            return ranked_ids
+        
+        videos = ContextualBanditRecommender()._rank_for_user(user_id, RANKED_LIST_SIZE, exclude_watched, trace)
+    ranked_ids = np.array([video.id for video in videos], dtype=np.int64)
+    
+    # Exploration lists are not cached by recommend_for_user; keep this one so
+    # that later pages continue the same list
+    if get_cached_ranked_ids(user_id, exclude_watched) is None:
+        cache_ranked_ids(user_id, exclude_watched, ranked_ids)
+    return ranked_ids
+
+def parse_shard(shard):
+    """
+    Parse a 'i/N' shard spec
+    
+    Returns:
+        tuple: (index, count) with 0 <= index < count
+    """
+    try:
+        index, count = (int(part) for part in shard.split('/'))
+    except (ValueError, AttributeError):
+        raise ValueError(f"Invalid shard '{shard}', expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard '{shard}', expected 0 <= i < N")
+    return index, count
+
+
+def in_shard(user_id, shard_index, shard_count):
+    """Stable assignment of users to shards by a hash of their id"""
+    return zlib.crc32(str(user_id).encode()) % shard_count == shard_index
+
+
+def get_users_to_precompute(shard=None, full=False):
+    """
+    Select the active users whose recommendations need recomputing
+    
+    A user is selected when they have no watermark yet, when they have views or
+    likes newer than their watermark, or when the list cached at their
+    watermark has outlived PRECOMPUTED_CACHE_TTL. Only the persisted
+    watermarks are consulted: the cache of the calling process may not be the
+    one web workers read (e.g. the default per-process LocMemCache).
+    
+    Args:
+        shard (tuple): Optional (index, count) to keep only this shard's users
+        full (bool): Ignore watermarks and select every active user
+        
+    Returns:
+        list: User IDs
     """
     from django.contrib.auth import get_user_model
+    from core.models import RecommendationWatermark
     User = get_user_model()
     
     # Get active users (who have logged in recently)
     one_month_ago = timezone.now() - timedelta(days=30)
-    active_users = User.objects.filter(
-        last_login__gte=one_month_ago
+    user_ids = list(User.objects.filter(last_login__gte=one_month_ago).values_list('id', flat=True))
+    
+    if shard is not None:
+        user_ids = [user_id for user_id in user_ids if in_shard(user_id, *shard)]
+    
+    if full or not user_ids:
+        return user_ids
+    
+    watermarks = dict(
+        RecommendationWatermark.objects.filter(user_id__in=user_ids).values_list('user_id', 'precomputed_at')
     )
     
-    recommender = ContextualBanditRecommender()
+    # Latest activity per user, one aggregate per table
+    last_view = dict(
+        VideoView.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+            last=Max('created_at')
+        ).values_list('user_id', 'last')
+    )
+    last_like = dict(
+        Like.objects.filter(user_id__in=user_ids, video__isnull=False).values('user_id').annotate(
+            last=Max('created_at')
+        ).values_list('user_id', 'last')
+    )
     
-    # Precompute recommendations for each active user
-    for user in active_users:
-        try:
-            # Generate recommendations
-            recommendations = recommender.recommend_for_user(user.id, DEFAULT_NUM_RECOMMENDATIONS)
-            
-            # Cache the results
-            cache_key = f"user_recommendations_{user.id}_{DEFAULT_NUM_RECOMMENDATIONS}_True"
-            cache.set(cache_key, [video.id for video in recommendations], CACHE_TTL * 6)  # Longer TTL for precomputed
-            
-            logger.info(f"Precomputed recommendations for user {user.id}")
-        except Exception as e:
-            logger.error(f"Error precomputing recommendations for user {user.id}: {e}")
+    expired_before = timezone.now() - timedelta(seconds=PRECOMPUTED_CACHE_TTL)
+    
+    selected = []
+    for user_id in user_ids:
+        watermark = watermarks.get(user_id)
+        if (
+            watermark is None
+            or watermark <= expired_before
+            or (last_view.get(user_id) and last_view[user_id] > watermark)
+            or (last_like.get(user_id) and last_like[user_id] > watermark)
+        ):
+            selected.append(user_id)
+    return selected
+
+
+def _init_precompute_worker():
+    """Pool initializer: never reuse a database connection inherited from the parent"""
+    connections.close_all()
+
+
+def _precompute_user(user_id):
+    """
+    Rank one user's recommendations (runs in a pool worker or in process)
+    
+    Returns:
+        tuple: (user_id, ranked video IDs or None on failure, started_at, seconds taken)
+    """
+    started_at = timezone.now()
+    start = time.perf_counter()
+    try:
+        cache.delete(ranked_cache_key(user_id))
+        # Never explore here: the list is cached for PRECOMPUTED_CACHE_TTL and every page is served from it
+        videos = ContextualBanditRecommender(exploration_rate=0).recommend_for_user(user_id, RANKED_LIST_SIZE)
+        video_ids = [video.id for video in videos]
+    except Exception as e:
+        logger.error(f"Error precomputing recommendations for user {user_id}: {e}")
+        video_ids = None
+    return user_id, video_ids, started_at, time.perf_counter() - start
+
+
+def precompute_recommendations(workers=1, shard=None, full=False):
+    """
+    Background task to precompute recommendations for active users
+    Should be called periodically by a scheduler (e.g., Celery)
+    
+    Only users with new activity since their last precompute are re-ranked.
+    Users are ranked across a process pool, and results are cached and
+    watermarked by the calling process.
+    
+    Args:
+        workers (int): Number of worker processes (1 = in process)
+        shard (tuple): Optional (index, count) to split users between nodes
+        full (bool): Recompute every active user, ignoring watermarks
+        
+    Returns:
+        dict: Summary with user counts and per-user latency percentiles (ms)
+    """
+    from core.models import RecommendationWatermark
+    
+    user_ids = get_users_to_precompute(shard=shard, full=full)
+    logger.info(f"Precomputing recommendations for {len(user_ids)} users with {workers} workers")
+    
+    if workers > 1 and len(user_ids) > 1:
+        # Children must open their own connections, so close the parent's before forking
+        connections.close_all()
+        with multiprocessing.Pool(workers, initializer=_init_precompute_worker) as pool:
+            results = list(pool.imap_unordered(_precompute_user, user_ids, chunksize=8))
+    else:
+        results = [_precompute_user(user_id) for user_id in user_ids]
+    
+    latencies = []
+    watermarks = []
+    failed = 0
+    for user_id, video_ids, started_at, elapsed in results:
+        latencies.append(elapsed * 1000)
+        if video_ids is None:
+            failed += 1
+            continue
+        cache_ranked_ids(user_id, True, video_ids, PRECOMPUTED_CACHE_TTL)
+        watermarks.append(RecommendationWatermark(user_id=user_id, precomputed_at=started_at))
+    
+    RecommendationWatermark.objects.bulk_create(
+        watermarks,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['precomputed_at'],
+        batch_size=500
+    )
+    
+    recommender = ContextualBanditRecommender()
     
     # Also update popular videos cache
     try:
-        popular_videos = recommender.get_popular_videos(DEFAULT_NUM_RECOMMENDATIONS)
-        cache_key = f"popular_videos_{DEFAULT_NUM_RECOMMENDATIONS}"
-        cache.set(cache_key, [video.id for video in popular_videos], CACHE_TTL * 6)
+        cache.delete(POPULAR_VIDEOS_CACHE_KEY)
+        popular_ids = recommender.get_popular_video_ids()
+        cache.set(POPULAR_VIDEOS_CACHE_KEY, popular_ids.tobytes(), CACHE_TTL * 6)
         logger.info("Precomputed popular videos")
     except Exception as e:
         logger.error(f"Error precomputing popular videos: {e}")
     
-    return True 
\ No newline at end of file
+    summary = {
+        'users': len(user_ids),
+        'succeeded': len(user_ids) - failed,
+        'failed': failed,
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary.update({'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'max_ms': max(latencies)})
+    return summary
@@ -0,0 +1,357 @@
+import logging
+from datetime import timedelta
+
+import numpy as np
+from scipy import sparse
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q, F
+from django.utils import timezone
+
+from videos.models import Video, VideoView
+from core.models import RelatedVideos, Like, Tag, Category
+from core.embedding_matrix import get_embedding_matrix
+from core.item_similarity import get_item_similarity_model
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+RELATED_LIST_SIZE = 30  # Video IDs stored per list
+RELATED_CACHE_TTL = 60 * 60 * 6  # 6 hours; lists are written through on every rebuild
+EMBEDDING_WEIGHT = 1.0  # Weight of the content embedding cosine
+COWATCH_WEIGHT = 1.0  # Weight of the item-item co-watch cosine
+TAG_WEIGHT = 0.15  # Per shared tag, up to MAX_SHARED_TAGS
+MAX_SHARED_TAGS = 3
+CATEGORY_WEIGHT = 0.2  # Bonus for sharing at least one category
+CREATOR_WEIGHT = 0.1  # Bonus for the same creator
+PERSONAL_WEIGHT = 0.3  # Weight of the user's embedding in the sidebar re-rank
+ENGAGEMENT_REFRESH_HOURS = 6  # Minimum age of a list before new views or likes trigger a rebuild
+BLOCK_SIZE = 128  # Maximum source videos scored per dense block
+MAX_BLOCK_CELLS = 1 << 22  # Cells per dense score block (16 MB of float32); large catalogues get fewer rows per block
+UPSERT_BATCH_SIZE = 500
+
+
+def related_cache_key(video_id):
+    return f"related_videos_{video_id}"
+
+
+def pack_ids(video_ids):
+    """
+    Pack video IDs into bytes, using 32-bit integers when they fit
+
+    Returns:
+        tuple: (bytes, dtype string)
+    """
+    video_ids = np.asarray(video_ids, dtype=np.int64)
+    dtype = np.uint32 if not len(video_ids) or video_ids.max() < 2 ** 32 else np.int64
+    return video_ids.astype(dtype).tobytes(), np.dtype(dtype).str
+
+
+def unpack_ids(data, dtype):
+    """Inverse of pack_ids"""
+    return np.frombuffer(bytes(data), dtype=dtype).astype(np.int64)
+
+
+def _membership_matrix(through, owner_field, candidate_ids):
+    """
+    Binary candidates x owners matrix (e.g. video x tag) from an M2M through table
+
+    Rows are aligned with the sorted `candidate_ids`.
+    """
+    pairs = np.array(
+        list(through.objects.filter(video_id__in=candidate_ids.tolist()).values_list('video_id', owner_field)),
+        dtype=np.int64
+    ).reshape(-1, 2)
+    owners, cols = np.unique(pairs[:, 1], return_inverse=True)
+    rows = np.searchsorted(candidate_ids, pairs[:, 0])
+    return sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+        shape=(len(candidate_ids), len(owners))
+    )
+
+
+def _add_sparse(scores, matrix, weight):
+    """Add `weight` times a sparse block to the dense `scores` without densifying it"""
+    coo = matrix.tocoo()
+    scores[coo.row, coo.col] += weight * coo.data
+
+
+def _top_related(scores, num_videos):
+    """Column positions of the `num_videos` best positive scores of each row, best first"""
+    k = min(num_videos, scores.shape[1])
+    if k <= 0:
+        return [np.zeros(0, dtype=np.int64) for _ in range(scores.shape[0])]
+
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.tile(np.arange(k), (scores.shape[0], 1))
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return [row[row_scores > 0] for row, row_scores in zip(top, top_scores)]
+
+
+def compute_related_lists(source_ids, num_videos=RELATED_LIST_SIZE):
+    """
+    Score every published, approved video against each source video
+
+    The score of a candidate is a weighted sum of its content embedding
+    cosine, its co-watch cosine from the item-item model, shared tags and
+    categories, and whether it has the same creator. Sources are scored in
+    dense blocks against the whole catalogue; the rows per block shrink as
+    the catalogue grows so a block never exceeds MAX_BLOCK_CELLS scores, and
+    the tag, category and creator terms stay sparse.
+
+    Args:
+        source_ids (array-like): Videos to compute lists for
+        num_videos (int): Length of each list
+
+    Returns:
+        dict: Source video ID -> numpy.ndarray of related IDs, best first
+    """
+    eligible = Video.objects.filter(is_published=True, moderation_status='approved')
+    rows = np.array(list(eligible.order_by('id').values_list('id', 'creator_id')), dtype=np.int64).reshape(-1, 2)
+    candidate_ids, creators = rows[:, 0], rows[:, 1]
+    source_ids = np.intersect1d(np.asarray(source_ids, dtype=np.int64), candidate_ids)
+    if not len(source_ids):
+        return {}
+
+    tags = _membership_matrix(Tag.videos.through, 'tag_id', candidate_ids)
+    categories = _membership_matrix(Category.videos.through, 'category_id', candidate_ids)
+    _, creator_cols = np.unique(creators, return_inverse=True)
+    creator_matrix = sparse.csr_matrix(
+        (np.ones(len(candidate_ids), dtype=np.float32), (np.arange(len(candidate_ids)), creator_cols)),
+        shape=(len(candidate_ids), creator_cols.max() + 1)
+    )
+    tags_t, categories_t, creators_t = tags.T.tocsc(), categories.T.tocsc(), creator_matrix.T.tocsc()
+
+    # Normalised candidate embeddings; candidates without one keep a zero row
+    matrix = get_embedding_matrix()
+    has_vector = np.array([int(video_id) in matrix.id_to_row for video_id in candidate_ids], dtype=bool)
+    vectors = np.zeros((len(candidate_ids), matrix.dimension or 0), dtype=np.float32)
+    if has_vector.any():
+        vectors[has_vector] = matrix.get_vectors(candidate_ids[has_vector])
+
+    cowatch_model = get_item_similarity_model()
+
+    block_size = int(np.clip(MAX_BLOCK_CELLS // len(candidate_ids), 1, BLOCK_SIZE))
+
+    related = {}
+    for start in range(0, len(source_ids), block_size):
+        block_ids = source_ids[start:start + block_size]
+        positions = np.searchsorted(candidate_ids, block_ids)
+
+        scores = np.zeros((len(block_ids), len(candidate_ids)), dtype=np.float32)
+
+        # Content embeddings (sources without a vector contribute nothing)
+        source_has_vector = has_vector[positions]
+        if source_has_vector.any():
+            cosine = vectors[positions[source_has_vector]] @ vectors.T
+            np.maximum(cosine, 0, out=cosine)
+            cosine *= EMBEDDING_WEIGHT
+            scores[source_has_vector] += cosine
+            del cosine
+
+        # Shared tags and categories
+        shared_tags = tags[positions] @ tags_t
+        shared_tags.data = np.minimum(shared_tags.data, MAX_SHARED_TAGS)
+        _add_sparse(scores, shared_tags, TAG_WEIGHT)
+        shared_categories = categories[positions] @ categories_t
+        shared_categories.data = (shared_categories.data > 0).astype(np.float32)
+        _add_sparse(scores, shared_categories, CATEGORY_WEIGHT)
+
+        # Same creator
+        _add_sparse(scores, creator_matrix[positions] @ creators_t, CREATOR_WEIGHT)
+
+        # Co-watch neighbours
+        for row, video_id in enumerate(block_ids.tolist()):
+            neighbor_ids, neighbor_scores = cowatch_model.score([video_id])
+            neighbor_positions = np.searchsorted(candidate_ids, neighbor_ids)
+            neighbor_positions = np.minimum(neighbor_positions, len(candidate_ids) - 1)
+            known = candidate_ids[neighbor_positions] == neighbor_ids
+            scores[row, neighbor_positions[known]] += COWATCH_WEIGHT * neighbor_scores[known]
+
+        # Never relate a video to itself
+        scores[np.arange(len(block_ids)), positions] = 0
+
+        for video_id, top in zip(block_ids.tolist(), _top_related(scores, num_videos)):
+            related[video_id] = candidate_ids[top]
+
+    return related
+
+
+def build_related_lists(video_ids=None, num_videos=RELATED_LIST_SIZE):
+    """
+    Recompute and store related lists
+
+    Lists of videos that are no longer published and approved are deleted.
+
+    Args:
+        video_ids (list): Videos to rebuild (every eligible video if None)
+        num_videos (int): Length of each list
+
+    Returns:
+        dict: Number of lists written and deleted
+    """
+    now = timezone.now()
+    if video_ids is None:
+        video_ids = Video.objects.filter(is_published=True, moderation_status='approved').values_list('id', flat=True)
+    video_ids = np.unique(np.fromiter(video_ids, dtype=np.int64))
+
+    related = compute_related_lists(video_ids, num_videos)
+
+    entries = []
+    for video_id, ids in related.items():
+        data, dtype = pack_ids(ids)
+        entries.append(RelatedVideos(video_id=video_id, video_ids=data, dtype=dtype, computed_at=now, is_stale=False))
+
+    dropped = [int(video_id) for video_id in video_ids.tolist() if video_id not in related]
+    with transaction.atomic():
+        RelatedVideos.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['video'],
+            update_fields=['video_ids', 'dtype', 'computed_at', 'is_stale'],
+            batch_size=UPSERT_BATCH_SIZE
+        )
+        deleted = RelatedVideos.objects.filter(
+            Q(video_id__in=dropped) | ~Q(video__is_published=True) | ~Q(video__moderation_status='approved')
+        ).delete()[0]
+
+    # Write through so sidebars pick up the new lists immediately
+    cache.set_many({
+        related_cache_key(entry.video_id): (entry.video_ids, entry.dtype)
+        for entry in entries
+    }, RELATED_CACHE_TTL)
+    cache.delete_many([related_cache_key(video_id) for video_id in dropped])
+
+    logger.info(f"Built {len(entries)} related video lists, deleted {deleted}")
+    return {'written': len(entries), 'deleted': deleted}
+
+
+def get_videos_to_refresh(now=None):
+    """
+    Select the videos whose related list is missing or out of date
+
+    A list is rebuilt when the video has none, when its metadata or embedding
+    changed after the list was computed, when its tags or categories changed
+    (is_stale), or when it was viewed or liked since and the list is older
+    than ENGAGEMENT_REFRESH_HOURS.
+
+    Returns:
+        list: Video IDs
+    """
+    now = now or timezone.now()
+    eligible = Video.objects.filter(is_published=True, moderation_status='approved')
+
+    selected = set(eligible.filter(
+        Q(related_list__isnull=True)
+        | Q(related_list__is_stale=True)
+        | Q(updated_at__gt=F('related_list__computed_at'))
+        | Q(embedding__updated_at__gt=F('related_list__computed_at'))
+    ).values_list('id', flat=True))
+
+    # Engagement: new views or likes since lists old enough to be worth recomputing
+    cutoff = now - timedelta(hours=ENGAGEMENT_REFRESH_HOURS)
+    computed_at = dict(
+        RelatedVideos.objects.filter(computed_at__lt=cutoff).values_list('video_id', 'computed_at')
+    )
+    if computed_at:
+        since = min(computed_at.values())
+        for model in (VideoView, Like):
+            last_activity = model.objects.filter(
+                created_at__gt=since,
+                video_id__isnull=False
+            ).values('video_id').annotate(last=Max('created_at')).values_list('video_id', 'last')
+            for video_id, last in last_activity:
+                if video_id in computed_at and last > computed_at[video_id]:
+                    selected.add(video_id)
+
+    return sorted(selected)
+
+
+def mark_related_stale(video_ids):
+    """Flag lists for rebuilding on the next build_related_videos run; they are still served until then"""
+    RelatedVideos.objects.filter(video_id__in=list(video_ids)).update(is_stale=True)
+
+
+def get_related_video_ids(video_id):
+    """
+    Get a video's stored related list: one cache read, or one primary-key read on a miss
+
+    Returns:
+        numpy.ndarray or None: Related IDs, best first, or None if no list was built yet
+    """
+    key = related_cache_key(video_id)
+    entry = cache.get(key)
+    if entry is None:
+        entry = RelatedVideos.objects.filter(video_id=video_id).values_list('video_ids', 'dtype').first()
+        if entry is None:
+            return None
+        entry = (bytes(entry[0]), entry[1])
+        cache.set(key, entry, RELATED_CACHE_TTL)
+    return unpack_ids(*entry)
+
+
+def personal_rerank(related_ids, user_id):
+    """
+    Lightly re-rank a related list towards a user's preference embedding
+
+    Each video keeps a prior from its position in the list, plus
+    PERSONAL_WEIGHT times its cosine with the user's vector.
+
+    Returns:
+        numpy.ndarray: The same IDs, re-ordered
+    """
+    from core.nlp import get_or_create_user_embedding
+
+    matrix = get_embedding_matrix()
+    query = matrix.prepare_query(get_or_create_user_embedding(user_id))
+    if query is None or not len(related_ids):
+        return related_ids
+
+    scored_ids, similarities = matrix.score(query, related_ids)
+    similarity_by_id = dict(zip(scored_ids.tolist(), similarities.tolist()))
+    prior = 1.0 - np.arange(len(related_ids), dtype=np.float32) / len(related_ids)
+    personal = np.array([similarity_by_id.get(video_id, 0.0) for video_id in related_ids.tolist()], dtype=np.float32)
+    order = np.argsort(-(prior + PERSONAL_WEIGHT * personal), kind='stable')
+    return related_ids[order]
+
+
+def get_related_videos(video, user=None, num_videos=6):
+    """
+    Videos for the watch page sidebar
+
+    Reads the video's precomputed list (topped up with popular videos when it
+    is missing or short), re-ranks it for logged-in users and loads the
+    first `num_videos` published, approved videos in one query.
+
+    Args:
+        video (Video): Video being watched
+        user (User): Requesting user, may be anonymous
+        num_videos (int): Number of videos to return
+
+    Returns:
+        list: List of Video objects
+    """
+    from core.recommender import ContextualBanditRecommender
+
+    related_ids = get_related_video_ids(video.id)
+    if related_ids is None:
+        related_ids = np.zeros(0, dtype=np.int64)
+
+    if len(related_ids) < num_videos * 2:
+        popular_ids = ContextualBanditRecommender().get_popular_video_ids()[:num_videos * 3]
+        popular_ids = popular_ids[~np.isin(popular_ids, related_ids) & (popular_ids != video.id)]
+        related_ids = np.concatenate([related_ids, popular_ids])
+
+    if user is not None and user.is_authenticated:
+        related_ids = personal_rerank(related_ids, user.id)
+
+    # Lists can trail moderation and deletions, so load a few spare IDs
+    candidate_ids = related_ids[:num_videos * 2].tolist()
+    videos_by_id = Video.objects.filter(
+        is_published=True,
+        moderation_status='approved'
+    ).select_related('creator').in_bulk(candidate_ids)
+    return [videos_by_id[video_id] for video_id in candidate_ids if video_id in videos_by_id][:num_videos]
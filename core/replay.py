@@ -0,0 +1,382 @@
+import logging
+import multiprocessing
+import random
+import time
+from collections import defaultdict
+from unittest import mock
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+
+from videos.models import Video, VideoView
+from core.models import STORED_EMBEDDING_FIELDS, Category, Like, UserEmbedding, VideoEmbedding
+from core.benchmarks import latency_summary
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_K = 10  # Length of the evaluated top-k list
+INSERT_BATCH_SIZE = 2000
+# Evaluated generators: full recommend_for_user, or one candidate source
+# (a recommender method name) run on a shared RecommendationContext
+SOURCES = {
+    'recommend': None,
+    'personalized': 'get_personalized_videos',
+    'collaborative': 'get_collaborative_recommendations',
+    'category': 'get_category_recommendations',
+    'likes': 'get_recommendations_from_likes',
+    'watch_time': 'get_watch_time_recommendations',
+    'factors': 'get_factor_recommendations',
+    'popular': 'get_popular_videos',
+    'exploration': 'get_exploration_videos',
+}
+
+
+def ranking_metrics(recommended_ids, target_ids, k):
+    """
+    Hit, recall and NDCG of a top-k list against the videos actually watched next
+
+    Args:
+        recommended_ids (list): Ranked video IDs
+        target_ids (set): Videos the user watched next
+        k (int): Cutoff
+
+    Returns:
+        tuple: (hit, recall, ndcg) at k
+    """
+    top = list(recommended_ids)[:k]
+    gains = np.array([1.0 if video_id in target_ids else 0.0 for video_id in top])
+    if not len(target_ids):
+        return 0.0, 0.0, 0.0
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = float((gains * discounts[:len(gains)]).sum())
+    idcg = float(discounts[:min(len(target_ids), k)].sum())
+    hits = gains.sum()
+    return float(hits > 0), float(hits / len(target_ids)), dcg / idcg
+
+
+def load_history():
+    """
+    Read everything the replay needs from the live database into memory
+
+    Returns:
+        dict: Users, videos, embeddings, categories, subscriptions, views and likes as value tuples
+    """
+    User = get_user_model()
+    return {
+        'users': list(User.objects.values_list('id', 'username', 'date_joined')),
+        'videos': list(Video.objects.values_list(
+            'id', 'title', 'creator_id', 'slug', 'content_type', 'is_published', 'moderation_status', 'created_at'
+        ).order_by('created_at')),
+        'embeddings': {
+            row[0]: dict(zip(STORED_EMBEDDING_FIELDS, row[1:]))
+            for row in VideoEmbedding.objects.values_list('video_id', *STORED_EMBEDDING_FIELDS)
+        },
+        'categories': list(Category.objects.values_list('id', 'name', 'slug')),
+        'category_videos': list(Category.videos.through.objects.values_list('category_id', 'video_id')),
+        'subscriptions': list(User.subscribers.through.objects.values_list('from_customuser_id', 'to_customuser_id')),
+        'views': list(VideoView.objects.filter(user__isnull=False).values_list(
+            'user_id', 'video_id', 'view_time', 'created_at'
+        ).order_by('created_at')),
+        'likes': list(Like.objects.filter(video__isnull=False).values_list(
+            'user_id', 'video_id', 'created_at'
+        ).order_by('created_at')),
+    }
+
+
+class ReplayDatabase:
+    """
+    Rebuilds the live history inside a throwaway database, one time step at a time.
+
+    Users, categories and subscriptions are inserted up front; videos, their
+    embeddings, views and likes are inserted once their timestamp has passed, so
+    at every step the recommender only sees data from before the replay clock.
+    """
+
+    def __init__(self, history):
+        self.history = history
+        self.video_cursor = 0
+        self.view_cursor = 0
+        self.like_cursor = 0
+        self.video_ids = set()
+
+    def setup(self):
+        """Insert the rows that do not depend on time"""
+        User = get_user_model()
+        User.objects.bulk_create([
+            User(id=user_id, username=username, password='!', date_joined=date_joined)
+            for user_id, username, date_joined in self.history['users']
+        ], batch_size=INSERT_BATCH_SIZE)
+        Category.objects.bulk_create([
+            Category(id=category_id, name=name, slug=slug)
+            for category_id, name, slug in self.history['categories']
+        ])
+        User.subscribers.through.objects.bulk_create([
+            User.subscribers.through(from_customuser_id=creator_id, to_customuser_id=user_id)
+            for creator_id, user_id in self.history['subscriptions']
+        ], batch_size=INSERT_BATCH_SIZE)
+
+    def advance(self, until):
+        """
+        Insert every video, view and like timestamped before `until`
+
+        Returns:
+            set: IDs of users with new views or likes
+        """
+        videos = []
+        while self.video_cursor < len(self.history['videos']) and self.history['videos'][self.video_cursor][7] < until:
+            videos.append(self.history['videos'][self.video_cursor])
+            self.video_cursor += 1
+        if videos:
+            self._insert_videos(videos)
+
+        views = []
+        while self.view_cursor < len(self.history['views']) and self.history['views'][self.view_cursor][3] < until:
+            views.append(self.history['views'][self.view_cursor])
+            self.view_cursor += 1
+        likes = []
+        while self.like_cursor < len(self.history['likes']) and self.history['likes'][self.like_cursor][2] < until:
+            likes.append(self.history['likes'][self.like_cursor])
+            self.like_cursor += 1
+
+        # Interactions with videos that were never inserted (deleted since) are dropped
+        views = [row for row in views if row[1] in self.video_ids]
+        likes = [row for row in likes if row[1] in self.video_ids]
+        VideoView.objects.bulk_create([
+            VideoView(user_id=user_id, video_id=video_id, view_time=view_time, created_at=created_at)
+            for user_id, video_id, view_time, created_at in views
+        ], batch_size=INSERT_BATCH_SIZE)
+        # created_at is auto_now_add, so the original timestamps are written back afterwards
+        like_objects = Like.objects.bulk_create([
+            Like(user_id=user_id, video_id=video_id)
+            for user_id, video_id, _ in likes
+        ], batch_size=INSERT_BATCH_SIZE)
+        for like, (_, _, created_at) in zip(like_objects, likes):
+            like.created_at = created_at
+        Like.objects.bulk_update(like_objects, ['created_at'], batch_size=INSERT_BATCH_SIZE)
+
+        # Keep the view counters in step with the replayed views
+        view_counts = defaultdict(int)
+        for _, video_id, _, _ in views:
+            view_counts[video_id] += 1
+        by_count = defaultdict(list)
+        for video_id, count in view_counts.items():
+            by_count[count].append(video_id)
+        for count, video_ids in by_count.items():
+            Video.objects.filter(id__in=video_ids).update(views=F('views') + count)
+
+        return {row[0] for row in views} | {row[0] for row in likes}
+
+    def _insert_videos(self, videos):
+        """Insert videos with their embeddings and categories"""
+        Video.objects.bulk_create([
+            Video(
+                id=video_id, title=title, description='', creator_id=creator_id, slug=slug,
+                content_type=content_type, is_published=is_published, moderation_status=moderation_status
+            )
+            for video_id, title, creator_id, slug, content_type, is_published, moderation_status, _ in videos
+        ], batch_size=INSERT_BATCH_SIZE)
+        Video.objects.bulk_update([
+            Video(id=row[0], created_at=row[7]) for row in videos
+        ], ['created_at'], batch_size=INSERT_BATCH_SIZE)
+
+        new_ids = {row[0] for row in videos}
+        self.video_ids |= new_ids
+        VideoEmbedding.objects.bulk_create([
+            VideoEmbedding(video_id=video_id, **self.history['embeddings'][video_id])
+            for video_id in new_ids if video_id in self.history['embeddings']
+        ], batch_size=INSERT_BATCH_SIZE)
+        Category.videos.through.objects.bulk_create([
+            Category.videos.through(category_id=category_id, video_id=video_id)
+            for category_id, video_id in self.history['category_videos'] if video_id in new_ids
+        ], batch_size=INSERT_BATCH_SIZE)
+
+
+def refresh_derived_state(user_ids, now, retrain_models=False):
+    """
+    Rebuild the state the recommender derives from raw interactions
+
+    Args:
+        user_ids (set): Users whose preference embeddings changed
+        now (datetime): Replay clock
+        retrain_models (bool): Also rebuild the item-item model and ALS factors
+    """
+    from core.nlp import calculate_user_preference_embedding
+    from core.trending import refresh_trending
+    from core.embedding_matrix import get_embedding_matrix
+    from core.exploration import get_exploration_sampler
+
+    User = get_user_model()
+    embeddings = [
+        UserEmbedding(user=user, **UserEmbedding.encode_fields(calculate_user_preference_embedding(user)))
+        for user in User.objects.filter(id__in=user_ids)
+    ]
+    UserEmbedding.objects.bulk_create(
+        embeddings,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=STORED_EMBEDDING_FIELDS,
+        batch_size=INSERT_BATCH_SIZE
+    )
+
+    refresh_trending(now)
+    get_embedding_matrix().refresh(force=True)
+    get_exploration_sampler().build()
+
+    if retrain_models:
+        from core.item_similarity import get_item_similarity_model
+        from core.matrix_factorization import FactorModel, load_feedback, train_als, save_factors
+
+        model = get_item_similarity_model()
+        model.build()
+        model.save()
+
+        factor_user_ids, factor_video_ids, feedback = load_feedback()
+        if feedback.nnz:
+            user_factors, item_factors = train_als(feedback)
+            save_factors(factor_user_ids, factor_video_ids, user_factors, item_factors)
+            FactorModel.get_instance().load()
+
+    # Ranked lists and the popular list were computed from older data
+    cache.clear()
+
+
+def _init_replay_worker():
+    """Pool initializer: never reuse a database connection inherited from the parent"""
+    connections.close_all()
+
+
+def _replay_user(task):
+    """
+    Ask every evaluated generator for one user's top-k at the replay time
+
+    Args:
+        task (tuple): (user_id, target_ids, now, k, sources)
+
+    Returns:
+        dict: Source name -> (hit, recall, ndcg, latency_ms, queries)
+    """
+    from core.recommender import ContextualBanditRecommender, RecommendationContext, ranked_cache_key
+
+    user_id, target_ids, now, k, sources = task
+    recommender = ContextualBanditRecommender(exploration_rate=0.0)
+    results = {}
+
+    # The recommender's own notion of "now" follows the replay clock
+    with mock.patch('django.utils.timezone.now', return_value=now):
+        user = get_user_model().objects.get(id=user_id)
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            context = RecommendationContext(user)
+            results['context'] = (None, None, None, (time.perf_counter() - start) * 1000, len(queries))
+
+        for source in sources:
+            method = SOURCES[source]
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    if source == 'recommend':
+                        cache.delete(ranked_cache_key(user_id))
+                        videos = recommender.recommend_for_user(user_id, k)
+                    elif source == 'popular':
+                        videos = recommender.get_popular_videos(k)
+                    elif source == 'exploration':
+                        videos = recommender.get_exploration_videos(user, k)
+                    else:
+                        videos = getattr(recommender, method)(user, k, True, context)
+                    elapsed = (time.perf_counter() - start) * 1000
+                hit, recall, ndcg = ranking_metrics([video.id for video in videos], target_ids, k)
+                results[source] = (hit, recall, ndcg, elapsed, len(queries))
+            except Exception as e:
+                logger.error(f"Error replaying {source} for user {user_id}: {e}")
+
+    return results
+
+
+def replay(history, start, end, step, k=DEFAULT_K, sources=tuple(SOURCES), users_per_step=200,
+           workers=1, retrain_models=False, seed=0, progress=None):
+    """
+    Replay history chronologically and score each generator on what users watched next
+
+    At every step boundary t, users who go on to watch videos they had not seen
+    before (and that existed at t) within the next step are evaluated; each
+    generator ranks top-k from the data before t only. Users of a step are
+    spread over a process pool.
+
+    Args:
+        history (dict): Output of load_history
+        start (datetime): First evaluation time
+        end (datetime): Replay stops here
+        step (timedelta): Distance between evaluation times (and the look-ahead window)
+        k (int): Cutoff of the evaluated lists
+        sources (tuple): Names from SOURCES to evaluate
+        users_per_step (int): Maximum users evaluated per step (sampled)
+        workers (int): Worker processes (1 = in process)
+        retrain_models (bool): Rebuild the item-item model and ALS factors at every step
+        seed (int): Random seed for sampling users
+        progress (callable): Optional callback(step_time, evaluated_users)
+
+    Returns:
+        dict: Per-generator quality (hit rate, recall, NDCG at k), latency and query summaries
+    """
+    rng = random.Random(seed)
+    database = ReplayDatabase(history)
+    database.setup()
+    touched = database.advance(start)
+    first_views = defaultdict(dict)
+    for user_id, video_id, _, created_at in history['views']:
+        first_views[user_id].setdefault(video_id, created_at)
+
+    collected = defaultdict(list)
+    now = start
+    while now < end:
+        horizon = min(now + step, end)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            refresh_derived_state(touched, now, retrain_models)
+
+        # Targets: first-time views in (now, horizon] of videos that existed at `now`
+        targets = defaultdict(set)
+        for user_id, watched in first_views.items():
+            for video_id, first_seen in watched.items():
+                if now <= first_seen < horizon and video_id in database.video_ids:
+                    targets[user_id].add(video_id)
+        user_ids = sorted(targets)
+        if len(user_ids) > users_per_step:
+            user_ids = sorted(rng.sample(user_ids, users_per_step))
+        tasks = [(user_id, targets[user_id], now, k, tuple(sources)) for user_id in user_ids]
+
+        if workers > 1 and len(tasks) > 1:
+            # Children must open their own connections, so close the parent's before forking
+            connections.close_all()
+            with multiprocessing.Pool(workers, initializer=_init_replay_worker) as pool:
+                step_results = list(pool.imap_unordered(_replay_user, tasks, chunksize=4))
+        else:
+            step_results = [_replay_user(task) for task in tasks]
+
+        for user_results in step_results:
+            for source, values in user_results.items():
+                collected[source].append(values)
+
+        if progress is not None:
+            progress(now, len(tasks))
+
+        touched = database.advance(horizon)
+        now = horizon
+
+    report = {}
+    for source, values in collected.items():
+        summary = latency_summary([value[3] for value in values], [value[4] for value in values])
+        if source != 'context':
+            summary.update({
+                f'hit_rate@{k}': round(float(np.mean([value[0] for value in values])), 4),
+                f'recall@{k}': round(float(np.mean([value[1] for value in values])), 4),
+                f'ndcg@{k}': round(float(np.mean([value[2] for value in values])), 4),
+            })
+        report[source] = summary
+    return report
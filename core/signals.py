@@ -1,36 +1,200 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from videos.models import Video
-from .models import Blog, Post
-from .bert_utils import create_or_update_content_embedding
+from .models import Blog, Post, VideoEmbedding, ContentEmbedding, Like, Comment, Tag, Category
+from .embedding_queue import enqueue_embedding, enqueue_embeddings
 import logging
 
 logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=Video)
-def create_video_embedding(sender, instance, created, **kwargs):
-    """Create or update embedding when video is saved"""
+def queue_video_embedding(sender, instance, created, update_fields=None, **kwargs):
+    """Queue the video for embedding when it is saved (see core.embedding_queue)"""
+    # View counter updates do not change the embedded text
+    if update_fields is not None and set(update_fields) <= {'views'}:
+        return
     if instance.is_published:  # Only create embeddings for published videos
         try:
-            create_or_update_content_embedding(instance)
-            logger.info(f"Created/updated embedding for Video: {instance.id}")
+            enqueue_embedding(instance)
         except Exception as e:
-            logger.error(f"Error creating embedding for Video {instance.id}: {str(e)}")
+            logger.error(f"Error queueing embedding for Video {instance.id}: {str(e)}")
 
 @receiver(post_save, sender=Blog)
-def create_blog_embedding(sender, instance, created, **kwargs):
-    """Create or update embedding when blog is saved"""
+def queue_blog_embedding(sender, instance, created, **kwargs):
+    """Queue the blog for embedding when it is saved"""
     try:
-        create_or_update_content_embedding(instance)
-        logger.info(f"Created/updated embedding for Blog: {instance.id}")
+        enqueue_embedding(instance)
     except Exception as e:
-        logger.error(f"Error creating embedding for Blog {instance.id}: {str(e)}")
+        logger.error(f"Error queueing embedding for Blog {instance.id}: {str(e)}")
 
 @receiver(post_save, sender=Post)
-def create_post_embedding(sender, instance, created, **kwargs):
-    """Create or update embedding when post is saved"""
+def queue_post_embedding(sender, instance, created, **kwargs):
+    """Queue the post for embedding when it is saved"""
     try:
-        create_or_update_content_embedding(instance)
-        logger.info(f"Created/updated embedding for Post: {instance.id}")
+        enqueue_embedding(instance)
     except Exception as e:
-        logger.error(f"Error creating embedding for Post {instance.id}: {str(e)}") 
\ No newline at end of file
+        logger.error(f"Error queueing embedding for Post {instance.id}: {str(e)}")
+
+@receiver(post_save, sender=VideoEmbedding)
+@receiver(post_delete, sender=VideoEmbedding)
+def invalidate_cached_video_embedding(sender, instance, **kwargs):
+    """Stop serving the previous vector of a regenerated or deleted embedding"""
+    from .embedding_cache import invalidate_video_embeddings
+    invalidate_video_embeddings([instance.video_id])
+
+@receiver(post_delete, sender=VideoEmbedding)
+def remove_video_embedding_row(sender, instance, **kwargs):
+    """Drop a deleted video from this process's embedding matrix"""
+    from .embedding_matrix import EmbeddingMatrix
+    EmbeddingMatrix.get_instance().remove([instance.video_id])
+
+
+@receiver(post_save, sender=VideoEmbedding)
+def index_video_embedding(sender, instance, **kwargs):
+    """Add a new or updated video embedding to this process's ANN index"""
+    from .ann_index import ANNIndex
+    try:
+        video = instance.video
+        if video.is_published and video.moderation_status == 'approved' and instance.matches_model():
+            ANNIndex.get_instance('video').add([video.id], instance.get_vector())
+    except Exception as e:
+        logger.error(f"Error indexing embedding for Video {instance.video_id}: {str(e)}")
+
+@receiver(post_save, sender=Video)
+def update_video_ann_index(sender, instance, created, update_fields=None, **kwargs):
+    """Add approved videos to the ANN indexes and drop unpublished ones"""
+    from .ann_index import ANNIndex
+
+    # View counter updates do not change what is searchable
+    if update_fields is not None and set(update_fields) <= {'views'}:
+        return
+
+    try:
+        if instance.is_published and instance.moderation_status == 'approved':
+            embedding = VideoEmbedding.objects.filter(video=instance).first()
+            if embedding is not None and embedding.matches_model():
+                ANNIndex.get_instance('video').add([instance.id], embedding.get_vector())
+        else:
+            ANNIndex.get_instance('video').remove([instance.id])
+    except Exception as e:
+        logger.error(f"Error updating ANN index for Video {instance.id}: {str(e)}")
+
+@receiver(post_save, sender=Video)
+def update_exploration_sampler(sender, instance, update_fields=None, **kwargs):
+    """Keep this process's exploration buckets in step with publishing and moderation"""
+    from .exploration import ExplorationSampler
+
+    # View counter updates do not change what can be explored
+    if update_fields is not None and set(update_fields) <= {'views'}:
+        return
+
+    sampler = ExplorationSampler.get_instance()
+    if instance.is_published and instance.moderation_status == 'approved':
+        sampler.add(instance.id, instance.created_at)
+    else:
+        sampler.remove(instance.id)
+
+@receiver(post_delete, sender=Video)
+def remove_video_from_exploration_sampler(sender, instance, **kwargs):
+    """Stop exploring a deleted video"""
+    from .exploration import ExplorationSampler
+    ExplorationSampler.get_instance().remove(instance.id)
+
+@receiver(post_delete, sender=Video)
+def remove_video_from_ann_index(sender, instance, **kwargs):
+    """Drop a deleted video from the ANN index"""
+    from .ann_index import ANNIndex
+    ANNIndex.get_instance('video').remove([instance.id])
+
+@receiver(post_save, sender=ContentEmbedding)
+def index_content_embedding(sender, instance, **kwargs):
+    """Add a new or updated content embedding to this process's search index"""
+    from .ann_index import ANNIndex, encode_content_id
+    try:
+        if instance.matches_model():
+            index_id = encode_content_id(instance.content_type_id, instance.object_id)
+            ANNIndex.get_instance('content').add([index_id], instance.get_vector())
+    except Exception as e:
+        logger.error(f"Error indexing content embedding {instance.id}: {str(e)}")
+
+@receiver(post_delete, sender=ContentEmbedding)
+def remove_content_embedding_from_index(sender, instance, **kwargs):
+    """Drop a deleted content embedding from this process's search index"""
+    from .ann_index import ANNIndex, encode_content_id
+    ANNIndex.get_instance('content').remove([encode_content_id(instance.content_type_id, instance.object_id)])
+
+@receiver(post_delete, sender=Blog)
+@receiver(post_delete, sender=Post)
+def delete_content_embedding(sender, instance, **kwargs):
+    """Delete the embedding of a deleted blog or post (generic relations do not cascade)"""
+    from django.contrib.contenttypes.models import ContentType
+    try:
+        content_type = ContentType.objects.get_for_model(instance)
+        ContentEmbedding.objects.filter(content_type=content_type, object_id=instance.pk).delete()
+    except Exception as e:
+        logger.error(f"Error deleting embedding for {sender.__name__} {instance.pk}: {str(e)}")
+
+
+@receiver(post_save, sender=Like)
+def apply_like_to_user_embedding(sender, instance, created, **kwargs):
+    """Fold a new video like into the user's preference embedding"""
+    if created and instance.video_id:
+        from .nlp import apply_user_interaction, LIKE_INTERACTION_WEIGHT
+        try:
+            apply_user_interaction(instance.user_id, instance.video_id, LIKE_INTERACTION_WEIGHT)
+        except Exception as e:
+            logger.error(f"Error updating user embedding for User {instance.user_id}: {str(e)}")
+
+
+@receiver(post_save, sender=Comment)
+def apply_comment_to_user_embedding(sender, instance, created, **kwargs):
+    """Fold a new video comment into the user's preference embedding"""
+    if created and instance.video_id:
+        from .nlp import apply_user_interaction, COMMENT_INTERACTION_WEIGHT
+        try:
+            apply_user_interaction(instance.user_id, instance.video_id, COMMENT_INTERACTION_WEIGHT)
+        except Exception as e:
+            logger.error(f"Error updating user embedding for User {instance.user_id}: {str(e)}")
+
+
+@receiver(m2m_changed, sender=Tag.videos.through)
+@receiver(m2m_changed, sender=Category.videos.through)
+def mark_related_lists_stale(sender, instance, action, reverse, pk_set, **kwargs):
+    """Rebuild the related lists of videos whose tags or categories changed"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    from .related import mark_related_stale
+    try:
+        if reverse:
+            # video.tags / video.categories changed
+            video_ids = [instance.pk]
+        elif action == 'pre_clear':
+            video_ids = list(instance.videos.values_list('id', flat=True))
+        else:
+            video_ids = list(pk_set)
+        mark_related_stale(video_ids)
+    except Exception as e:
+        logger.error(f"Error marking related video lists stale: {str(e)}")
+
+
+@receiver(m2m_changed, sender=Tag.videos.through)
+@receiver(m2m_changed, sender=Category.videos.through)
+def queue_retagged_video_embeddings(sender, instance, action, reverse, pk_set, **kwargs):
+    """Re-embed published videos whose tags or categories changed (both are part of the embedded text)"""
+    # Clears are handled before they run, while the affected videos can still be
+    # listed; the job is written in the same transaction as the clear
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    try:
+        if reverse:
+            # video.tags / video.categories changed
+            if instance.is_published:
+                enqueue_embedding(instance)
+        elif action == 'pre_clear':
+            enqueue_embeddings(Video, instance.videos.filter(is_published=True).values_list('id', flat=True))
+        else:
+            enqueue_embeddings(Video, Video.objects.filter(id__in=pk_set, is_published=True).values_list('id', flat=True))
+    except Exception as e:
+        logger.error(f"Error queueing embeddings of retagged videos: {str(e)}")
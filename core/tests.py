@@ -1,3 +1,1281 @@
-from django.test import TestCase
+import base64
+import copy
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from scipy import sparse
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from videos.models import Video, VideoView
+from core.models import (
+    BanditStats, Blog, Category, ContentEmbedding, EmbeddingJob, Impression, Like, Post, RecommendationWatermark,
+    RelatedVideos, Tag, TrendingScore, VideoViewBucket
+)
+from core.impressions import ImpressionLogger, write_impressions
+from core.bandit_buffer import MAX_FLUSH_ATTEMPTS, BanditUpdateBuffer, apply_deltas, calculate_reward, compute_ucb_scores
+from core.covisitation import COVISIT_WINDOW_MINUTES, CovisitationModel, covisit_pairs, get_up_next_video
+from core.embedding_queue import (
+    CLAIM_TIMEOUT, MAX_ATTEMPTS, _fail_jobs, _finish_jobs, claim_jobs, enqueue_embeddings
+)
+from core.embedding_store import EMBEDDING_DIMENSION, EmbeddingDimensionError, decode_rows, decode_vector, encode_vector
+from core.exploration import ExplorationSampler
+from core.feeds import decode_cursor, encode_cursor, get_cursor_offset, get_feed_page
+from core.item_similarity import ItemSimilarityModel
+from core.matrix_factorization import KEEP_VERSIONS, FactorModel, get_factors_dir, save_factors, solve_side, train_als
+from core.related import (
+    build_related_lists, compute_related_lists, get_related_video_ids, get_related_videos, get_videos_to_refresh,
+    mark_related_stale
+)
+from core.trending import TRENDING_HALF_LIFE_HOURS, compute_trending_scores, refresh_trending
+from core.recommender import (
+    PRECOMPUTED_CACHE_TTL, ContextualBanditRecommender, bump_recommendation_version, cache_ranked_ids,
+    get_cached_ranked_ids, get_users_to_precompute, precompute_recommendations
+)
+from core.ann_index import MERGE_BATCH_SIZE, ANNIndex, NumpyIVFIndex, encode_content_id
+from core.embedding_matrix import EmbeddingMatrix
+
+
+class RecommenderTestCase(TestCase):
+    """Database test case with helpers for users and videos"""
+
+    @classmethod
+    def setUpClass(cls):
+        # New users get a generated avatar; keep it out of the real media directory
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def create_user(self, username):
+        return get_user_model().objects.create_user(username=username, password='password')
+
+    def create_video(self, creator, title='Video', **fields):
+        fields.setdefault('moderation_status', 'approved')
+        return Video.objects.create(title=title, description=f'{title} description', creator=creator, **fields)
+
+
+class EmbeddingMatrixTests(SimpleTestCase):
+    def setUp(self):
+        self.matrix = EmbeddingMatrix()
+        self.matrix.upsert([(1, [1.0, 0.0, 0.0]), (2, [0.0, 2.0, 0.0]), (3, [1.0, 1.0, 0.0])])
+
+    def test_upsert_normalises_rows(self):
+        self.assertEqual(len(self.matrix), 3)
+        np.testing.assert_allclose(self.matrix.get_vectors([2]), [[0.0, 1.0, 0.0]])
+
+    def test_upsert_replaces_rows(self):
+        self.matrix.upsert([(2, [0.0, 0.0, 5.0])])
+
+        self.assertEqual(len(self.matrix), 3)
+        np.testing.assert_allclose(self.matrix.get_vectors([2]), [[0.0, 0.0, 1.0]])
+
+    def test_upsert_skips_mismatched_dimensions(self):
+        self.assertEqual(self.matrix.upsert([(4, [1.0, 0.0])]), 0)
+        self.assertEqual(len(self.matrix.get_vectors([4])), 0)
+
+    def test_remove(self):
+        self.matrix.remove([1, 99])
+
+        self.assertEqual(sorted(self.matrix.ids.tolist()), [2, 3])
+        self.assertEqual(len(self.matrix.get_vectors([1])), 0)
+        np.testing.assert_allclose(self.matrix.get_vectors([2]), [[0.0, 1.0, 0.0]])
+
+    def test_score_skips_missing_candidates(self):
+        query = self.matrix.prepare_query([1.0, 0.0, 0.0])
+        ids, scores = self.matrix.score(query, [3, 4, 1])
+
+        self.assertEqual(ids.tolist(), [3, 1])
+        np.testing.assert_allclose(scores, [np.sqrt(0.5), 1.0], rtol=1e-6)
+
+    def test_score_several_queries(self):
+        queries = np.stack([self.matrix.prepare_query([1.0, 0.0, 0.0]), self.matrix.prepare_query([0.0, 1.0, 0.0])], axis=1)
+        ids, scores = self.matrix.score(queries, [1, 2])
+
+        self.assertEqual(ids.tolist(), [1, 2])
+        np.testing.assert_allclose(scores, [[1.0, 0.0], [0.0, 1.0]], atol=1e-6)
+
+    def test_prepare_query_rejects_bad_vectors(self):
+        self.assertIsNone(self.matrix.prepare_query(None))
+        self.assertIsNone(self.matrix.prepare_query([0.0, 0.0, 0.0]))
+        self.assertIsNone(self.matrix.prepare_query([1.0, 0.0]))
+
+    def test_top_k(self):
+        ids = np.array([10, 11, 12, 13])
+        scores = np.array([0.1, 0.9, 0.5, 0.7])
+
+        top_ids, top_scores = EmbeddingMatrix.top_k(ids, scores, 2)
+        self.assertEqual(top_ids.tolist(), [11, 13])
+        np.testing.assert_allclose(top_scores, [0.9, 0.7])
+
+        self.assertEqual(EmbeddingMatrix.top_k(ids, scores, 10)[0].tolist(), [11, 13, 12, 10])
+        self.assertEqual(len(EmbeddingMatrix.top_k(ids, scores, 0)[0]), 0)
+
+
+class SerialIndex(NumpyIVFIndex):
+    """NumPy index that, like FAISS, must not be written while it is searched"""
+    supports_concurrent_search = False
+
+    def copy(self):
+        return copy.deepcopy(self)
+
+
+class ANNIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.ids = np.arange(100, 300, dtype=np.int64)
+        self.vectors = rng.standard_normal((len(self.ids), 16)).astype(np.float32)
+
+    def build(self, backend_class=NumpyIVFIndex):
+        index = ANNIndex('test', use_faiss=False)
+        index._backend_class = lambda: backend_class
+        index.build(self.ids, self.vectors, nlist=4)
+        return index
+
+    def test_search_finds_nearest(self):
+        index = self.build()
+        ids, scores = index.search(self.vectors[5], 3, nprobe=4)
+
+        self.assertEqual(ids[0], self.ids[5])
+        self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_search_filter(self):
+        index = self.build()
+        allowed = set(self.ids[10:20].tolist())
+        ids, _ = index.search(self.vectors[5], 5, filter=allowed)
+
+        self.assertEqual(len(ids), 5)
+        self.assertTrue(set(ids.tolist()) <= allowed)
+
+    def test_add_and_remove(self):
+        index = self.build()
+        index.remove([self.ids[5]])
+        self.assertNotIn(self.ids[5], index.search(self.vectors[5], 3, nprobe=4)[0])
+
+        index.add([1], self.vectors[5:6])
+        self.assertEqual(index.search(self.vectors[5], 1, nprobe=4)[0].tolist(), [1])
+
+    def test_serial_backend_collects_writes(self):
+        index = self.build(SerialIndex)
+        backend = index.backend
+
+        index.remove([self.ids[5]])
+        index.add([1], self.vectors[5:6])
+
+        self.assertIs(index.backend, backend)
+        self.assertEqual(len(index.pending), 2)
+        ids, _ = index.search(self.vectors[5], 3, nprobe=4)
+        self.assertEqual(ids[0], 1)
+        self.assertNotIn(self.ids[5], ids)
+        self.assertEqual(index.search(self.vectors[5], 3, filter={self.ids[6]})[0].tolist(), [self.ids[6]])
+
+    def test_serial_backend_merges_in_batches(self):
+        index = self.build(SerialIndex)
+        backend = index.backend
+        new_ids = np.arange(1000, 1000 + MERGE_BATCH_SIZE)
+        vectors = np.repeat(self.vectors[:1], len(new_ids), axis=0)
+
+        for new_id, vector in zip(new_ids[:-1], vectors):
+            index.add([new_id], vector[None, :])
+        self.assertIs(index.backend, backend)
+
+        index.add(new_ids[-1:], vectors[-1:])
+        self.assertIsNot(index.backend, backend)
+        self.assertEqual(len(index.pending), 0)
+        self.assertEqual(len(index), len(self.ids) + len(new_ids))
+        self.assertEqual(len(backend), len(self.ids))
+
+    def test_save_and_load(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir, ignore_errors=True)
+
+        with override_settings(RECOMMENDER_DATA_DIR=data_dir):
+            index = self.build(SerialIndex)
+            index.add([1], self.vectors[5:6])
+            index.save()
+            self.assertEqual(len(index.pending), 0)
+
+            loaded = ANNIndex('test', use_faiss=False)
+            self.assertTrue(loaded.load())
+
+        self.assertEqual(len(loaded), len(self.ids) + 1)
+        self.assertIn(1, loaded.search(self.vectors[5], 2, nprobe=4)[0])
+
+
+class UCBRankingTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('viewer')
+        creator = self.create_user('creator')
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(4)]
+
+    def rank(self):
+        return [video.id for video in ContextualBanditRecommender().rank_videos_ucb(self.user, self.videos)]
+
+    def test_ranks_by_ucb_score(self):
+        for video, score in zip(self.videos, [0.2, 0.9, 0.5, 0.7]):
+            BanditStats.objects.create(video=video, impression_count=10, ucb_score=score)
+
+        self.assertEqual(self.rank(), [self.videos[i].id for i in (1, 3, 2, 0)])
+
+    def test_new_arms_rank_first_and_are_stored_at_infinity(self):
+        BanditStats.objects.create(video=self.videos[0], impression_count=10, ucb_score=0.9)
+        BanditStats.objects.create(video=self.videos[1], impression_count=10, ucb_score=0.1)
+
+        self.assertEqual(self.rank()[:2], [self.videos[2].id, self.videos[3].id])
+        self.assertEqual(self.rank()[2:], [self.videos[0].id, self.videos[1].id])
+        self.assertEqual(BanditStats.objects.get(video=self.videos[3]).ucb_score, float('inf'))
+
+    def test_arms_never_shown_rank_first(self):
+        for video in self.videos:
+            BanditStats.objects.create(video=video, impression_count=5, ucb_score=0.5)
+        BanditStats.objects.filter(video=self.videos[2]).update(impression_count=0, ucb_score=0.0)
+
+        self.assertEqual(self.rank()[0], self.videos[2].id)
+
+    def test_queries_do_not_grow_with_candidates(self):
+        creator = self.videos[0].creator
+        more = [self.create_video(creator, f'More {i}') for i in range(10)]
+        recommender = ContextualBanditRecommender()
+        recommender.rank_videos_ucb(self.user, self.videos + more)  # Creates the arms
+
+        with CaptureQueriesContext(connection) as few:
+            recommender.rank_videos_ucb(self.user, self.videos)
+        with CaptureQueriesContext(connection) as many:
+            recommender.rank_videos_ucb(self.user, self.videos + more)
+        self.assertEqual(len(many), len(few))
+
+
+class RewardTests(SimpleTestCase):
+    def test_reward_is_fraction_watched(self):
+        self.assertAlmostEqual(calculate_reward(150), 0.5)
+        self.assertAlmostEqual(calculate_reward(30, duration=60), 0.5)
+
+    def test_reward_is_capped(self):
+        self.assertEqual(calculate_reward(10000), 1.0)
+
+
+class UCBScoreTests(SimpleTestCase):
+    def test_matches_scalar_formula(self):
+        scores = compute_ucb_scores([10, 4], [5.0, 1.0], total_arms=8)
+        expected = [0.5 + np.sqrt(2 * np.log(8) / 10), 0.25 + np.sqrt(2 * np.log(8) / 4)]
+        np.testing.assert_allclose(scores, expected)
+
+    def test_unseen_arms_score_infinity(self):
+        scores = compute_ucb_scores([0, 3], [0.0, 3.0], total_arms=2)
+        self.assertEqual(scores[0], np.inf)
+        self.assertTrue(np.isfinite(scores[1]))
+
+    def test_single_arm_has_no_bonus(self):
+        np.testing.assert_allclose(compute_ucb_scores([4], [2.0], total_arms=1), [0.5])
+
+
+class BanditBufferTests(SimpleTestCase):
+    def setUp(self):
+        # Long interval so the background flusher never touches the database
+        self.buffer = BanditUpdateBuffer(flush_interval=3600)
+
+    def test_deltas_are_summed_per_video(self):
+        self.buffer.record(1)
+        self.buffer.record(1, clicked=True, impressions=0)
+        self.buffer.record_impressions({1: 2, 2: 1})
+
+        self.assertEqual(self.buffer._pending[1][:2], [3, 1])
+        self.assertEqual(self.buffer._pending[2][:2], [1, 0])
+
+    def test_watch_time_heartbeats_add_up_to_one_reward(self):
+        self.buffer.record(1, clicked=True, impressions=0)
+        previous = 0
+        for watched in (60, 120, 400, 900):
+            self.buffer.record(1, watch_time=watched, impressions=0, previous_watch_time=previous)
+            previous = watched
+
+        impressions, clicks, watch_time, reward = self.buffer._pending[1]
+        self.assertEqual((impressions, clicks, watch_time), (0, 1, 900))
+        self.assertAlmostEqual(reward, calculate_reward(900))
+
+    def test_previous_watch_time_beyond_watch_time_is_ignored(self):
+        self.buffer.record(1, watch_time=30, impressions=0, previous_watch_time=60)
+
+        self.assertEqual(self.buffer._pending[1][2], 0)
+        self.assertEqual(self.buffer._pending[1][3], 0.0)
+
+    def test_failed_flush_requeues_deltas(self):
+        self.buffer.record(1)
+        with self.assertLogs('core.bandit_buffer', 'ERROR'), \
+                mock.patch('core.bandit_buffer.apply_deltas', side_effect=RuntimeError('database is down')):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.record(1)
+
+        self.assertEqual(self.buffer._pending[1][0], 2)
+
+    def test_deltas_are_dropped_after_repeated_failures(self):
+        self.buffer.record(1)
+        with self.assertLogs('core.bandit_buffer', 'ERROR'), \
+                mock.patch('core.bandit_buffer.apply_deltas', side_effect=RuntimeError('database is down')):
+            for _ in range(MAX_FLUSH_ATTEMPTS):
+                self.buffer.flush()
+
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer._failures, {})
+
+    def test_successful_flush_resets_failures(self):
+        self.buffer.record(1)
+        with self.assertLogs('core.bandit_buffer', 'ERROR'), \
+                mock.patch('core.bandit_buffer.apply_deltas', side_effect=RuntimeError('database is down')):
+            self.buffer.flush()
+        with mock.patch('core.bandit_buffer.apply_deltas') as apply:
+            self.assertEqual(self.buffer.flush(), 1)
+
+        apply.assert_called_once_with({1: [1, 0, 0, 0.0]})
+        self.assertEqual(self.buffer._failures, {})
+
+
+class ApplyDeltasTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.creator = self.create_user('creator')
+        self.video = self.create_video(self.creator)
+
+    def test_impressions_accumulate(self):
+        apply_deltas({self.video.id: [3, 0, 0, 0.0]})
+        apply_deltas({self.video.id: [2, 1, 150, 0.5]})
+
+        stats = BanditStats.objects.get(video=self.video)
+        self.assertEqual((stats.impression_count, stats.click_count, stats.total_watch_time), (5, 1, 150))
+        self.assertAlmostEqual(stats.reward_sum, 0.5)
+        self.assertTrue(np.isfinite(stats.ucb_score))
+
+    def test_impressions_never_fall_below_clicks(self):
+        apply_deltas({self.video.id: [0, 2, 120, 0.4]})
+
+        stats = BanditStats.objects.get(video=self.video)
+        self.assertEqual((stats.impression_count, stats.click_count), (2, 2))
+        self.assertTrue(np.isfinite(stats.ucb_score))
+
+    def test_deltas_of_deleted_videos_are_dropped(self):
+        deleted = self.create_video(self.creator, 'Deleted')
+        buffer = BanditUpdateBuffer(flush_interval=3600)
+        buffer.record(self.video.id)
+        buffer.record(deleted.id)
+        deleted_id = deleted.id
+        deleted.delete()
+
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(BanditStats.objects.get(video=self.video).impression_count, 1)
+        self.assertFalse(BanditStats.objects.filter(video_id=deleted_id).exists())
+
+
+class ItemSimilarityTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        creator = self.create_user('creator')
+        self.users = [self.create_user(f'viewer{i}') for i in range(4)]
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(5)]
+        self.watch(0, 0, 1)
+        self.watch(1, 0, 1, 2)
+        self.watch(2, 2, 3)
+        Like.objects.create(user=self.users[3], video=self.videos[3])
+
+    def watch(self, user, *videos):
+        for video in videos:
+            VideoView.objects.create(user=self.users[user], video=self.videos[video])
+
+    @staticmethod
+    def neighbours(model):
+        return {
+            int(video_id): dict(zip(
+                model.neighbor_ids[model.indptr[i]:model.indptr[i + 1]].tolist(),
+                model.scores[model.indptr[i]:model.indptr[i + 1]].astype(float).round(2).tolist()
+            ))
+            for i, video_id in enumerate(model.video_ids)
+        }
+
+    def built(self):
+        model = ItemSimilarityModel()
+        model.build()
+        return model
+
+    def test_build_links_videos_watched_together(self):
+        neighbours = self.neighbours(self.built())
+
+        self.assertEqual(list(neighbours[self.videos[0].id]), [self.videos[1].id, self.videos[2].id])
+        self.assertNotIn(self.videos[0].id, neighbours[self.videos[0].id])
+        self.assertNotIn(self.videos[3].id, neighbours[self.videos[0].id])
+
+    def test_update_matches_a_full_rebuild(self):
+        model = self.built()
+        self.watch(3, 1, 4)
+        self.watch(0, 3)
+        Like.objects.create(user=self.users[2], video=self.videos[0])
+
+        self.assertEqual(model.update(), 4)
+        self.assertEqual(self.neighbours(model), self.neighbours(self.built()))
+
+    def test_update_without_new_interactions(self):
+        model = self.built()
+        before = self.neighbours(model)
+
+        self.assertEqual(model.update(), 0)
+        self.assertEqual(self.neighbours(model), before)
+
+    def test_score_sums_neighbours_of_seeds(self):
+        model = self.built()
+        ids, scores = model.score([self.videos[0].id, self.videos[2].id, 999])
+        scored = dict(zip(ids.tolist(), scores.tolist()))
+
+        neighbours = self.neighbours(model)
+        expected = neighbours[self.videos[0].id][self.videos[1].id] + neighbours[self.videos[2].id][self.videos[1].id]
+        self.assertAlmostEqual(scored[self.videos[1].id], expected, places=2)
+        self.assertIn(self.videos[3].id, scored)
+
+
+class MatrixFactorizationTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.matrix = sparse.random(12, 9, density=0.4, format='csr', random_state=1, dtype=np.float32) * 10
+        self.fixed = rng.standard_normal((9, 4)).astype(np.float32)
+
+    def reference_solve(self, matrix, fixed, regularization):
+        """Row-by-row solve of (Y^T C_u Y + reg * I) x_u = Y^T C_u p_u"""
+        dense = matrix.toarray()
+        rows = []
+        for row in dense:
+            confidence = np.diag(1 + row)
+            preference = (row > 0).astype(np.float64)
+            lhs = fixed.T @ confidence @ fixed + regularization * np.eye(fixed.shape[1])
+            rows.append(np.linalg.solve(lhs, fixed.T @ confidence @ preference))
+        return np.array(rows)
+
+    def test_solve_side_matches_row_by_row_solve(self):
+        expected = self.reference_solve(self.matrix, self.fixed, 0.1)
+
+        np.testing.assert_allclose(solve_side(self.matrix, self.fixed, 0.1), expected, rtol=1e-3, atol=1e-4)
+
+    def test_solve_side_blocks_and_long_rows(self):
+        expected = self.reference_solve(self.matrix, self.fixed, 0.1)
+
+        with mock.patch('core.matrix_factorization.SOLVE_BATCH_NNZ', 5), \
+                mock.patch('core.matrix_factorization.LONG_ROW_NNZ', 3):
+            np.testing.assert_allclose(solve_side(self.matrix, self.fixed, 0.1), expected, rtol=1e-3, atol=1e-4)
+
+    def test_train_als_ranks_observed_items_first(self):
+        # Two groups of users, each watching its own half of the videos
+        blocks = np.kron(np.eye(2), np.ones((5, 4))).astype(np.float32)
+        user_factors, item_factors = train_als(sparse.csr_matrix(blocks * 5), factors=4, iterations=10)
+
+        self.assertEqual((user_factors.shape, item_factors.shape), ((10, 4), (8, 4)))
+        scores = user_factors @ item_factors.T
+        self.assertTrue(np.all(scores[:5, :4].min(axis=1) > scores[:5, 4:].max(axis=1)))
+        self.assertTrue(np.all(scores[5:, 4:].min(axis=1) > scores[5:, :4].max(axis=1)))
+
+
+class FactorModelTests(SimpleTestCase):
+    def setUp(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir, ignore_errors=True)
+        settings_override = override_settings(RECOMMENDER_DATA_DIR=data_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user_factors = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+        self.item_factors = np.array([[0.5, 0.1], [0.2, 0.9], [0.3, 0.3]], dtype=np.float32)
+        save_factors([7, 9], [10, 20, 30], self.user_factors, self.item_factors)
+
+    def test_score_candidates(self):
+        model = FactorModel()
+        self.assertTrue(model.load())
+
+        ids, scores = model.score(9, np.array([30, 99, 10]))
+        self.assertEqual(ids.tolist(), [30, 10])
+        np.testing.assert_allclose(scores, [0.3, 0.1])
+
+    def test_unknown_user_scores_nothing(self):
+        model = FactorModel()
+        model.load()
+
+        self.assertEqual(len(model.score(8, np.array([10, 20]))[0]), 0)
+
+    def test_load_picks_up_new_versions(self):
+        model = FactorModel()
+        model.load()
+        save_factors([7], [10], self.user_factors[:1] * 2, self.item_factors[:1])
+
+        self.assertTrue(model.load())
+        np.testing.assert_allclose(model.score(7, np.array([10, 20]))[1], [1.0])
+
+    def test_old_versions_are_pruned(self):
+        for _ in range(KEEP_VERSIONS + 1):
+            save_factors([7], [10], self.user_factors[:1], self.item_factors[:1])
+
+        versions = [name for name in os.listdir(get_factors_dir()) if not name.startswith('CURRENT')]
+        self.assertEqual(len(versions), KEEP_VERSIONS)
+
+
+class RankedListTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('viewer')
+        creator = self.create_user('creator')
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(6)]
+        self.recommender = ContextualBanditRecommender(exploration_rate=0)
+
+    def recommend(self, count):
+        return [video.id for video in self.recommender.recommend_for_user(self.user.id, count)]
+
+    def test_one_ranked_list_serves_every_size(self):
+        first = self.recommend(2)
+        ranked = get_cached_ranked_ids(self.user.id)
+
+        self.assertEqual(sorted(ranked.tolist()), sorted(video.id for video in self.videos))
+        self.assertEqual(first, ranked[:2].tolist())
+        with mock.patch('core.recommender.RecommendationContext', side_effect=AssertionError('ranked again')):
+            self.assertEqual(self.recommend(4), ranked[:4].tolist())
+
+    def test_cached_slice_keeps_rank_order_and_skips_deleted_videos(self):
+        ids = [video.id for video in reversed(self.videos)]
+        cache_ranked_ids(self.user.id, True, ids)
+        self.videos[-2].delete()
+
+        self.assertEqual(self.recommend(3), [ids[0], ids[2], ids[3]])
+
+    def test_cached_slice_skips_rejected_videos(self):
+        ids = [video.id for video in self.videos]
+        cache_ranked_ids(self.user.id, True, ids)
+        Video.objects.filter(id=ids[1]).update(moderation_status='rejected')
+        Video.objects.filter(id=ids[2]).update(is_published=False)
+
+        self.assertEqual(self.recommend(3), [ids[0], ids[3], ids[4]])
+
+    def test_version_bump_invalidates_cached_lists(self):
+        cache_ranked_ids(self.user.id, True, [self.videos[0].id])
+        bump_recommendation_version()
+
+        self.assertIsNone(get_cached_ranked_ids(self.user.id))
+
+    def test_large_ids_round_trip(self):
+        ids = [2 ** 40, 5, 2 ** 33]
+        cache_ranked_ids(self.user.id, False, ids)
+
+        self.assertEqual(get_cached_ranked_ids(self.user.id, False).tolist(), ids)
+        self.assertIsNone(get_cached_ranked_ids(self.user.id, True))
+
+
+def raw_cursor(position):
+    """Encode an arbitrary JSON value the way encode_cursor does, without validation"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+class FeedCursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor({'feed': 'trending', 'offset': 0, 'views': 15, 'id': 7})
+
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor, 'trending'), {'feed': 'trending', 'offset': 0, 'views': 15, 'id': 7})
+        self.assertEqual(get_cursor_offset(encode_cursor({'feed': 'for_you', 'offset': 20}), 'for_you'), 20)
+
+    def test_datetimes_are_parsed(self):
+        created_at = timezone.now().replace(microsecond=0)
+        cursor = encode_cursor({'feed': 'latest', 'created_at': created_at.isoformat(), 'id': 3})
+
+        self.assertEqual(decode_cursor(cursor, 'latest')['created_at'], created_at)
+
+    def test_offset_only_cursor(self):
+        cursor = encode_cursor({'feed': 'for_you', 'offset': 40})
+
+        self.assertEqual(decode_cursor(cursor, 'for_you'), {'feed': 'for_you', 'offset': 40})
+
+    def test_missing_cursor(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor(''))
+        self.assertEqual(get_cursor_offset(None), 0)
+
+    def test_malformed_cursors_are_rejected(self):
+        malformed = [
+            '!!!not base64!!!',
+            raw_cursor('a string'),
+            raw_cursor([1, 2, 3]),
+            raw_cursor({'feed': 'for_you', 'offset': -5}),
+            raw_cursor({'feed': 'for_you', 'offset': '10'}),
+            raw_cursor({'feed': 'for_you', 'offset': True}),
+            raw_cursor({'feed': 'trending', 'views': 'many', 'id': 1}),
+            raw_cursor({'feed': 'trending', 'views': 1.5, 'id': 1}),
+            raw_cursor({'feed': 'trending', 'views': 3}),
+            raw_cursor({'feed': 'trending', 'views': 3, 'id': 'x'}),
+            raw_cursor({'feed': 'latest', 'created_at': 'yesterday', 'id': 1}),
+            raw_cursor({'feed': 'latest', 'created_at': 12345, 'id': 1}),
+        ]
+        for cursor in malformed:
+            with self.subTest(cursor=cursor), self.assertLogs('core.feeds', 'WARNING'):
+                self.assertIsNone(decode_cursor(cursor))
+
+    def test_cursor_of_another_feed_is_rejected(self):
+        cursor = encode_cursor({'feed': 'latest', 'offset': 10})
+
+        with self.assertLogs('core.feeds', 'WARNING'):
+            self.assertEqual(get_cursor_offset(cursor, 'trending'), 0)
+
+
+class FeedPageTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('viewer')
+        creator = self.create_user('creator')
+        # Feed cards link the thumbnail; the file itself is never read
+        self.videos = [self.create_video(creator, f'Video {i}', thumbnail='thumbnails/video.jpg') for i in range(7)]
+        self.create_video(creator, 'Draft', is_published=False)
+        for video, views in zip(self.videos, [5, 9, 9, 1, 9, 0, 3]):
+            Video.objects.filter(id=video.id).update(views=views)
+
+    def collect(self, feed_type, user=None, page_size=3):
+        """Follow next cursors to the end of a feed, returning the ids of every page"""
+        pages, cursor = [], None
+        while True:
+            videos, cursor, _ = get_feed_page(feed_type, user, cursor, page_size)
+            pages.append([video.id for video in videos])
+            if cursor is None:
+                return pages
+
+    def test_trending_pages_by_views_then_id(self):
+        by_views = sorted(self.videos, key=lambda video: (Video.objects.get(id=video.id).views, video.id), reverse=True)
+        pages = self.collect('trending')
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), [video.id for video in by_views])
+
+    def test_trending_serves_scored_videos_then_the_tail(self):
+        now = timezone.now()
+        for index, score in ((3, 10.0), (5, 7.0), (0, 7.0)):
+            TrendingScore.objects.create(video=self.videos[index], score=score, scored_at=now)
+        expected = [self.videos[i].id for i in (3, 5, 0, 4, 2, 1, 6)]
+
+        for page_size in (2, 3, 4):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(sum(self.collect('trending', page_size=page_size), []), expected)
+
+    def test_latest_pages_newest_first(self):
+        pages = self.collect('latest', page_size=4)
+
+        self.assertEqual(sum(pages, []), [video.id for video in reversed(self.videos)])
+
+    def test_keyset_pages_do_not_repeat_after_new_uploads(self):
+        first, cursor, _ = get_feed_page('latest', None, None, 3)
+        self.create_video(self.videos[0].creator, 'Newer')
+        second, _, _ = get_feed_page('latest', None, cursor, 3)
+
+        self.assertEqual([video.id for video in second], [video.id for video in reversed(self.videos[1:4])])
+
+    def test_for_you_pages_through_the_ranked_list(self):
+        ranked = [video.id for video in self.videos][::-1]
+        cache_ranked_ids(self.user.id, True, ranked)
+
+        pages = self.collect('for_you', self.user)
+        self.assertEqual(sum(pages, []), ranked)
+        self.assertTrue(get_feed_page('for_you', self.user)[2])
+
+    def test_malformed_cursor_gives_the_first_page(self):
+        with self.assertLogs('core.feeds', 'WARNING'):
+            videos, _, _ = get_feed_page('latest', None, 'garbage', 2)
+
+        self.assertEqual([video.id for video in videos], [self.videos[6].id, self.videos[5].id])
+
+    @mock.patch('core.views.log_impressions')
+    def test_feed_view_follows_next_url(self, log_impressions):
+        self.client.force_login(self.user)
+        cache_ranked_ids(self.user.id, True, [video.id for video in self.videos])
+
+        response = self.client.get(reverse('core:feed'), {'feed': 'for_you', 'page_size': 4})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['is_personalized'])
+        self.assertEqual([video['id'] for video in data['videos']], [video.id for video in self.videos[:4]])
+        self.assertIn(self.videos[0].title, data['html'])
+
+        data = self.client.get(data['next_url']).json()
+        self.assertEqual([video['id'] for video in data['videos']], [video.id for video in self.videos[4:]])
+        self.assertIsNone(data['next_cursor'])
+        self.assertIsNone(data['next_url'])
+
+        # Impression slots continue across pages
+        self.assertEqual([call.args[3] for call in log_impressions.call_args_list], [0, 4])
+
+    @mock.patch('core.views.log_impressions')
+    def test_feed_view_falls_back_to_for_you(self, log_impressions):
+        response = self.client.get(reverse('core:feed'), {'feed': 'bogus', 'page_size': 'many'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['is_personalized'])
+
+
+class PrecomputeTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        creator = self.create_user('creator')
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(3)]
+        self.users = [self.create_user(f'viewer{i}') for i in range(4)]
+        get_user_model().objects.filter(id__in=[user.id for user in self.users]).update(last_login=timezone.now())
+
+    def watermark(self, user, age):
+        RecommendationWatermark.objects.create(user=user, precomputed_at=timezone.now() - age)
+
+    def test_selects_users_with_new_activity(self):
+        fresh, active, expired, new = self.users
+        VideoView.objects.create(user=active, video=self.videos[0])
+        self.watermark(fresh, timedelta(0))
+        self.watermark(active, timedelta(minutes=5))
+        self.watermark(expired, timedelta(seconds=PRECOMPUTED_CACHE_TTL + 60))
+
+        self.assertEqual(sorted(get_users_to_precompute()), sorted([active.id, expired.id, new.id]))
+        self.assertEqual(len(get_users_to_precompute(full=True)), len(self.users))
+
+    def test_inactive_users_are_skipped(self):
+        get_user_model().objects.filter(id=self.users[0].id).update(last_login=timezone.now() - timedelta(days=60))
+
+        self.assertNotIn(self.users[0].id, get_users_to_precompute())
+
+    def test_shards_partition_users(self):
+        shards = [get_users_to_precompute(shard=(index, 3)) for index in range(3)]
+
+        self.assertEqual(sorted(sum(shards, [])), sorted(user.id for user in self.users))
+
+    def test_precompute_caches_lists_and_watermarks(self):
+        summary = precompute_recommendations()
+
+        self.assertEqual((summary['users'], summary['failed']), (len(self.users), 0))
+        for user in self.users:
+            self.assertEqual(len(get_cached_ranked_ids(user.id)), len(self.videos))
+        self.assertEqual(RecommendationWatermark.objects.count(), len(self.users))
+        self.assertEqual(precompute_recommendations()['users'], 0)
+
+    def test_precompute_never_caches_exploration_lists(self):
+        with mock.patch('core.recommender.random.random', return_value=0.0), \
+                mock.patch.object(ContextualBanditRecommender, 'get_exploration_videos', side_effect=AssertionError('explored')):
+            summary = precompute_recommendations()
+
+        self.assertEqual(summary['failed'], 0)
+
+
+class ImpressionLoggerTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('viewer')
+        creator = self.create_user('creator')
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(3)]
+
+    def test_ring_buffer_drops_the_oldest_impressions(self):
+        impression_logger = ImpressionLogger(flush_interval=3600, capacity=4)
+        impression_logger.record(self.user.id, [1, 2, 3], 'for_you')
+        impression_logger.record(None, [4, 5], 'trending', first_slot=24)
+
+        self.assertEqual(impression_logger.dropped, 1)
+        self.assertEqual([row[1:3] for row in impression_logger._buffer], [(2, 1), (3, 2), (4, 24), (5, 25)])
+
+    @mock.patch('core.impressions.get_bandit_buffer')
+    def test_write_skips_deleted_videos_and_counts_logged_in_impressions(self, get_bandit_buffer):
+        shown_at = timezone.now()
+        deleted_id = self.videos[2].id
+        self.videos[2].delete()
+
+        written = write_impressions([
+            (self.user.id, self.videos[0].id, 0, 'for_you', shown_at),
+            (self.user.id, deleted_id, 1, 'for_you', shown_at),
+            (None, self.videos[1].id, 0, 'trending', shown_at),
+            (self.user.id, self.videos[0].id, 0, 'related', shown_at),
+        ])
+
+        self.assertEqual(written, 3)
+        self.assertEqual(Impression.objects.count(), 3)
+        get_bandit_buffer.return_value.record_impressions.assert_called_once_with({self.videos[0].id: 2})
+
+
+class TrendingScoreTests(SimpleTestCase):
+    def test_scores_decay_with_age(self):
+        now = 100 * 3600.0
+        hours = np.array([now - 3600, now - 3600 - TRENDING_HALF_LIFE_HOURS * 3600, now - 3600])
+        ids, scores = compute_trending_scores(np.array([2, 1, 1]), hours, np.array([4.0, 8.0, 2.0]), now)
+
+        decay = 0.5 ** (0.5 / TRENDING_HALF_LIFE_HOURS)
+        self.assertEqual(ids.tolist(), [1, 2])
+        np.testing.assert_allclose(scores, [8.0 * 0.5 * decay + 2.0 * decay, 4.0 * decay])
+
+    def test_current_bucket_is_not_boosted(self):
+        now = 100 * 3600.0
+        _, scores = compute_trending_scores(np.array([1]), np.array([now]), np.array([3.0]), now)
+
+        np.testing.assert_allclose(scores, [3.0])
+
+
+class RefreshTrendingTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        creator = self.create_user('creator')
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(3)]
+        self.now = timezone.now()
+
+    def view(self, video, age, count=1):
+        for _ in range(count):
+            VideoView.objects.create(video=video, created_at=self.now - age)
+
+    def scores(self):
+        return dict(TrendingScore.objects.values_list('video_id', 'score'))
+
+    def test_recent_views_outscore_older_ones(self):
+        self.view(self.videos[0], timedelta(hours=1), count=3)
+        self.view(self.videos[1], timedelta(days=3), count=3)
+        self.view(self.videos[2], timedelta(days=8), count=5)
+
+        self.assertEqual(refresh_trending(self.now)['videos'], 2)
+        scores = self.scores()
+        self.assertEqual(set(scores), {self.videos[0].id, self.videos[1].id})
+        self.assertGreater(scores[self.videos[0].id], scores[self.videos[1].id])
+
+    def test_refresh_is_idempotent(self):
+        self.view(self.videos[0], timedelta(minutes=10), count=2)
+        self.view(self.videos[1], timedelta(hours=5))
+        refresh_trending(self.now)
+        buckets = sorted(VideoViewBucket.objects.values_list('video_id', 'hour', 'views'))
+
+        refresh_trending(self.now)
+        self.assertEqual(sorted(VideoViewBucket.objects.values_list('video_id', 'hour', 'views')), buckets)
+
+    def test_videos_leaving_the_window_lose_their_score(self):
+        self.view(self.videos[0], timedelta(hours=1))
+        refresh_trending(self.now)
+
+        refresh_trending(self.now + timedelta(days=8))
+        self.assertEqual(self.scores(), {})
+        self.assertFalse(VideoViewBucket.objects.exists())
+
+
+class ExplorationSamplerTests(SimpleTestCase):
+    def setUp(self):
+        self.sampler = ExplorationSampler()
+        self.sampler.rng = np.random.default_rng(0)
+        self.ids = np.arange(1, 1001, dtype=np.int64)
+
+    def test_samples_are_distinct_and_not_excluded(self):
+        exclude = set(range(1, 101))
+        chosen = self.sampler._sample_bucket(self.ids, 50, exclude)
+
+        self.assertEqual(len(chosen), 50)
+        self.assertEqual(len(set(chosen)), 50)
+        self.assertFalse(set(chosen) & exclude)
+
+    def test_mostly_excluded_bucket(self):
+        exclude = set(range(1, 996))
+        chosen = self.sampler._sample_bucket(self.ids, 10, exclude)
+
+        self.assertEqual(sorted(chosen), [996, 997, 998, 999, 1000])
+
+    def test_empty_requests(self):
+        self.assertEqual(self.sampler._sample_bucket(self.ids, 0, set()), [])
+        self.assertEqual(self.sampler._sample_bucket(np.zeros(0, dtype=np.int64), 5, set()), [])
+
+
+class ExplorationVideosTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('viewer')
+        creator = self.create_user('creator')
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(5)]
+        self.old_video = self.create_video(creator, 'Old video')
+        Video.objects.filter(id=self.old_video.id).update(created_at=timezone.now() - timedelta(days=90))
+        self.create_video(creator, 'Pending', moderation_status='pending')
+
+        self.sampler = ExplorationSampler()
+        self.sampler.build()
+        patcher = mock.patch('core.recommender.get_exploration_sampler', return_value=self.sampler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def explore(self, count=10):
+        return [video.id for video in ContextualBanditRecommender().get_exploration_videos(self.user, count)]
+
+    def test_recent_videos_come_first(self):
+        explored = self.explore()
+
+        self.assertEqual(sorted(explored[:5]), sorted(video.id for video in self.videos))
+        self.assertEqual(explored[5:], [self.old_video.id])
+
+    def test_watched_videos_are_excluded(self):
+        VideoView.objects.create(user=self.user, video=self.videos[0])
+
+        self.assertNotIn(self.videos[0].id, self.explore())
+
+    def test_rejected_videos_are_not_served(self):
+        # Moderated in another process, so this process's buckets still hold the video
+        Video.objects.filter(id=self.videos[1].id).update(moderation_status='rejected')
+
+        explored = self.explore()
+        self.assertNotIn(self.videos[1].id, explored)
+        self.assertEqual(len(explored), 5)
+
+
+class RelatedVideosTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        creator = self.create_user('creator')
+        other = self.create_user('other')
+        self.source = self.create_video(creator, 'Source')
+        self.shared = self.create_video(other, 'Shares tags')
+        self.sibling = self.create_video(creator, 'Same creator')
+        self.cowatched = self.create_video(other, 'Watched together')
+        self.unrelated = self.create_video(other, 'Unrelated')
+        self.pending = self.create_video(creator, 'Pending', moderation_status='pending')
+
+        for name in ('cooking', 'pasta'):
+            Tag.objects.create(name=name).videos.add(self.source, self.shared, self.pending)
+        Category.objects.create(name='Food', slug='food').videos.add(self.source, self.shared)
+
+        viewer = self.create_user('viewer')
+        for video in (self.source, self.cowatched):
+            VideoView.objects.create(user=viewer, video=video)
+        cowatch_model = ItemSimilarityModel()
+        cowatch_model.build()
+
+        # No embeddings: scores come from tags, categories, creators and co-watching only
+        for name, value in (('get_embedding_matrix', EmbeddingMatrix()), ('get_item_similarity_model', cowatch_model)):
+            patcher = mock.patch(f'core.related.{name}', return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_lists_rank_shared_signals(self):
+        related = compute_related_lists([self.source.id, self.pending.id])
+
+        self.assertEqual(list(related), [self.source.id])
+        self.assertEqual(related[self.source.id].tolist(), [self.cowatched.id, self.shared.id, self.sibling.id])
+
+    def test_build_stores_and_caches_lists(self):
+        self.assertEqual(build_related_lists()['written'], 5)
+
+        expected = [self.cowatched.id, self.shared.id, self.sibling.id]
+        self.assertEqual(get_related_video_ids(self.source.id).tolist(), expected)
+        cache.clear()
+        self.assertEqual(get_related_video_ids(self.source.id).tolist(), expected)
+        self.assertIsNone(get_related_video_ids(self.pending.id))
+
+    def test_lists_of_unpublished_videos_are_deleted(self):
+        build_related_lists()
+        Video.objects.filter(id=self.shared.id).update(is_published=False)
+
+        self.assertEqual(build_related_lists([self.shared.id])['deleted'], 1)
+        self.assertFalse(RelatedVideos.objects.filter(video=self.shared).exists())
+        self.assertIsNone(get_related_video_ids(self.shared.id))
+
+    def test_refresh_selects_missing_and_stale_lists(self):
+        self.assertIn(self.source.id, get_videos_to_refresh())
+
+        build_related_lists()
+        self.assertEqual(get_videos_to_refresh(), [])
+
+        mark_related_stale([self.sibling.id])
+        self.assertEqual(get_videos_to_refresh(), [self.sibling.id])
+
+    def test_sidebar_skips_rejected_videos_and_tops_up(self):
+        build_related_lists()
+        Video.objects.filter(id=self.cowatched.id).update(moderation_status='rejected')
+
+        related = [video.id for video in get_related_videos(self.source, num_videos=3)]
+        self.assertEqual(related[:2], [self.shared.id, self.sibling.id])
+        self.assertEqual(related[2], self.unrelated.id)
+
+
+class CovisitationTests(SimpleTestCase):
+    def pairs(self, views, counted_after=None):
+        visitors, timestamps, video_ids = (np.array(column) for column in zip(*views))
+        sources, targets, counts = covisit_pairs(visitors, timestamps, video_ids, counted_after)
+        return {(int(s), int(t)): float(c) for s, t, c in zip(sources, targets, counts)}
+
+    def test_later_views_are_weighted_by_lag(self):
+        pairs = self.pairs([(1, 0, 10), (1, 60, 11), (1, 120, 12)])
+
+        self.assertEqual(pairs, {(10, 11): 1.0, (11, 12): 1.0, (10, 12): 0.5})
+
+    def test_repeated_views_merge_into_one_run(self):
+        pairs = self.pairs([(1, 0, 10), (1, 30, 10), (1, 60, 11)])
+
+        self.assertEqual(pairs, {(10, 11): 1.0})
+
+    def test_visitors_and_window_separate_views(self):
+        window = COVISIT_WINDOW_MINUTES * 60
+        pairs = self.pairs([(1, 0, 10), (2, 10, 11), (1, window + 1, 12)])
+
+        self.assertEqual(pairs, {})
+
+    def test_counts_are_summed_across_visitors(self):
+        pairs = self.pairs([(1, 0, 10), (1, 60, 11), (2, 0, 10), (2, 60, 11)])
+
+        self.assertEqual(pairs, {(10, 11): 2.0})
+
+    def test_counted_after(self):
+        pairs = self.pairs([(1, 0, 10), (1, 60, 11), (1, 120, 12)], counted_after=90)
+
+        self.assertEqual(pairs, {(11, 12): 1.0, (10, 12): 0.5})
+
+
+class CovisitationModelTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        creator = self.create_user('creator')
+        self.viewer = self.create_user('viewer')
+        self.videos = [self.create_video(creator, f'Video {i}') for i in range(4)]
+        self.now = timezone.now()
+
+    def view(self, video, minutes_ago, user=None, session_id=None):
+        VideoView.objects.create(
+            video=self.videos[video], user=user, session_id=session_id,
+            created_at=self.now - timedelta(minutes=minutes_ago)
+        )
+
+    def built(self):
+        model = CovisitationModel()
+        model.build()
+        return model
+
+    def test_update_matches_a_full_rebuild(self):
+        self.view(0, 10, user=self.viewer)
+        self.view(1, 9, user=self.viewer)
+        self.view(0, 8, session_id='anonymous')
+        model = self.built()
+
+        VideoView.objects.create(video=self.videos[2], user=self.viewer)
+        VideoView.objects.create(video=self.videos[1], session_id='anonymous')
+        VideoView.objects.create(video=self.videos[3], session_id='other')
+
+        self.assertEqual(model.update(), 3)
+        rebuilt = self.built()
+        for video in self.videos:
+            self.assertEqual(model.neighbors(video.id).tolist(), rebuilt.neighbors(video.id).tolist())
+        self.assertEqual(model.neighbors(self.videos[0].id).tolist(), [self.videos[1].id, self.videos[2].id])
+
+    def test_up_next_skips_excluded_and_rejected_videos(self):
+        self.view(0, 10, user=self.viewer)
+        self.view(1, 9, user=self.viewer)
+        self.view(2, 8, user=self.viewer)
+        self.view(3, 7, user=self.viewer)
+
+        with mock.patch('core.covisitation.get_covisitation_model', return_value=self.built()):
+            self.assertEqual(get_up_next_video(self.videos[0]), self.videos[1])
+            self.assertEqual(get_up_next_video(self.videos[0], exclude=[self.videos[1].id]), self.videos[2])
+
+            Video.objects.filter(id=self.videos[1].id).update(moderation_status='rejected')
+            self.assertEqual(get_up_next_video(self.videos[0]), self.videos[2])
+
+    def test_up_next_falls_back_to_the_related_list(self):
+        with mock.patch('core.covisitation.get_covisitation_model', return_value=CovisitationModel()), \
+                mock.patch('core.related.get_related_video_ids', return_value=np.array([self.videos[0].id, self.videos[3].id])):
+            self.assertEqual(get_up_next_video(self.videos[0]), self.videos[3])
+
+
+class EmbeddingEncodingTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        vector = rng.standard_normal(384).astype(np.float32)
+        self.vector = vector / np.linalg.norm(vector)
+
+    def round_trip(self, encoding):
+        data, scale, offset = encode_vector(self.vector, encoding)
+        return decode_vector(data, encoding, len(self.vector), scale, offset)
+
+    def test_float32_is_exact(self):
+        decoded = self.round_trip('float32')
+
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_array_equal(decoded, self.vector)
+
+    def test_float16_is_close(self):
+        data, _, _ = encode_vector(self.vector, 'float16')
+        decoded = self.round_trip('float16')
+
+        self.assertEqual(len(data), 2 * len(self.vector))
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, self.vector, atol=1e-3)
+
+    def test_int8_is_within_half_a_step(self):
+        data, scale, _ = encode_vector(self.vector, 'int8')
+        decoded = self.round_trip('int8')
+
+        self.assertEqual(len(data), len(self.vector))
+        self.assertLessEqual(np.abs(decoded - self.vector).max(), scale / 2 + 1e-6)
+
+    def test_int8_constant_vector(self):
+        vector = np.full(8, 0.25, dtype=np.float32)
+        data, scale, offset = encode_vector(vector, 'int8')
+
+        np.testing.assert_allclose(decode_vector(data, 'int8', 8, scale, offset), vector)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            encode_vector(self.vector, 'float64')
+
+    def test_dimension_mismatch(self):
+        data, _, _ = encode_vector(self.vector, 'float32')
+
+        with self.assertRaises(EmbeddingDimensionError):
+            decode_vector(data, 'float32', 128)
+
+    def test_rows_without_recorded_dimension(self):
+        data, _, _ = encode_vector(self.vector, 'float32')
+
+        self.assertEqual(len(decode_vector(data, 'float32', 0)), len(self.vector))
+
+    def test_decode_rows_skips_other_models_and_dimensions(self):
+        data, scale, offset = encode_vector(self.vector, 'float16')
+        short, _, _ = encode_vector(self.vector[:8], 'float32')
+        rows = [
+            (1, data, 'float16', 384, scale, offset, 'test-model', 'kept'),
+            (2, data, 'float16', 384, scale, offset, '', 'legacy'),
+            (3, data, 'float16', 384, scale, offset, 'other-model', 'other'),
+            (4, data, 'float16', 128, scale, offset, 'test-model', 'corrupt'),
+            (5, short, 'float32', 8, 1.0, 0.0, 'test-model', 'short'),
+        ]
+
+        with self.assertLogs('core.embedding_store', 'WARNING'):
+            decoded = decode_rows(rows, model_name='test-model', dimension=384)
+        self.assertEqual([(key, extra) for key, _, extra in decoded], [(1, 'kept')])
+
+
+class ContentEmbeddingCleanupTests(RecommenderTestCase):
+    def setUp(self):
+        super().setUp()
+        self.creator = self.create_user('creator')
+        vectors = np.random.default_rng(0).standard_normal((2, EMBEDDING_DIMENSION)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        # A small built content index in place of the process-wide one
+        self.index = ANNIndex('content', use_faiss=False)
+        self.index.build([1], self.vectors[1:])
+        patcher = mock.patch.dict(ANNIndex._instances, {'content': self.index})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def embed(self, content_object, vector):
+        content_type = ContentType.objects.get_for_model(content_object)
+        ContentEmbedding.objects.create(
+            content_type=content_type, object_id=content_object.pk, **ContentEmbedding.encode_fields(vector)
+        )
+        return encode_content_id(content_type.id, content_object.pk)
+
+    def test_deleting_a_blog_removes_its_embedding_and_index_entry(self):
+        blog = Blog.objects.create(creator=self.creator, title='Blog', content='Blog content', slug='blog')
+        index_id = self.embed(blog, self.vectors[0])
+        self.assertEqual(self.index.search(self.vectors[0], 1)[0].tolist(), [index_id])
+
+        blog.delete()
+
+        self.assertFalse(ContentEmbedding.objects.exists())
+        self.assertNotIn(index_id, self.index.search(self.vectors[0], 2)[0].tolist())
+
+    def test_deleting_a_post_removes_its_embedding(self):
+        post = Post.objects.create(creator=self.creator, title='Post', content='Post content', slug='post', image='posts/post.jpg')
+        blog = Blog.objects.create(creator=self.creator, title='Kept', content='Kept content', slug='kept')
+        self.embed(post, self.vectors[0])
+        self.embed(blog, self.vectors[1])
+
+        post.delete()
+
+        self.assertEqual(list(ContentEmbedding.objects.values_list('object_id', flat=True)), [blog.pk])
+
+
+class EmbeddingQueueTests(TestCase):
+    def setUp(self):
+        self.content_type = ContentType.objects.get_for_model(Video)
+
+    def test_enqueue_keeps_one_job_per_object(self):
+        enqueue_embeddings(Video, [1, 2, 2])
+        enqueue_embeddings(Video, [2, 3])
+
+        self.assertEqual(
+            sorted(EmbeddingJob.objects.values_list('object_id', flat=True)),
+            [1, 2, 3]
+        )
+
+    def test_enqueue_without_requeue_leaves_jobs_alone(self):
+        enqueue_embeddings(Video, [1])
+        job = EmbeddingJob.objects.get()
+        EmbeddingJob.objects.update(attempts=2)
+
+        enqueue_embeddings(Video, [1], requeue=False)
+        self.assertEqual(EmbeddingJob.objects.get().attempts, 2)
+        self.assertEqual(EmbeddingJob.objects.get().enqueued_at, job.enqueued_at)
+
+        enqueue_embeddings(Video, [1])
+        self.assertEqual(EmbeddingJob.objects.get().attempts, 0)
+
+    def test_claimed_jobs_are_hidden_until_the_claim_expires(self):
+        enqueue_embeddings(Video, [1, 2, 3])
+
+        first = claim_jobs(limit=2)
+        self.assertEqual(len(first), 2)
+        second = claim_jobs()
+        self.assertEqual(len(second), 1)
+        self.assertFalse({job.pk for job in first} & {job.pk for job in second})
+        self.assertEqual(claim_jobs(), [])
+
+        EmbeddingJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_jobs()), 3)
+
+    def test_claim_sets_timeout(self):
+        enqueue_embeddings(Video, [1])
+        before = timezone.now()
+        claim_jobs()
+
+        locked_until = EmbeddingJob.objects.get().locked_until
+        self.assertGreaterEqual(locked_until, before + timedelta(seconds=CLAIM_TIMEOUT))
+
+    def test_finished_jobs_are_deleted(self):
+        enqueue_embeddings(Video, [1, 2])
+        _finish_jobs(claim_jobs())
+
+        self.assertFalse(EmbeddingJob.objects.exists())
+
+    def test_jobs_queued_again_while_claimed_are_kept(self):
+        enqueue_embeddings(Video, [1, 2])
+        jobs = claim_jobs()
+        EmbeddingJob.objects.filter(object_id=2).update(enqueued_at=timezone.now() + timedelta(seconds=1))
+
+        _finish_jobs(jobs)
+
+        job = EmbeddingJob.objects.get()
+        self.assertEqual(job.object_id, 2)
+        self.assertIsNone(job.locked_until)
+        self.assertEqual(len(claim_jobs()), 1)
+
+    def test_failed_jobs_are_retried_then_dropped(self):
+        enqueue_embeddings(Video, [1])
+
+        for attempt in range(1, MAX_ATTEMPTS):
+            jobs = claim_jobs()
+            self.assertEqual(len(jobs), 1)
+            _fail_jobs(jobs, 'boom')
+
+            job = EmbeddingJob.objects.get()
+            self.assertEqual((job.attempts, job.last_error), (attempt, 'boom'))
+            self.assertEqual(claim_jobs(), [])  # Backing off
+            EmbeddingJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        with self.assertLogs('core.embedding_queue', 'WARNING'):
+            _fail_jobs(claim_jobs(), 'boom')
+        self.assertFalse(EmbeddingJob.objects.exists())
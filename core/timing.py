@@ -0,0 +1,161 @@
+import contextvars
+import json
+import logging
+import time
+
+from django.db import connection
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+TIMING_HEADER = 'X-Rec-Timing'
+
+_active_trace = contextvars.ContextVar('recommendation_trace', default=None)
+_request_traces = contextvars.ContextVar('recommendation_request_traces', default=None)
+
+
+class TraceStage:
+    """Wall time, SQL queries, candidate counts and cache outcome of one pipeline stage"""
+
+    def __init__(self, name, candidates_in=None):
+        self.name = name
+        self.candidates_in = candidates_in
+        self.candidates_out = None
+        self.cache = None
+        self.ms = 0.0
+        self.queries = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook counting the stage's queries"""
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'ms': round(self.ms, 3),
+            'queries': self.queries,
+            'candidates_in': self.candidates_in,
+            'candidates_out': self.candidates_out,
+            'cache': self.cache,
+        }
+
+
+class RecommendationTrace:
+    """
+    Per-call breakdown of a recommendation request.
+
+    Used as a context manager around the call; stages are recorded with
+    `stage()`. On exit the trace is written as one structured log line and
+    attached to the current request (see RecommendationTimingMiddleware).
+    Query counting uses connection.execute_wrapper, so it works with DEBUG off.
+    """
+
+    def __init__(self, name, user_id=None):
+        self.name = name
+        self.user_id = user_id
+        self.stages = []
+        self.current = None
+        self.ms = 0.0
+        self.queries = 0
+        self._root = TraceStage(name)
+
+    def __enter__(self):
+        self._token = _active_trace.set(self)
+        self._wrapper = connection.execute_wrapper(self._root.count_query)
+        self._wrapper.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.ms = (time.perf_counter() - self._start) * 1000
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        self.queries = self._root.queries
+        _active_trace.reset(self._token)
+
+        logger.info(f"recommendation_timing {json.dumps(self.as_dict(), separators=(',', ':'))}")
+        traces = _request_traces.get()
+        if traces is not None:
+            traces.append(self)
+        return False
+
+    def stage(self, name, candidates_in=None):
+        """
+        Context manager timing one stage
+
+        Usage:
+            with trace.stage('personalized', len(candidate_ids)) as stage:
+                videos = ...
+                stage.candidates_out = len(videos)
+        """
+        return _StageTimer(self, TraceStage(name, candidates_in))
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'user_id': self.user_id,
+            'ms': round(self.ms, 3),
+            'queries': self.queries,
+            'stages': [stage.as_dict() for stage in self.stages],
+        }
+
+    def header_value(self):
+        """Server-Timing style summary: total, then one entry per stage"""
+        entries = [f"total;dur={self.ms:.1f};q={self.queries}"]
+        for stage in self.stages:
+            entry = f"{stage.name};dur={stage.ms:.1f};q={stage.queries}"
+            if stage.candidates_in is not None:
+                entry += f";in={stage.candidates_in}"
+            if stage.candidates_out is not None:
+                entry += f";out={stage.candidates_out}"
+            if stage.cache is not None:
+                entry += f";cache={stage.cache}"
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+class _StageTimer:
+    """Context manager behind RecommendationTrace.stage"""
+
+    def __init__(self, trace, stage):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.parent = self.trace.current
+        self.trace.current = self.stage
+        self.wrapper = connection.execute_wrapper(self.stage.count_query)
+        self.wrapper.__enter__()
+        self.start = time.perf_counter()
+        return self.stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stage.ms = (time.perf_counter() - self.start) * 1000
+        self.wrapper.__exit__(exc_type, exc_value, traceback)
+        self.trace.current = self.parent
+        self.trace.stages.append(self.stage)
+        return False
+
+
+def mark_cache(hit):
+    """Record a cache hit or miss on the stage that is currently running, if any"""
+    trace = _active_trace.get()
+    if trace is not None and trace.current is not None:
+        trace.current.cache = 'hit' if hit else 'miss'
+
+
+def collect_request_traces():
+    """
+    Start collecting the traces of the current request
+
+    Returns:
+        tuple: (list that finished traces are appended to, token for reset_request_traces)
+    """
+    traces = []
+    return traces, _request_traces.set(traces)
+
+
+def reset_request_traces(token):
+    """Stop collecting traces for the current request"""
+    _request_traces.reset(token)
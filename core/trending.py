@@ -0,0 +1,152 @@
+import logging
+from datetime import timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from videos.models import VideoView
+from core.models import VideoViewBucket, TrendingScore
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Constants
+TRENDING_HALF_LIFE_HOURS = 24  # A view counts half as much after this many hours
+TRENDING_WINDOW_DAYS = 7  # Views older than this no longer count towards trending
+UPSERT_BATCH_SIZE = 1000
+
+
+def hour_floor(moment):
+    """Start of the UTC hour containing `moment`"""
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def update_view_buckets(now=None):
+    """
+    Fold new views into hourly buckets
+
+    Recounts every hour from the latest existing bucket onwards (the first run
+    starts at the beginning of the trending window), so re-running is safe,
+    and drops buckets that fell out of the window.
+
+    Args:
+        now (datetime): Reference time, defaults to now
+
+    Returns:
+        int: Number of buckets written
+    """
+    now = now or timezone.now()
+    window_start = hour_floor(now - timedelta(days=TRENDING_WINDOW_DAYS))
+    latest_hour = VideoViewBucket.objects.aggregate(latest=Max('hour'))['latest']
+    start = max(latest_hour, window_start) if latest_hour else window_start
+
+    counts = (
+        VideoView.objects.filter(created_at__gte=start, created_at__lt=now)
+        .annotate(hour=TruncHour('created_at', tzinfo=dt_timezone.utc))
+        .values('video_id', 'hour')
+        .annotate(views=Count('id'))
+    )
+    buckets = [
+        VideoViewBucket(video_id=row['video_id'], hour=row['hour'], views=row['views'])
+        for row in counts
+    ]
+
+    with transaction.atomic():
+        VideoViewBucket.objects.bulk_create(
+            buckets,
+            update_conflicts=True,
+            unique_fields=['video', 'hour'],
+            update_fields=['views'],
+            batch_size=UPSERT_BATCH_SIZE
+        )
+        VideoViewBucket.objects.filter(hour__lt=window_start).delete()
+
+    return len(buckets)
+
+
+def compute_trending_scores(video_ids, hours, views, now):
+    """
+    Exponentially decayed view totals per video
+
+    Each bucket is aged from its midpoint, so a full hour of views just
+    before `now` counts with weight 0.5 ** (0.5 / TRENDING_HALF_LIFE_HOURS).
+
+    Args:
+        video_ids (numpy.ndarray): Video ID of each bucket
+        hours (numpy.ndarray): Bucket start times as epoch seconds
+        views (numpy.ndarray): Views in each bucket
+        now (float): Reference time as epoch seconds
+
+    Returns:
+        tuple: (unique video IDs, scores)
+    """
+    age_hours = np.maximum((now - hours) / 3600.0 - 0.5, 0.0)
+    weighted = views * 0.5 ** (age_hours / TRENDING_HALF_LIFE_HOURS)
+    unique_ids, inverse = np.unique(video_ids, return_inverse=True)
+    return unique_ids, np.bincount(inverse, weights=weighted)
+
+
+def refresh_trending(now=None):
+    """
+    Bring the view buckets and trending scores up to date
+
+    Only the buckets inside the trending window are read, so the cost tracks
+    the number of recently viewed videos rather than the catalogue size.
+    Videos without views in the window lose their score row.
+
+    Args:
+        now (datetime): Reference time, defaults to now
+
+    Returns:
+        dict: Number of buckets written and videos scored
+    """
+    now = now or timezone.now()
+    buckets_written = update_view_buckets(now)
+
+    window_start = hour_floor(now - timedelta(days=TRENDING_WINDOW_DAYS))
+    rows = list(VideoViewBucket.objects.filter(hour__gte=window_start).values_list('video_id', 'hour', 'views'))
+
+    scores = []
+    if rows:
+        video_ids, scored = compute_trending_scores(
+            np.array([video_id for video_id, _, _ in rows], dtype=np.int64),
+            np.array([hour.timestamp() for _, hour, _ in rows], dtype=np.float64),
+            np.array([views for _, _, views in rows], dtype=np.float64),
+            now.timestamp()
+        )
+        scores = [
+            TrendingScore(video_id=video_id, score=score, scored_at=now)
+            for video_id, score in zip(video_ids.tolist(), scored.tolist())
+        ]
+
+    with transaction.atomic():
+        TrendingScore.objects.bulk_create(
+            scores,
+            update_conflicts=True,
+            unique_fields=['video'],
+            update_fields=['score', 'scored_at'],
+            batch_size=UPSERT_BATCH_SIZE
+        )
+        TrendingScore.objects.filter(scored_at__lt=now).delete()
+
+    return {'buckets': buckets_written, 'videos': len(scores)}
+
+
+def get_trending_video_ids(limit, approved_only=True):
+    """
+    Top trending videos, read straight from the score index
+
+    Args:
+        limit (int): Maximum number of IDs
+        approved_only (bool): Whether to require moderation approval
+
+    Returns:
+        list: Video IDs, highest score first
+    """
+    scores = TrendingScore.objects.filter(video__is_published=True)
+    if approved_only:
+        scores = scores.filter(video__moderation_status='approved')
+    return list(scores.order_by('-score', '-video').values_list('video_id', flat=True)[:limit])
@@ -5,6 +5,7 @@ app_name = 'core'
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('feed/', views.feed, name='feed'),
     path('categories/', views.category_list, name='category_list'),
     path('category/<slug:slug>/', views.category_detail, name='category_detail'),
     path('search/', views.search, name='search'),
@@ -25,6 +26,9 @@ urlpatterns = [
     # Subscribed Channels
     path('subscribed/', views.subscribed_channels, name='subscribed_channels'),
     
+    # Recommendation timing breakdown (staff only)
+    path('debug/recommendations/<int:user_id>/', views.recommendation_debug, name='recommendation_debug'),
+    
     # Add report URL
     path('report/<str:content_type>/<int:object_id>/', views.report_content, name='report_content'),
 ] 
\ No newline at end of file
@@ -10,9 +10,13 @@ from django.core.paginator import Paginator
 from django.contrib.contenttypes.models import ContentType
 from django.contrib import messages
 from notifications.models import Notification
-from core.recommender import recommend_videos
+from core.feeds import get_feed_page, get_cursor_offset, FEED_TYPES, FEED_PAGE_SIZE
+from core.impressions import log_impressions
+from django.template.loader import render_to_string
+from django.urls import reverse
+from urllib.parse import urlencode
 import logging
-from .bert_utils import semantic_search
+from .embedding_service import semantic_search
 from django.contrib.auth import get_user_model
 
 logger = logging.getLogger(__name__)
@@ -21,55 +25,20 @@ def home(request):
     # Get the requested feed type (default to 'for_you')
     feed_type = request.GET.get('feed', 'for_you')
     
-    # Load videos based on feed type
-    if feed_type == 'trending':
-        # Show all trending videos, no limit
-        videos = Video.objects.filter(is_published=True).order_by('-views')
-        is_personalized = False
-    elif feed_type == 'latest':
-        # Show all latest videos, no limit
-        videos = Video.objects.filter(is_published=True).order_by('-created_at')
-        is_personalized = False
-    else:  # 'for_you' or default
-        # Get recommended videos based on user interests
-        if request.user.is_authenticated:
-            # Personalized recommendations for authenticated users
-            try:
-                # Get all videos, no limit
-                videos = recommend_videos(user_id=request.user.id, num_recommendations=9999)
-                is_personalized = True
-            except Exception as e:
-                logger.error(f"Error generating personalized recommendations: {e}")
-                # If recommendation engine fails, try to get videos from user's viewed categories
-                try:
-                    # Find categories from videos the user has watched
-                    user_views = VideoView.objects.filter(user=request.user).values_list('video', flat=True)
-                    watched_categories = Video.objects.filter(id__in=user_views).values_list('categories', flat=True).distinct()
-                    
-                    # Get videos from those categories, excluding ones already watched
-                    videos = Video.objects.filter(
-                        categories__in=watched_categories, 
-                        is_published=True
-                    ).exclude(
-                        id__in=user_views
-                    ).order_by('?')
-                    
-                    if not videos.exists():
-                        # If still no videos, get newest videos
-                        videos = Video.objects.filter(is_published=True).order_by('-created_at')
-                        is_personalized = False
-                    else:
-                        is_personalized = True
-                except Exception as inner_e:
-                    logger.error(f"Error finding category-based recommendations: {inner_e}")
-                    # Last resort - get newest videos
-                    videos = Video.objects.filter(is_published=True).order_by('-created_at')
-                    is_personalized = False
-        else:
-            # For anonymous users, use the recommendation engine without user_id
-            videos = recommend_videos(user_id=None, num_recommendations=9999)
-            # Mark as not personalized since it's based on general popularity
-            is_personalized = False
+    if feed_type not in FEED_TYPES:
+        feed_type = 'for_you'
+    
+    # Render only the first page; later pages are fetched from core:feed as the user scrolls
+    page_feed = feed_type
+    try:
+        videos, next_cursor, is_personalized = get_feed_page(feed_type, request.user)
+    except Exception as e:
+        logger.error(f"Error generating {feed_type} feed: {e}")
+        # If the recommendation engine fails, fall back to the newest videos
+        page_feed = 'latest'
+        videos, next_cursor, is_personalized = get_feed_page('latest')
+    
+    log_impressions(request.user, videos, page_feed)
     
     # Get user interest topics
     user_interest_topics = []
@@ -175,7 +144,57 @@ def home(request):
         'trending_topics': trending_topics,
         'recommended_channels': recommended_channels,
         'is_personalized': is_personalized,
-        'feed_type': feed_type
+        'feed_type': feed_type,
+        'page_feed': page_feed,
+        'next_cursor': next_cursor
+    })
+
+def feed(request):
+    """
+    Next page of a home feed for infinite scroll
+    
+    Returns the rendered video cards plus their basic fields as JSON, with the
+    URL of the following page (null on the last page).
+    """
+    feed_type = request.GET.get('feed', 'for_you')
+    if feed_type not in FEED_TYPES:
+        feed_type = 'for_you'
+    
+    try:
+        page_size = int(request.GET.get('page_size', FEED_PAGE_SIZE))
+    except ValueError:
+        page_size = FEED_PAGE_SIZE
+    
+    cursor = request.GET.get('cursor')
+    try:
+        videos, next_cursor, is_personalized = get_feed_page(feed_type, request.user, cursor, page_size)
+    except Exception as e:
+        logger.error(f"Error loading {feed_type} feed page: {e}")
+        return JsonResponse({'error': 'Could not load feed'}, status=500)
+    
+    log_impressions(request.user, videos, feed_type, get_cursor_offset(cursor, feed_type))
+    
+    next_url = None
+    if next_cursor:
+        next_url = f"{reverse('core:feed')}?{urlencode({'feed': feed_type, 'cursor': next_cursor, 'page_size': page_size})}"
+    
+    return JsonResponse({
+        'html': render_to_string('includes/video_feed_cards.html', {
+            'videos': videos,
+            'feed_type': feed_type
+        }, request=request),
+        'videos': [{
+            'id': video.id,
+            'title': video.title,
+            'url': reverse('videos:watch', args=[video.slug]),
+            'thumbnail': video.thumbnail.url if video.thumbnail else None,
+            'creator': video.creator.username,
+            'views': video.views,
+            'created_at': video.created_at.isoformat()
+        } for video in videos],
+        'next_cursor': next_cursor,
+        'next_url': next_url,
+        'is_personalized': is_personalized
     })
 
 def category_list(request):
@@ -595,6 +614,42 @@ def subscribed_channels(request):
         'latest_blogs': latest_blogs
     })
 
+@login_required
+def recommendation_debug(request, user_id):
+    """
+    Per-stage timing breakdown of recommend_for_user for one user (staff only)
+    
+    Pass ?fresh=1 to drop the user's cached ranked list first, so the full
+    pipeline runs instead of the cache read.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+    
+    from django.core.cache import cache
+    from core.recommender import ContextualBanditRecommender, ranked_cache_key
+    from core.timing import RecommendationTrace
+    from core.embedding_cache import get_embedding_lru
+    
+    try:
+        num_recommendations = min(int(request.GET.get('num', 20)), 100)
+    except ValueError:
+        num_recommendations = 20
+    exclude_watched = request.GET.get('exclude_watched', '1') != '0'
+    
+    if request.GET.get('fresh') == '1':
+        cache.delete(ranked_cache_key(user_id, exclude_watched))
+    
+    # No exploration, so the breakdown always covers the ranking pipeline
+    recommender = ContextualBanditRecommender(exploration_rate=0)
+    trace = RecommendationTrace('recommend_for_user', user_id)
+    videos = recommender.recommend_for_user(user_id, num_recommendations, exclude_watched, trace=trace)
+    
+    return JsonResponse({
+        'trace': trace.as_dict(),
+        'video_ids': [video.id for video in videos],
+        'embedding_cache': get_embedding_lru().stats(),
+    })
+
 @login_required
 def latest_videos(request):
     # Get all latest videos from all channels
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0002_alter_videoview_options_remove_videoview_viewed_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['-views', '-id'], name='video_views_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['-created_at', '-id'], name='video_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 21:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('videos', '0003_video_feed_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='videoview',
+            index=models.Index(fields=['created_at'], name='videoview_created_idx'),
+        ),
+    ]
@@ -74,6 +74,13 @@ class Video(models.Model):
     @property
     def comment_count(self):
         return self.comments.count()
+    
+    class Meta:
+        indexes = [
+            # Keyset pagination of the trending and latest feeds
+            models.Index(fields=['-views', '-id'], name='video_views_id_idx'),
+            models.Index(fields=['-created_at', '-id'], name='video_created_id_idx'),
+        ]
 
 class Playlist(models.Model):
     title = models.CharField(max_length=100)
@@ -123,6 +130,9 @@ class VideoView(models.Model):
     class Meta:
         verbose_name = 'Video View'
         verbose_name_plural = 'Video Views'
+        indexes = [
+            models.Index(fields=['created_at'], name='videoview_created_idx'),
+        ]
         
     @classmethod
     def record_view(cls, video, user=None, session_id=None, ip_address=None, 
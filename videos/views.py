@@ -212,50 +212,34 @@ def video_detail(request, slug):
         # Refresh the video from database to get updated view count
         video.refresh_from_db()
     
-    # Get related videos using recommendation engine
-    if request.user.is_authenticated:
-        try:
-            from core.recommender import recommend_videos
-            related_videos = recommend_videos(user_id=request.user.id, num_recommendations=6)
-        except Exception:
-            # Fallback to simple related videos
-            related_videos = Video.objects.filter(
-                is_published=True,
-                moderation_status='approved'
-            ).exclude(id=video.id).order_by('-created_at')[:6]
-    else:
-        # For anonymous users, just show similar videos by category/tags
-        try:
-            # Try to get videos with similar tags or categories
-            if hasattr(video, 'tags') and video.tags.exists():
-                tags = video.tags.all()
-                related_videos = Video.objects.filter(
-                    tags__in=tags,
-                    is_published=True
-                ).exclude(id=video.id).distinct()[:6]
-            elif hasattr(video, 'categories') and video.categories.exists():
-                categories = video.categories.all()
-                related_videos = Video.objects.filter(
-                    categories__in=categories,
-                    is_published=True
-                ).exclude(id=video.id).distinct()[:6]
-            else:
-                # Fallback to videos from same creator
-                related_videos = Video.objects.filter(
-                    creator=video.creator,
-                    is_published=True
-                ).exclude(id=video.id)[:6]
-                
-            # If still no related videos, just get recent popular ones
-            if not related_videos.exists():
-                related_videos = Video.objects.filter(
-                    is_published=True
-                ).exclude(id=video.id).order_by('-views')[:6]
-        except Exception:
-            # Final fallback
-            related_videos = Video.objects.filter(
-                is_published=True
-            ).exclude(id=video.id).order_by('-created_at')[:6]
+    # Get related videos from the video's precomputed list
+    try:
+        from core.related import get_related_videos
+        related_videos = get_related_videos(video, request.user, num_videos=6)
+    except Exception as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Error loading related videos: {e}")
+        # Fallback to simple related videos
+        related_videos = Video.objects.filter(
+            is_published=True,
+            moderation_status='approved'
+        ).exclude(id=video.id).order_by('-created_at')[:6]
+    
+    # Most common next video after this one
+    try:
+        from core.covisitation import get_up_next_video
+        up_next = get_up_next_video(video)
+    except Exception as e:
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.error(f"Error loading up next video: {e}")
+        up_next = None
+    
+    from core.impressions import log_impressions
+    log_impressions(request.user, related_videos, 'related')
+    if up_next:
+        log_impressions(request.user, [up_next], 'up_next')
     
     return render(request, 'videos/detail.html', {
         'video': video,
@@ -264,6 +248,7 @@ def video_detail(request, slug):
         'is_subscribed': is_subscribed,
         'comment_form': CommentForm(),
         'related_videos': related_videos,
+        'up_next': up_next,
         'is_recommendation': is_recommendation,
         'rec_source': request.GET.get('rec_source', '')
     })
@@ -717,6 +702,23 @@ def playlist_player(request, pk):
         next_items = playlist_items.filter(order__gt=current_item.order).order_by('order')
         next_item = next_items.first() if next_items.exists() else None
     
+    # At the end of the playlist, autoplay what people most often watch next
+    up_next = None
+    if current_item and next_item is None:
+        try:
+            from core.covisitation import get_up_next_video
+            from core.impressions import log_impressions
+            up_next = get_up_next_video(
+                current_item.video,
+                exclude=playlist_items.values_list('video_id', flat=True)
+            )
+            if up_next:
+                log_impressions(request.user, [up_next], 'up_next')
+        except Exception as e:
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.error(f"Error loading up next video: {e}")
+    
     # Check if current video is liked
     is_liked = False
     is_subscribed = False
@@ -743,6 +745,7 @@ def playlist_player(request, pk):
         'current_video': current_video,
         'video': current_video,
         'next_item': next_item,
+        'up_next': up_next,
         'is_liked': is_liked,
         'is_subscribed': is_subscribed,
         'comments': comments,
@@ -837,9 +840,13 @@ def update_watch_time(request):
             
             if view:
                 # Update existing view with new watch time
+                previous_watch_time = view.view_time
+                watched_seconds = max(watch_time - view.view_time, 0)
                 view.view_time = max(view.view_time, watch_time)  # Use max to prevent decreasing
                 view.save()
             else:
+                previous_watch_time = 0
+                watched_seconds = watch_time
                 # Create a new view record if none found
                 VideoView.record_view(
                     video=video,
@@ -852,16 +859,28 @@ def update_watch_time(request):
                     is_recommendation='rec_source' in request.GET
                 )
             
+            # Fold the newly watched minutes into the user's preference embedding
+            if watched_seconds > 0:
+                try:
+                    from core.nlp import apply_user_interaction, WATCH_MINUTE_WEIGHT
+                    apply_user_interaction(request.user.id, video.id, watched_seconds / 60 * WATCH_MINUTE_WEIGHT)
+                except Exception as e:
+                    import logging
+                    logger = logging.getLogger(__name__)
+                    logger.error(f"Error updating user embedding: {e}")
+            
             # Update recommendation stats if this was a recommendation
-            if 'rec_source' in request.GET:
+            if 'rec_source' in request.GET and watched_seconds > 0:
                 try:
                     from core.recommender import ContextualBanditRecommender
                     recommender = ContextualBanditRecommender()
+                    # The click was recorded when the watch page was opened;
+                    # only the newly watched time is added here
                     recommender.update_stats(
                         video_id=video.id,
                         user_id=request.user.id,
-                        clicked=True,
-                        watch_time=watch_time
+                        watch_time=watch_time,
+                        previous_watch_time=previous_watch_time
                     )
                 except Exception as e:
                     import logging